@@ -129,11 +129,13 @@ class LatticeIceStormToolchain:
         cwd = os.getcwd()
         os.chdir(build_dir)
 
+        # keep the module for hierarchical conversion
+        module = fragment
         if not isinstance(fragment, _Fragment):
             fragment = fragment.get_fragment()
         platform.finalize(fragment)
 
-        v_output = platform.get_verilog(fragment, name=build_name, **kwargs)
+        v_output = platform.get_verilog(module, name=build_name, **kwargs)
         named_sc, named_pc = platform.resolve_signals(v_output.ns)
         v_file = build_name + ".v"
         v_output.write(v_file)
@@ -158,11 +158,13 @@ class LatticeTrellisToolchain:
         os.chdir(build_dir)
 
         # generate verilog
+        # keep the module for hierarchical conversion
+        module = fragment
         if not isinstance(fragment, _Fragment):
             fragment = fragment.get_fragment()
         platform.finalize(fragment)
 
-        top_output = platform.get_verilog(fragment, name=build_name, **kwargs)
+        top_output = platform.get_verilog(module, name=build_name, **kwargs)
         named_sc, named_pc = platform.resolve_signals(top_output.ns)
         top_file = build_name + ".v"
         top_output.write(top_file)
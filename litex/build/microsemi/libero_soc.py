@@ -237,12 +237,14 @@ class MicrosemiLiberoSoCPolarfireToolchain:
         os.chdir(build_dir)
 
         # finalize design
+        # keep the module for hierarchical conversion
+        module = fragment
         if not isinstance(fragment, _Fragment):
             fragment = fragment.get_fragment()
         platform.finalize(fragment)
 
         # generate top module
-        top_output = platform.get_verilog(fragment, name=build_name, **kwargs)
+        top_output = platform.get_verilog(module, name=build_name, **kwargs)
         named_sc, named_pc = platform.resolve_signals(top_output.ns)
         top_file = build_name + ".v"
         top_output.write(top_file)
@@ -178,6 +178,8 @@ class XilinxISEToolchain:
 
     def build(self, platform, fragment, build_dir="build", build_name="top",
             toolchain_path=None, source=True, run=True, mode="xst", **kwargs):
+        # keep the module for hierarchical conversion
+        module = fragment
         if not isinstance(fragment, _Fragment):
             fragment = fragment.get_fragment()
         if toolchain_path is None:
@@ -197,7 +199,7 @@ class XilinxISEToolchain:
         os.chdir(build_dir)
         try:
             if mode in ("xst", "yosys", "cpld"):
-                v_output = platform.get_verilog(fragment, name=build_name, **kwargs)
+                v_output = platform.get_verilog(module, name=build_name, **kwargs)
                 vns = v_output.ns
                 named_sc, named_pc = platform.resolve_signals(vns)
                 v_file = build_name + ".v"
@@ -11,13 +11,20 @@
 
 # License: BSD
 
+import os
+import re
+import json
+import hashlib
 from functools import partial
 from operator import itemgetter
-import collections
+import collections.abc
 
 from migen.fhdl.structure import *
 from migen.fhdl.structure import _Operator, _Slice, _Assign, _Fragment
 from migen.fhdl.tools import *
+from migen.fhdl.tools import _apply_lowerer, _BasicLowerer, _ComplexSliceLowerer
+from migen.fhdl.visit import NodeVisitor
+from migen.util.misc import flat_iteration
 from migen.fhdl.namer import build_namespace
 from migen.fhdl.conv_output import ConvOutput
 
@@ -130,10 +137,20 @@ def _printexpr(ns, node):
 (_AT_BLOCKING, _AT_NONBLOCKING, _AT_SIGNAL) = range(3)
 
 
-def _printnode(ns, at, level, node, target_filter=None):
-    if target_filter is not None and target_filter not in list_targets(node):
-        return ""
-    elif isinstance(node, _Assign):
+def _emitnode(r, ns, at, level, node, target_filter=None, node_targets=None):
+    # with target_filter, only the statements driving it are emitted. node_targets gives the targets
+    # of the If/Case nodes (see _FragmentAnalysis), they are listed on the fly without it.
+    if target_filter is not None:
+        if isinstance(node, (If, Case)):
+            targets = list_targets(node) if node_targets is None else node_targets[id(node)]
+            if target_filter not in targets:
+                return
+        elif isinstance(node, _Assign):
+            if target_filter not in list_targets(node):
+                return
+        elif not isinstance(node, collections.abc.Iterable):
+            return
+    if isinstance(node, _Assign):
         if at == _AT_BLOCKING:
             assignment = " = "
         elif at == _AT_NONBLOCKING:
@@ -142,34 +159,31 @@ def _printnode(ns, at, level, node, target_filter=None):
             assignment = " = "
         else:
             assignment = " <= "
-        return "\t"*level + _printexpr(ns, node.l)[0] + assignment + _printexpr(ns, node.r)[0] + ";\n"
-    elif isinstance(node, collections.Iterable):
-        return "".join(_printnode(ns, at, level, n, target_filter) for n in node)
+        r.append("\t"*level + _printexpr(ns, node.l)[0] + assignment + _printexpr(ns, node.r)[0] + ";\n")
+    elif isinstance(node, collections.abc.Iterable):
+        for n in node:
+            _emitnode(r, ns, at, level, n, target_filter, node_targets)
     elif isinstance(node, If):
-        r = "\t"*level + "if (" + _printexpr(ns, node.cond)[0] + ") begin\n"
-        r += _printnode(ns, at, level + 1, node.t, target_filter)
+        r.append("\t"*level + "if (" + _printexpr(ns, node.cond)[0] + ") begin\n")
+        _emitnode(r, ns, at, level + 1, node.t, target_filter, node_targets)
         if node.f:
-            r += "\t"*level + "end else begin\n"
-            r += _printnode(ns, at, level + 1, node.f, target_filter)
-        r += "\t"*level + "end\n"
-        return r
+            r.append("\t"*level + "end else begin\n")
+            _emitnode(r, ns, at, level + 1, node.f, target_filter, node_targets)
+        r.append("\t"*level + "end\n")
     elif isinstance(node, Case):
         if node.cases:
-            r = "\t"*level + "case (" + _printexpr(ns, node.test)[0] + ")\n"
+            r.append("\t"*level + "case (" + _printexpr(ns, node.test)[0] + ")\n")
             css = [(k, v) for k, v in node.cases.items() if isinstance(k, Constant)]
             css = sorted(css, key=lambda x: x[0].value)
             for choice, statements in css:
-                r += "\t"*(level + 1) + _printexpr(ns, choice)[0] + ": begin\n"
-                r += _printnode(ns, at, level + 2, statements, target_filter)
-                r += "\t"*(level + 1) + "end\n"
+                r.append("\t"*(level + 1) + _printexpr(ns, choice)[0] + ": begin\n")
+                _emitnode(r, ns, at, level + 2, statements, target_filter, node_targets)
+                r.append("\t"*(level + 1) + "end\n")
             if "default" in node.cases:
-                r += "\t"*(level + 1) + "default: begin\n"
-                r += _printnode(ns, at, level + 2, node.cases["default"], target_filter)
-                r += "\t"*(level + 1) + "end\n"
-            r += "\t"*level + "endcase\n"
-            return r
-        else:
-            return ""
+                r.append("\t"*(level + 1) + "default: begin\n")
+                _emitnode(r, ns, at, level + 2, node.cases["default"], target_filter, node_targets)
+                r.append("\t"*(level + 1) + "end\n")
+            r.append("\t"*level + "endcase\n")
     elif isinstance(node, Display):
         s = "\"" + node.s + "\""
         for arg in node.args:
@@ -178,20 +192,121 @@ def _printnode(ns, at, level, node, target_filter=None):
                 s += ns.get_name(arg)
             else:
                 s += str(arg)
-        return "\t"*level + "$display(" + s + ");\n"
+        r.append("\t"*level + "$display(" + s + ");\n")
     elif isinstance(node, Finish):
-        return "\t"*level + "$finish;\n"
+        r.append("\t"*level + "$finish;\n")
     else:
         raise TypeError("Node of unrecognized type: "+str(type(node)))
 
 
-def _list_comb_wires(f):
-    r = set()
-    groups = group_by_targets(f.comb)
-    for g in groups:
-        if len(g[1]) == 1 and isinstance(g[1][0], _Assign):
-            r |= g[0]
-    return r
+def _printnode(ns, at, level, node, target_filter=None, node_targets=None):
+    r = []
+    _emitnode(r, ns, at, level, node, target_filter, node_targets)
+    return "".join(r)
+
+
+class _FragmentAnalysis(NodeVisitor):
+    """Signals and targets of a lowered fragment, gathered in a single pass
+
+    Shared by the header and combinatorial printers, which would otherwise walk the fragment
+    again for each of list_signals, list_targets and group_by_targets.
+
+    - signals: signals used by the fragment and its specials
+    - targets: signals driven by the fragment and its specials
+    - inouts: inouts of the specials
+    - wires: signals driven by a single assignment or by specials
+    - statements: flattened combinatorial statements
+    - statement_targets: targets of each combinatorial statement
+    - target_statements: combinatorial statements driving each target
+    - node_targets: targets of each If/Case node of the combinatorial statements, by id
+    - groups: combinatorial statements grouped as by group_by_targets
+    """
+    def __init__(self, f):
+        self.signals = set()
+        self.targets = set()
+        self.node_targets = dict()
+        self.target_context = False
+        self.record = True
+        self.stack = []
+
+        self.statements = list(flat_iteration(f.comb))
+        self.statement_targets = []
+        self.target_statements = dict()
+        for statement in self.statements:
+            targets = set()
+            self.stack = [targets]
+            self.visit(statement)
+            self.statement_targets.append(targets)
+            for t in targets:
+                self.target_statements.setdefault(t, []).append(statement)
+            self.targets |= targets
+        self.record = False
+        self.stack = [self.targets]
+        self.visit(f.sync)
+
+        special_outs = list_special_ios(f, False, True, True)
+        self.signals |= list_special_ios(f, True, True, True)
+        self.targets |= special_outs
+        self.inouts = list_special_ios(f, False, False, True)
+
+        self.groups = self._group()
+        self.wires = set(special_outs)
+        for targets, statements in self.groups:
+            if len(statements) == 1 and isinstance(statements[0], _Assign):
+                self.wires |= targets
+
+    def _group(self):
+        # same groups, in the same order, as group_by_targets, which scans all the previous groups
+        # for each statement driving an already driven signal.
+        groups = dict()  # order of the last statement of the group -> (targets, statements)
+        owners = dict()  # target -> key of its group
+        for order, (statement, targets) in enumerate(zip(self.statements, self.statement_targets)):
+            group = [(order, statement)]
+            targets = set(targets)
+            for key in sorted({owners[t] for t in targets if t in owners}):
+                old_targets, old_group = groups.pop(key)
+                targets |= old_targets
+                group += old_group
+            for t in targets:
+                owners[t] = order
+            groups[order] = targets, group
+        return [(targets, [statement for _, statement in sorted(group, key=itemgetter(0))])
+            for targets, group in groups.values()]
+
+    def visit_Signal(self, node):
+        self.signals.add(node)
+        if self.target_context:
+            for targets in self.stack:
+                targets.add(node)
+
+    def visit_Assign(self, node):
+        self.target_context = True
+        self.visit(node.l)
+        self.target_context = False
+        self.visit(node.r)
+
+    def visit_ArrayProxy(self, node):
+        for choice in node.choices:
+            self.visit(choice)
+        target_context, self.target_context = self.target_context, False
+        self.visit(node.key)
+        self.target_context = target_context
+
+    def _visit_node(self, node, visit):
+        if self.record:
+            targets = self.node_targets[id(node)] = set()
+            self.stack.append(targets)
+            visit(self, node)
+            self.stack.pop()
+        else:
+            visit(self, node)
+
+    def visit_If(self, node):
+        self._visit_node(node, NodeVisitor.visit_If)
+
+    def visit_Case(self, node):
+        self._visit_node(node, NodeVisitor.visit_Case)
+
 
 def _printattr(attr, attr_translate):
     r = ""
@@ -221,56 +336,66 @@ def _printattr(attr, attr_translate):
 
 
 def _printheader(f, ios, name, ns, attr_translate,
-                 reg_initialization):
-    sigs = list_signals(f) | list_special_ios(f, True, True, True)
-    special_outs = list_special_ios(f, False, True, True)
-    inouts = list_special_ios(f, False, False, True)
-    targets = list_targets(f) | special_outs
-    wires = _list_comb_wires(f) | special_outs
-    r = "module " + name + "(\n"
-    firstp = True
+                 reg_initialization, analysis=None):
+    if analysis is None:
+        analysis = _FragmentAnalysis(f)
+    sigs = analysis.signals
+    inouts = analysis.inouts
+    targets = analysis.targets
+    wires = analysis.wires
+    r = ["module " + name + "(\n"]
+    ports = []
     for sig in sorted(ios, key=lambda x: x.duid):
-        if not firstp:
-            r += ",\n"
-        firstp = False
+        p = ""
         attr = _printattr(sig.attr, attr_translate)
         if attr:
-            r += "\t" + attr
+            p += "\t" + attr
         sig.type = "wire"
         if sig in inouts:
             sig.direction = "inout"
-            r += "\tinout " + _printsig(ns, sig)
+            p += "\tinout " + _printsig(ns, sig)
         elif sig in targets:
             sig.direction = "output"
             if sig in wires:
-                r += "\toutput " + _printsig(ns, sig)
+                p += "\toutput " + _printsig(ns, sig)
             else:
                 sig.type = "reg"
-                r += "\toutput reg " + _printsig(ns, sig)
+                p += "\toutput reg " + _printsig(ns, sig)
         else:
             sig.direction = "input"
-            r += "\tinput " + _printsig(ns, sig)
-    r += "\n);\n\n"
+            p += "\tinput " + _printsig(ns, sig)
+        ports.append(p)
+    r.append(",\n".join(ports))
+    r.append("\n);\n\n")
     for sig in sorted(sigs - ios, key=lambda x: x.duid):
-        attr = _printattr(sig.attr, attr_translate)
-        if attr:
-            r += attr + " "
-        if sig in wires:
-            r += "wire " + _printsig(ns, sig) + ";\n"
+        r.append(_printdeclaration(ns, sig, sig in wires, reg_initialization, attr_translate))
+    r.append("\n")
+    return "".join(r)
+
+
+def _printdeclaration(ns, sig, wire, reg_initialization, attr_translate):
+    r = ""
+    attr = _printattr(sig.attr, attr_translate)
+    if attr:
+        r += attr + " "
+    if wire:
+        r += "wire " + _printsig(ns, sig) + ";\n"
+    else:
+        if reg_initialization:
+            r += "reg " + _printsig(ns, sig) + " = " + _printexpr(ns, sig.reset)[0] + ";\n"
         else:
-            if reg_initialization:
-                r += "reg " + _printsig(ns, sig) + " = " + _printexpr(ns, sig.reset)[0] + ";\n"
-            else:
-                r += "reg " + _printsig(ns, sig) + ";\n"
-    r += "\n"
+            r += "reg " + _printsig(ns, sig) + ";\n"
     return r
 
 
 def _printcomb_simulation(f, ns,
             display_run,
             dummy_signal,
-            blocking_assign):
-    r = ""
+            blocking_assign,
+            analysis=None):
+    if analysis is None:
+        analysis = _FragmentAnalysis(f)
+    r = []
     if f.comb:
         if dummy_signal:
             # Generate a dummy event to get the simulator
@@ -278,113 +403,98 @@ def _printcomb_simulation(f, ns,
             syn_off = "// synthesis translate_off\n"
             syn_on = "// synthesis translate_on\n"
             dummy_s = Signal(name_override="dummy_s")
-            r += syn_off
-            r += "reg " + _printsig(ns, dummy_s) + ";\n"
-            r += "initial " + ns.get_name(dummy_s) + " <= 1'd0;\n"
-            r += syn_on
-
-
-        from collections import defaultdict
+            r.append(syn_off)
+            r.append("reg " + _printsig(ns, dummy_s) + ";\n")
+            r.append("initial " + ns.get_name(dummy_s) + " <= 1'd0;\n")
+            r.append(syn_on)
 
-        target_stmt_map = defaultdict(list)
-
-        for statement in flat_iteration(f.comb):
-            targets = list_targets(statement)
-            for t in targets:
-                target_stmt_map[t].append(statement)
-
-        groups = group_by_targets(f.comb)
-
-        for n, (t, stmts) in enumerate(target_stmt_map.items()):
+        for n, (t, stmts) in enumerate(analysis.target_statements.items()):
             assert isinstance(t, Signal)
             if len(stmts) == 1 and isinstance(stmts[0], _Assign):
-                r += "assign " + _printnode(ns, _AT_BLOCKING, 0, stmts[0])
+                r.append("assign ")
+                _emitnode(r, ns, _AT_BLOCKING, 0, stmts[0])
             else:
                 if dummy_signal:
                     dummy_d = Signal(name_override="dummy_d")
-                    r += "\n" + syn_off
-                    r += "reg " + _printsig(ns, dummy_d) + ";\n"
-                    r += syn_on
+                    r.append("\n" + syn_off)
+                    r.append("reg " + _printsig(ns, dummy_d) + ";\n")
+                    r.append(syn_on)
 
-                r += "always @(*) begin\n"
+                r.append("always @(*) begin\n")
                 if display_run:
-                    r += "\t$display(\"Running comb block #" + str(n) + "\");\n"
+                    r.append("\t$display(\"Running comb block #" + str(n) + "\");\n")
                 if blocking_assign:
-                    r += "\t" + ns.get_name(t) + " = " + _printexpr(ns, t.reset)[0] + ";\n"
-                    r += _printnode(ns, _AT_BLOCKING, 1, stmts, t)
+                    r.append("\t" + ns.get_name(t) + " = " + _printexpr(ns, t.reset)[0] + ";\n")
+                    _emitnode(r, ns, _AT_BLOCKING, 1, stmts, t, analysis.node_targets)
                 else:
-                    r += "\t" + ns.get_name(t) + " <= " + _printexpr(ns, t.reset)[0] + ";\n"
-                    r += _printnode(ns, _AT_NONBLOCKING, 1, stmts, t)
+                    r.append("\t" + ns.get_name(t) + " <= " + _printexpr(ns, t.reset)[0] + ";\n")
+                    _emitnode(r, ns, _AT_NONBLOCKING, 1, stmts, t, analysis.node_targets)
                 if dummy_signal:
-                    r += syn_off
-                    r += "\t" + ns.get_name(dummy_d) + " = " + ns.get_name(dummy_s) + ";\n"
-                    r += syn_on
-                r += "end\n"
-    r += "\n"
-    return r
-
-
-def _printcomb_regular(f, ns, blocking_assign):
-    r = ""
+                    r.append(syn_off)
+                    r.append("\t" + ns.get_name(dummy_d) + " = " + ns.get_name(dummy_s) + ";\n")
+                    r.append(syn_on)
+                r.append("end\n")
+    r.append("\n")
+    return "".join(r)
+
+
+def _printcomb_regular(f, ns, blocking_assign, analysis=None):
+    if analysis is None:
+        analysis = _FragmentAnalysis(f)
+    r = []
     if f.comb:
-        groups = group_by_targets(f.comb)
-
-        for n, g in enumerate(groups):
+        for n, g in enumerate(analysis.groups):
             if len(g[1]) == 1 and isinstance(g[1][0], _Assign):
-                r += "assign " + _printnode(ns, _AT_BLOCKING, 0, g[1][0])
+                r.append("assign ")
+                _emitnode(r, ns, _AT_BLOCKING, 0, g[1][0])
             else:
-                r += "always @(*) begin\n"
+                r.append("always @(*) begin\n")
                 if blocking_assign:
                     for t in g[0]:
-                        r += "\t" + ns.get_name(t) + " = " + _printexpr(ns, t.reset)[0] + ";\n"
-                    r += _printnode(ns, _AT_BLOCKING, 1, g[1])
+                        r.append("\t" + ns.get_name(t) + " = " + _printexpr(ns, t.reset)[0] + ";\n")
+                    _emitnode(r, ns, _AT_BLOCKING, 1, g[1])
                 else:
                     for t in g[0]:
-                        r += "\t" + ns.get_name(t) + " <= " + _printexpr(ns, t.reset)[0] + ";\n"
-                    r += _printnode(ns, _AT_NONBLOCKING, 1, g[1])
-                r += "end\n"
-    r += "\n"
-    return r
+                        r.append("\t" + ns.get_name(t) + " <= " + _printexpr(ns, t.reset)[0] + ";\n")
+                    _emitnode(r, ns, _AT_NONBLOCKING, 1, g[1])
+                r.append("end\n")
+    r.append("\n")
+    return "".join(r)
 
 
 def _printsync(f, ns):
-    r = ""
+    r = []
     for k, v in sorted(f.sync.items(), key=itemgetter(0)):
-        r += "always @(posedge " + ns.get_name(f.clock_domains[k].clk) + ") begin\n"
-        r += _printnode(ns, _AT_SIGNAL, 1, v)
-        r += "end\n\n"
-    return r
+        r.append("always @(posedge " + ns.get_name(f.clock_domains[k].clk) + ") begin\n")
+        _emitnode(r, ns, _AT_SIGNAL, 1, v)
+        r.append("end\n\n")
+    return "".join(r)
 
 
 def _printspecials(overrides, specials, ns, add_data_file, attr_translate):
-    r = ""
+    r = []
     for special in sorted(specials, key=lambda x: x.duid):
         if hasattr(special, "attr"):
             attr = _printattr(special.attr, attr_translate)
             if attr:
-                r += attr + " "
+                r.append(attr + " ")
         pr = call_special_classmethod(overrides, special, "emit_verilog", ns, add_data_file)
         if pr is None:
             raise NotImplementedError("Special " + str(special) + " failed to implement emit_verilog")
-        r += pr
-    return r
+        r.append(pr)
+    return "".join(r)
 
 
-def convert(f, ios=None, name="top",
-  special_overrides=dict(),
-  attr_translate={},
-  create_clock_domains=True,
-  display_run=False,
-  reg_initialization=True,
-  dummy_signal=True,
-  blocking_assign=False,
-  regular_comb=True):
-    r = ConvOutput()
-    if not isinstance(f, _Fragment):
-        f = f.get_fragment()
-    if ios is None:
-        ios = set()
+def _get_fragment(f):
+    if isinstance(f, _Fragment):
+        return f
+    # modules already finalized by the build flow
+    if f.get_fragment_called:
+        return f._fragment
+    return f.get_fragment()
 
+
+def _create_clock_domains(f, ios, create_clock_domains):
     for cd_name in sorted(list_clock_domains(f)):
         try:
             f.clock_domains[cd_name]
@@ -399,38 +509,444 @@ def convert(f, ios=None, name="top",
                     print(f.name)
                 raise KeyError("Unresolved clock domain: '"+cd_name+"'")
 
+
+def _lower(f, special_overrides):
     f = lower_complex_slices(f)
     insert_resets(f)
     f = lower_basics(f)
     f, lowered_specials = lower_specials(special_overrides, f)
     f = lower_basics(f)
+    return f, lowered_specials
+
 
+def _name_ios(ios):
     for io in sorted(ios, key=lambda x: x.duid):
         if io.name_override is None:
             io_name = io.backtrace[-1][0]
             if io_name:
                 io.name_override = io_name
-    ns = build_namespace(list_signals(f) \
-        | list_special_ios(f, True, True, True) \
-        | ios, _reserved_keywords)
-    ns.clock_domains = f.clock_domains
-    r.ns = ns
 
-    src = generated_banner("//")
-    src += _printheader(f, ios, name, ns, attr_translate,
-                        reg_initialization=reg_initialization)
+
+# Hierarchical conversion --------------------------------------------------------------------------
+
+class _Lowerers:
+    """Lowerers shared by all the levels of a hierarchical conversion
+
+    The tracer indexes the objects creating signals by scanning all the instances of their class:
+    creating new lowerers for each level would make the conversion quadratic in the number of levels.
+    """
+    def __init__(self):
+        self.slices = _ComplexSliceLowerer()
+        self.basics = _BasicLowerer(None)
+
+    def _apply(self, lowerer, f):
+        # lowering specials leaves the lowerer in the context of their last expression
+        lowerer.target_context = False
+        lowerer.extra_stmts = []
+        lowerer.comb = []
+        return _apply_lowerer(lowerer, f)
+
+    def lower(self, f, special_overrides):
+        f = self._apply(self.slices, f)
+        insert_resets(f)
+        self.basics.clock_domains = f.clock_domains
+        f = self._apply(self.basics, f)
+        f, lowered_specials = lower_specials(special_overrides, f)
+        self.basics.clock_domains = f.clock_domains
+        f = self._apply(self.basics, f)
+        return f, lowered_specials
+
+
+class _Level:
+    """A level of the module hierarchy, emitted as its own Verilog module"""
+    def __init__(self, name, parent, index):
+        self.name = name
+        self.parent = parent
+        self.index = index  # preorder index
+        self.last = index   # preorder index of the last level of the subtree
+        self.children = []
+        self.fragment = None
+        self.analysis = None
+        self.ports = dict()
+        self.declared = set()
+        self.definition = None
+        self.names = dict()
+
+    def contains(self, level):
+        return self.index <= level.index <= self.last
+
+    def path(self):
+        if self.parent is None:
+            return []
+        return self.parent.path() + [self.name]
+
+
+def _common_ancestor(a, b):
+    while not a.contains(b):
+        a = a.parent
+    return a
+
+
+def _split_hierarchy(module, f):
+    # statements of renamed clock domains keep their original domain name in submodule fragments,
+    # the top-level fragment gives the final one.
+    domains = {id(s): cd for cd, statements in f.sync.items() for s in statements}
+    levels = []
+
+    def split(module, fragment, name, parent):
+        level = _Level(name, parent, len(levels))
+        levels.append(level)
+        sub_comb = set()
+        sub_sync = set()
+        sub_specials = set()
+        names = set()
+        for sub_name, submodule in module._submodules:
+            sub_fragment = submodule._fragment
+            sub_comb.update(map(id, sub_fragment.comb))
+            for statements in sub_fragment.sync.values():
+                sub_sync.update(map(id, statements))
+            sub_specials |= sub_fragment.specials
+            if sub_name is None:
+                sub_name = submodule.__class__.__name__.lower()
+            unique_name = sub_name
+            n = 1
+            while unique_name in names:
+                unique_name = sub_name + "_" + str(n)
+                n += 1
+            names.add(unique_name)
+            level.children.append(split(submodule, sub_fragment, unique_name, level))
+        sync = collections.defaultdict(list)
+        for cd, statements in fragment.sync.items():
+            for s in statements:
+                if id(s) not in sub_sync:
+                    sync[domains.get(id(s), cd)].append(s)
+        level.fragment = _Fragment(
+            [s for s in fragment.comb if id(s) not in sub_comb],
+            dict(sync),
+            fragment.specials - sub_specials,
+            f.clock_domains)
+        level.last = len(levels) - 1
+        return level
+
+    split(module, f, None, None)
+    return levels
+
+
+def _list_drivers(f):
+    return list_targets(f) | list_special_ios(f, False, True, False)
+
+
+def _move_drivers(src, dst, signal):
+    # Migen lets several modules drive the same signal, Verilog only allows it from a single one:
+    # move everything driving the signal to the common ancestor.
+    comb = []
+    for targets, statements in group_by_targets(src.fragment.comb):
+        if signal in targets:
+            dst.fragment.comb += statements
+        else:
+            comb += statements
+    src.fragment.comb = comb
+    for cd, statements in list(src.fragment.sync.items()):
+        if signal in list_targets(statements):
+            dst.fragment.sync.setdefault(cd, []).extend(statements)
+            del src.fragment.sync[cd]
+    for special in sorted(src.fragment.specials, key=lambda x: x.duid):
+        if signal in list_special_ios(_Fragment(specials={special}), False, True, False):
+            dst.fragment.specials.add(special)
+            src.fragment.specials.remove(special)
+    for cd in src.fragment.clock_domains:
+        if cd not in dst.fragment.clock_domains:
+            dst.fragment.clock_domains.append(cd)
+
+
+def _resolve_drivers(levels):
+    while True:
+        drivers = collections.defaultdict(list)
+        for level in levels:
+            for sig in _list_drivers(level.fragment):
+                drivers[sig].append(level)
+        conflicts = [(sig, l) for sig, l in drivers.items() if len(l) > 1]
+        if not conflicts:
+            return {sig: l[0] for sig, l in drivers.items()}
+        for sig, l in sorted(conflicts, key=lambda x: x[0].duid):
+            ancestor = l[0]
+            for level in l[1:]:
+                ancestor = _common_ancestor(ancestor, level)
+            for level in l:
+                if level is not ancestor:
+                    _move_drivers(level, ancestor, sig)
+
+
+def _analyze_hierarchy(levels, ios, drivers):
+    # a signal is declared in the common ancestor of all the levels using it, and is a port of all
+    # the levels between that ancestor and its users.
+    users = collections.defaultdict(list)
+    for sig in ios:
+        users[sig].append(levels[0])
+    inouts = set()
+    for level in levels:
+        f = level.fragment
+        level.analysis = _FragmentAnalysis(f)
+        inouts |= level.analysis.inouts
+        used = level.analysis.signals | {f.clock_domains[cd].clk for cd in f.sync}
+        for sig in used:
+            users[sig].append(level)
+    for sig, l in users.items():
+        home = l[0]
+        for level in l[1:]:
+            home = _common_ancestor(home, level)
+        home.declared.add(sig)
+        driver = drivers.get(sig)
+        for level in l:
+            while level is not home and sig not in level.ports:
+                if sig in inouts:
+                    level.ports[sig] = "inout"
+                elif driver is not None and level.contains(driver):
+                    level.ports[sig] = "output"
+                else:
+                    level.ports[sig] = "input"
+                level = level.parent
+    return inouts
+
+
+class _PlaceholderNamespace:
+    """Numbers signals in order of appearance
+
+    The text printed with this namespace identifies the structure of a level independently of the
+    names of its signals: it is the key of the definition cache, names are substituted afterwards.
+    """
+    def __init__(self, clock_domains):
+        self.clock_domains = clock_domains
+        self.signals = []
+        self.indexes = dict()
+
+    def get_name(self, sig):
+        if isinstance(sig, ClockSignal):
+            sig = self.clock_domains[sig.cd].clk
+        if isinstance(sig, ResetSignal):
+            sig = self.clock_domains[sig.cd].rst
+        try:
+            index = self.indexes[sig]
+        except KeyError:
+            index = self.indexes[sig] = len(self.signals)
+            self.signals.append(sig)
+        return "\0" + str(index) + "\0"
+
+
+_placeholder = re.compile("\0(\\d+)\0")
+
+
+class _HierarchicalNamespace:
+    """Names of the signals of a hierarchical conversion
+
+    Signals declared below the top-level module are given with the path of their instance,
+    separated by ``/``.
+    """
+    def __init__(self, levels, clock_domains):
+        self.clock_domains = clock_domains
+        self.names = dict()
+        for level in levels:
+            prefix = "".join(name + "/" for name in level.path())
+            for sig in level.declared:
+                self.names[sig] = prefix + level.names[sig]
+
+    def get_name(self, sig):
+        if isinstance(sig, ClockSignal):
+            sig = self.clock_domains[sig.cd].clk
+        if isinstance(sig, ResetSignal):
+            sig = self.clock_domains[sig.cd].rst
+        return self.names[sig]
+
+
+def _printlevel(level, ns, definition, ios, drivers, inouts, special_overrides, add_data_file,
+                attr_translate, reg_initialization, printcomb):
+    f = level.fragment
+    top = level.parent is None
+    r = ["module " + definition + "(\n"]
+    ports = []
+    for sig in sorted(level.ports if not top else ios, key=lambda x: x.duid):
+        reg = drivers.get(sig) is level and sig not in level.analysis.wires
+        p = ""
+        attr = _printattr(sig.attr, attr_translate)
+        if attr:
+            p += "\t" + attr
+        if top:
+            sig.type = "reg" if reg else "wire"
+            if sig in inouts:
+                sig.direction = "inout"
+            elif sig in drivers:
+                sig.direction = "output"
+            else:
+                sig.direction = "input"
+            direction = sig.direction
+        else:
+            direction = level.ports[sig]
+        if direction == "output" and reg:
+            p += "\toutput reg " + _printsig(ns, sig)
+            if reg_initialization and not top:
+                p += " = " + _printexpr(ns, sig.reset)[0]
+        else:
+            p += "\t" + direction + " " + _printsig(ns, sig)
+        ports.append(p)
+    r.append(",\n".join(ports))
+    r.append("\n);\n\n")
+    for sig in sorted(level.declared - set(level.ports) - ios, key=lambda x: x.duid):
+        driver = drivers.get(sig)
+        wire = (driver is not None and driver is not level) or sig in level.analysis.wires or sig in inouts
+        r.append(_printdeclaration(ns, sig, wire, reg_initialization, attr_translate))
+    r.append("\n")
+    r.append(printcomb(f, ns, analysis=level.analysis))
+    r.append(_printsync(f, ns))
+    r.append(_printspecials(special_overrides, f.specials, ns, add_data_file, attr_translate))
+    for child in level.children:
+        connections = ",\n".join("\t." + child.names[sig] + "(" + ns.get_name(sig) + ")"
+            for sig in sorted(child.ports, key=lambda x: x.duid))
+        r.append(child.definition + " " + child.name + "(\n" + connections + "\n);\n\n")
+    r.append("endmodule\n")
+    return "".join(r)
+
+
+def _name_level(signals, reserved, name_cache_dir, key):
+    # names are cached by printed text and naming hints of the signals, only the namer is skipped.
+    names = None
+    if name_cache_dir is not None:
+        hints = [(obj.name_override, [name for name, _ in getattr(obj, "backtrace", [])])
+            for obj in signals]
+        key = hashlib.sha1((key + repr(hints)).encode()).hexdigest()
+        filename = os.path.join(name_cache_dir, key + ".json")
+        if os.path.exists(filename):
+            with open(filename) as f:
+                names = json.load(f)
+    if names is None:
+        # specials (memories, instances) are named after their name_override
+        ns = build_namespace([obj for obj in signals if isinstance(obj, Signal)],
+            _reserved_keywords | reserved)
+        names = [ns.get_name(obj) for obj in signals]
+        if name_cache_dir is not None:
+            with open(filename, "w") as f:
+                json.dump(names, f)
+    return names
+
+
+def _convert_hierarchical(r, module, f, ios, name, special_overrides, attr_translate,
+                          reg_initialization, printcomb, name_cache_dir):
+    levels = _split_hierarchy(module, f)
+    lowerers = _Lowerers()
+    for level in levels:
+        level.fragment, _ = lowerers.lower(level.fragment, special_overrides)
+    drivers = _resolve_drivers(levels)
+    inouts = _analyze_hierarchy(levels, ios, drivers)
+    if name_cache_dir is not None:
+        os.makedirs(name_cache_dir, exist_ok=True)
+
+    def definition_name(level):
+        if level.parent is None:
+            return name
+        base = "_".join([name] + level.path())
+        definition = base
+        n = 1
+        while definition in used_definitions:
+            definition = base + "_" + str(n)
+            n += 1
+        used_definitions.add(definition)
+        return definition
+
+    # levels are emitted bottom-up, identical levels share a single definition.
+    definitions = dict()
+    used_definitions = {name}
+    sources = []
+    for level in reversed(levels):
+        top = level.parent is None
+        reserved = {child.name for child in level.children}
+        data_files = []
+        def add_data_file(filename_base, content):
+            data_files.append((filename_base, content))
+            return "\2" + str(len(data_files) - 1) + "\2"
+
+        ns = _PlaceholderNamespace(level.fragment.clock_domains)
+        src = _printlevel(level, ns, "\1", ios, drivers, inouts, special_overrides,
+            add_data_file, attr_translate, reg_initialization, printcomb)
+        key = hashlib.sha1("".join([src] + [content for _, content in data_files]).encode())
+        key = key.hexdigest()
+        if not top and key in definitions:
+            level.definition, names = definitions[key]
+        else:
+            names = _name_level(ns.signals, reserved, name_cache_dir, key)
+            level.definition = definition_name(level)
+            definitions[key] = level.definition, names
+            rename = lambda m: names[int(m.group(1))]
+            src = _placeholder.sub(rename, src)
+            for i, (filename_base, content) in enumerate(data_files):
+                filename = r.add_data_file(_placeholder.sub(rename, filename_base), content)
+                src = src.replace("\2" + str(i) + "\2", filename)
+            sources.append(src.replace("\1", level.definition))
+        level.names = dict(zip(ns.signals, names))
+
+    ns = _HierarchicalNamespace(levels, f.clock_domains)
+    return ns, sources
+
+
+def convert(f, ios=None, name="top",
+  special_overrides=dict(),
+  attr_translate={},
+  create_clock_domains=True,
+  display_run=False,
+  reg_initialization=True,
+  dummy_signal=True,
+  blocking_assign=False,
+  regular_comb=True,
+  hierarchical=False,
+  name_cache_dir=None):
+    """Convert a fragment or module to Verilog
+
+    With ``hierarchical``, ``f`` must be a module: each of its submodules is emitted as a separate
+    Verilog module instead of being flattened into the top-level one, in a single source.
+    Submodules with identical contents share a single definition. With ``name_cache_dir``, the
+    signal names given by the namer to each definition are cached on disk across conversions;
+    every level is still lowered and printed.
+    """
+    r = ConvOutput()
+    module = f
+    f = _get_fragment(f)
+    if ios is None:
+        ios = set()
+
+    _create_clock_domains(f, ios, create_clock_domains)
+    _name_ios(ios)
+
     if regular_comb:
-        src += _printcomb_regular(f, ns,
-                      blocking_assign=blocking_assign)
+        printcomb = partial(_printcomb_regular,
+            blocking_assign=blocking_assign)
     else:
-        src += _printcomb_simulation(f, ns,
-                      display_run=display_run,
-                      dummy_signal=dummy_signal,
-                      blocking_assign=blocking_assign)
-    src += _printsync(f, ns)
-    src += _printspecials(special_overrides, f.specials - lowered_specials,
-        ns, r.add_data_file, attr_translate)
-    src += "endmodule\n"
-    r.set_main_source(src)
+        printcomb = partial(_printcomb_simulation,
+            display_run=display_run,
+            dummy_signal=dummy_signal,
+            blocking_assign=blocking_assign)
+
+    if hierarchical:
+        if module is f:
+            raise TypeError("Hierarchical conversion requires a module")
+        ns, sources = _convert_hierarchical(r, module, f, ios, name, special_overrides,
+            attr_translate, reg_initialization, printcomb, name_cache_dir)
+        r.ns = ns
+        r.set_main_source(generated_banner("//") + "\n".join(sources))
+        return r
+
+    f, lowered_specials = _lower(f, special_overrides)
+    analysis = _FragmentAnalysis(f)
+
+    ns = build_namespace(analysis.signals | ios, _reserved_keywords)
+    ns.clock_domains = f.clock_domains
+    r.ns = ns
+
+    src = [generated_banner("//")]
+    src.append(_printheader(f, ios, name, ns, attr_translate,
+                            reg_initialization=reg_initialization, analysis=analysis))
+    src.append(printcomb(f, ns, analysis=analysis))
+    src.append(_printsync(f, ns))
+    src.append(_printspecials(special_overrides, f.specials - lowered_specials,
+        ns, r.add_data_file, attr_translate))
+    src.append("endmodule\n")
+    r.set_main_source("".join(src))
 
     return r
@@ -0,0 +1,275 @@
+# License: BSD
+
+import collections.abc
+from itertools import count
+
+from migen.fhdl.structure import *
+from migen.fhdl.structure import (_Operator, _Slice, _ArrayProxy, _Assign)
+from migen.fhdl.specials import _MemoryLocation
+from migen.fhdl.bitcontainer import value_bits_sign
+
+from litex.gen.sim.memory import _MemoryWrite
+
+
+_binops = {
+    "+": "+",
+    "-": "-",
+    "*": "*",
+
+    ">>>": ">>",
+    "<<<": "<<",
+
+    "&": "&",
+    "^": "^",
+    "|": "|",
+
+    "<": "<",
+    "<=": "<=",
+    "==": "==",
+    "!=": "!=",
+    ">": ">",
+    ">=": ">=",
+}
+
+# Above this nesting depth, expressions are handed to the interpreter instead of being inlined:
+# deeply nested generated code hits the limits of the Python parser.
+_max_depth = 48
+
+# Case statements with more choices than this are dispatched through a dict instead of if/elif.
+_max_case_chain = 8
+
+
+def _mask(nbits):
+    return 2**nbits - 1
+
+
+class StatementCompiler:
+    """Lower Migen statements to Python functions
+
+    The generated functions operate directly on the slot-indexed storage of a
+    ``CompiledEvaluator``: ``v`` holds the current values, ``n`` the next
+    values and ``pa`` records the slots written since the last commit.
+    Memory locations index the storage of the evaluator's ``MemoryState``
+    objects. Constructs that have no compiled form (``Display``, ...) are
+    delegated to the evaluator's interpreter.
+    """
+    def __init__(self, evaluator):
+        self.evaluator = evaluator
+        self.namespace = {
+            "v":  evaluator.values,
+            "n":  evaluator.next,
+            "pa": evaluator.pending.append,
+            "ev": evaluator,
+        }
+        self.counter = count()
+
+    def _name(self, prefix):
+        return "{}{}".format(prefix, next(self.counter))
+
+    def _constant(self, obj):
+        name = self._name("_k")
+        self.namespace[name] = obj
+        return name
+
+    def _define(self, name, lines):
+        src = "def {}(v=v, n=n, pa=pa):\n".format(name)
+        src += "\n".join("    " + line for line in lines or ["pass"]) + "\n"
+        exec(compile(src, "<litex.gen.sim:{}>".format(name), "exec"), self.namespace)
+        return self.namespace[name]
+
+    # Expressions ----------------------------------------------------------------------------------
+
+    def expr(self, node, postcommit=False, depth=0):
+        if depth > _max_depth:
+            return "ev.eval({}, {})".format(self._constant(node), postcommit)
+        depth += 1
+        if isinstance(node, Constant):
+            return repr(node.value)
+        elif isinstance(node, Signal):
+            return "{}[{}]".format("n" if postcommit else "v", self.evaluator.slot(node))
+        elif isinstance(node, _Operator):
+            operands = [self.expr(o, postcommit, depth) for o in node.operands]
+            if node.op == "-" and len(operands) == 1:
+                return "(-{})".format(*operands)
+            elif node.op == "~":
+                return "(~{})".format(*operands)
+            elif node.op == "m":
+                return "({1} if {0} else {2})".format(*operands)
+            else:
+                return "({} {} {})".format(operands[0], _binops[node.op], operands[1])
+        elif isinstance(node, _Slice):
+            v = self.expr(node.value, postcommit, depth)
+            return "(({} >> {}) & {})".format(v, node.start, _mask(node.stop - node.start))
+        elif isinstance(node, Cat):
+            shift = 0
+            terms = []
+            for element in node.l:
+                nbits = len(element)
+                term = "({} & {})".format(self.expr(element, postcommit, depth), _mask(nbits))
+                if shift:
+                    term = "({} << {})".format(term, shift)
+                terms.append(term)
+                shift += nbits
+            if not terms:
+                return "0"
+            return "(" + " | ".join(terms) + ")"
+        elif isinstance(node, Replicate):
+            nbits = len(node.v)
+            factor = sum(1 << i*nbits for i in range(node.n))
+            return "(({} & {}) * {})".format(self.expr(node.v, postcommit, depth), _mask(nbits), factor)
+        elif isinstance(node, _ArrayProxy):
+            key = "min({}, {})".format(len(node.choices) - 1, self.expr(node.key, postcommit, depth))
+            if all(isinstance(c, Signal) for c in node.choices):
+                slots = tuple(self.evaluator.slot(c) for c in node.choices)
+                return "{}[{}[{}]]".format("n" if postcommit else "v", self._constant(slots), key)
+            else:
+                choices = ", ".join("lambda: " + self.expr(c, postcommit, depth)
+                                    for c in node.choices)
+                choices = eval("(" + choices + ",)", self.namespace)
+                return "{}[{}]()".format(self._constant(choices), key)
+        elif isinstance(node, _MemoryLocation) and not postcommit:
+            state = self.evaluator.memory(node.memory)
+            return "{}[min({}, {})]".format(self._constant(state.storage),
+                state.depth - 1, self.expr(node.index, postcommit, depth))
+        else:
+            return "ev.eval({}, {})".format(self._constant(node), postcommit)
+
+    # Assignments ----------------------------------------------------------------------------------
+
+    def assign(self, node, value, lines):
+        if isinstance(node, Signal) and not node.variable:
+            slot = self.evaluator.slot(node)
+            if node.signed:
+                t = self._name("t")
+                lines.append("{} = {} & {}".format(t, value, _mask(node.nbits)))
+                lines.append("n[{}] = {} - (({} & {}) << 1)".format(slot, t, t, 2**(node.nbits - 1)))
+            else:
+                lines.append("n[{}] = {} & {}".format(slot, value, _mask(node.nbits)))
+            lines.append("pa({})".format(slot))
+        elif isinstance(node, Cat):
+            t = self._name("t")
+            lines.append("{} = {}".format(t, value))
+            shift = 0
+            for element in node.l:
+                nbits = len(element)
+                self.assign(element, "(({} >> {}) & {})".format(t, shift, _mask(nbits)), lines)
+                shift += nbits
+        elif isinstance(node, _Slice):
+            t = self._name("t")
+            clear = ~(_mask(node.stop) - _mask(node.start))
+            lines.append("{} = ({} & {}) | (({} & {}) << {})".format(
+                t, self.expr(node.value, True), clear,
+                value, _mask(node.stop - node.start), node.start))
+            self.assign(node.value, t, lines)
+        elif isinstance(node, _ArrayProxy):
+            t = self._name("t")
+            lines.append("{} = {}".format(t, value))
+            key = "min({}, {})".format(len(node.choices) - 1, self.expr(node.key))
+            if (all(isinstance(c, Signal) and not c.variable and not c.signed for c in node.choices)
+                    and len(set(c.nbits for c in node.choices)) == 1):
+                slots = tuple(self.evaluator.slot(c) for c in node.choices)
+                j = self._name("t")
+                lines.append("{} = {}[{}]".format(j, self._constant(slots), key))
+                lines.append("n[{}] = {} & {}".format(j, t, _mask(node.choices[0].nbits)))
+                lines.append("pa({})".format(j))
+            else:
+                writers = []
+                for choice in node.choices:
+                    body = []
+                    self.assign(choice, "x", body)
+                    name = self._name("_w")
+                    src = "def {}(x, v=v, n=n, pa=pa):\n".format(name)
+                    src += "\n".join("    " + line for line in body) + "\n"
+                    exec(compile(src, "<litex.gen.sim:{}>".format(name), "exec"), self.namespace)
+                    writers.append(self.namespace[name])
+                lines.append("{}[{}]({})".format(self._constant(tuple(writers)), key, t))
+        elif isinstance(node, _MemoryLocation):
+            state = self.evaluator.memory(node.memory)
+            lines.append("{}({}, {})".format(self._constant(state.write), self.expr(node.index), value))
+        else:
+            lines.append("ev.assign({}, {})".format(self._constant(node), value))
+
+    # Statements -----------------------------------------------------------------------------------
+
+    def statements(self, statements, lines, indent=""):
+        for s in statements:
+            if isinstance(s, _Assign):
+                body = []
+                self.assign(s.l, self.expr(s.r), body)
+                lines += [indent + line for line in body]
+            elif isinstance(s, If):
+                keyword = "if"
+                while True:
+                    lines.append("{}{} {} & {}:".format(indent, keyword,
+                        self.expr(s.cond), _mask(len(s.cond))))
+                    self.block(s.t, lines, indent + "    ")
+                    # flatten Elif chains
+                    if len(s.f) == 1 and isinstance(s.f[0], If):
+                        s = s.f[0]
+                        keyword = "elif"
+                    else:
+                        break
+                if s.f:
+                    lines.append(indent + "else:")
+                    self.block(s.f, lines, indent + "    ")
+            elif isinstance(s, Case):
+                self.case(s, lines, indent)
+            elif isinstance(s, _MemoryWrite):
+                state = self.evaluator.memory(s.memory)
+                lines.append("{}{}({}, {}, {})".format(indent, self._constant(state.write),
+                    self.expr(s.adr), self.expr(s.dat_w), s.mask))
+            elif isinstance(s, collections.abc.Iterable):
+                self.statements(s, lines, indent)
+            else:
+                lines.append("{}ev.execute([{}])".format(indent, self._constant(s)))
+
+    def block(self, statements, lines, indent):
+        n = len(lines)
+        self.statements(statements, lines, indent)
+        if len(lines) == n:
+            lines.append(indent + "pass")
+
+    def case(self, s, lines, indent):
+        nbits, signed = value_bits_sign(s.test)
+        t = self._name("t")
+        lines.append("{}{} = {} & {}".format(indent, t, self.expr(s.test), _mask(nbits)))
+        if signed:
+            lines.append("{}{} -= ({} & {}) << 1".format(indent, t, t, 2**(nbits - 1)))
+        # first matching choice wins, as in the interpreter
+        choices = collections.OrderedDict()
+        for k, v in s.cases.items():
+            if isinstance(k, Constant):
+                choices.setdefault(k.value, v)
+        default = s.cases.get("default")
+
+        if len(choices) <= _max_case_chain:
+            keyword = "if"
+            for value, body in choices.items():
+                lines.append("{}{} {} == {}:".format(indent, keyword, t, value))
+                self.block(body, lines, indent + "    ")
+                keyword = "elif"
+            if default is not None:
+                if choices:
+                    lines.append(indent + "else:")
+                    self.block(default, lines, indent + "    ")
+                else:
+                    self.statements(default, lines, indent)
+        else:
+            def function(body):
+                body_lines = []
+                self.statements(body, body_lines)
+                return self._define(self._name("_c"), body_lines)
+            dispatch = {value: function(body) for value, body in choices.items()}
+            if default is not None:
+                lines.append("{}{}.get({}, {})()".format(indent,
+                    self._constant(dispatch), t, self._constant(function(default))))
+            else:
+                f = self._name("t")
+                lines.append("{}{} = {}.get({})".format(indent, f, self._constant(dispatch), t))
+                lines.append("{}if {} is not None:".format(indent, f))
+                lines.append("{}    {}()".format(indent, f))
+
+    def compile(self, statements):
+        lines = []
+        self.statements(statements, lines)
+        return self._define(self._name("_f"), lines)
@@ -9,7 +9,11 @@
 
 import operator
 import collections
+import collections.abc
 import inspect
+import heapq
+import warnings
+import time
 from functools import wraps
 
 from migen.fhdl.structure import *
@@ -17,26 +21,36 @@ from migen.fhdl.structure import (_Value, _Statement,
                                   _Operator, _Slice, _ArrayProxy,
                                   _Assign, _Fragment)
 from migen.fhdl.bitcontainer import value_bits_sign
-from migen.fhdl.tools import (list_targets, list_signals,
+from migen.fhdl.tools import (list_targets, list_signals, group_by_targets,
                               insert_resets, lower_specials)
-from migen.fhdl.simplify import MemoryToArray
-from migen.fhdl.specials import _MemoryLocation
+from migen.fhdl.visit import NodeVisitor
+from migen.fhdl.namer import build_namespace
+from migen.fhdl.specials import Memory, _MemoryLocation
 from migen.fhdl.module import Module
 from migen.genlib.resetsync import AsyncResetSynchronizer
 
-from litex.gen.sim.vcd import VCDWriter, DummyVCDWriter
+from litex.gen.sim.vcd import StreamingVCDWriter, DummyVCDWriter
+from litex.gen.sim.lxw import LXWWriter
+from litex.gen.sim.memory import MemoryState, _MemoryWrite, lower_memories
+from litex.gen.sim.compiler import StatementCompiler
 
 
 class ClockState:
-    def __init__(self, high, half_period, time_before_trans):
+    def __init__(self, high, half_period):
         self.high = high
         self.half_period = half_period
-        self.time_before_trans = time_before_trans
 
 
 class TimeManager:
+    """Clock edge scheduler
+
+    The next transition of each clock is kept in a priority queue, so that
+    advancing time only touches the clocks that toggle.
+    """
     def __init__(self, description):
         self.clocks = collections.OrderedDict()
+        self.transitions = []
+        self.t = 0
 
         for k, period_phase in description.items():
             if isinstance(period_phase, tuple):
@@ -50,22 +64,24 @@ class TimeManager:
                 high = True
             else:
                 high = False
-            self.clocks[k] = ClockState(high, half_period, half_period - phase)
+            self.clocks[k] = ClockState(high, half_period)
+            heapq.heappush(self.transitions, (half_period - phase, k))
 
     def tick(self):
-        rising = set()
-        falling = set()
-        dt = min(cs.time_before_trans for cs in self.clocks.values())
-        for k, cs in self.clocks.items():
-            if cs.time_before_trans == dt:
-                cs.high = not cs.high
-                if cs.high:
-                    rising.add(k)
-                else:
-                    falling.add(k)
-            cs.time_before_trans -= dt
-            if not cs.time_before_trans:
-                cs.time_before_trans += cs.half_period
+        rising = []
+        falling = []
+        t = self.transitions[0][0]
+        while self.transitions and self.transitions[0][0] == t:
+            _, k = heapq.heappop(self.transitions)
+            cs = self.clocks[k]
+            cs.high = not cs.high
+            if cs.high:
+                rising.append(k)
+            else:
+                falling.append(k)
+            heapq.heappush(self.transitions, (t + cs.half_period, k))
+        dt = t - self.t
+        self.t = t
         return dt, rising, falling
 
 
@@ -98,20 +114,102 @@ def _truncate(value, nbits, signed):
     return value
 
 
+class Wait:
+    """Simulator command: resume the generator after ``cycles`` clock cycles
+
+    ``yield Wait(n)`` is equivalent to ``n`` times ``yield``, but lets the
+    simulator skip the generator in the meantime.
+    """
+    def __init__(self, cycles):
+        self.cycles = cycles
+
+
+class WaitUntil:
+    """Simulator command: resume the generator once ``condition`` is true
+
+    ``condition`` is a Migen expression, e.g. ``WaitUntil(dut.ready == 1)``.
+    It is checked immediately, then at each clock cycle, as with
+    ``while not (yield condition): yield``.
+    """
+    def __init__(self, condition):
+        self.condition = wrap(condition)
+
+
 class Evaluator:
-    def __init__(self, clock_domains, replaced_memories):
+    """Statement interpreter
+
+    Each signal is given a dense slot index on first use (or up front with
+    ``slot``). Current and next values are held in flat lists indexed by slot;
+    assignments write the next value and record the slot in ``pending``, and
+    ``commit`` copies the pending values that differ and returns their slots.
+    Slots changed since the last ``flush_changes`` are tracked in the
+    ``changed`` bitmap.
+
+    Memories are held natively by ``MemoryState`` objects, see ``memory``.
+    """
+    def __init__(self, clock_domains):
         self.clock_domains = clock_domains
-        self.replaced_memories = replaced_memories
-        self.signal_values = dict()
-        self.modifications = dict()
+        self.memories = dict()
+        self.pending_memories = []
+        self.slots = dict()
+        self.signals = []
+        self.values = []
+        self.next = []
+        self.pending = []
+        self.changed = bytearray()
+        self.changed_slots = []
+
+    def _new_slot(self, obj, value):
+        slot = len(self.signals)
+        self.signals.append(obj)
+        self.values.append(value)
+        self.next.append(value)
+        self.changed.append(0)
+        return slot
+
+    def slot(self, signal):
+        try:
+            return self.slots[signal]
+        except KeyError:
+            slot = self._new_slot(signal, signal.reset.value)
+            self.slots[signal] = slot
+            return slot
+
+    def memory(self, memory):
+        try:
+            return self.memories[memory]
+        except KeyError:
+            # the value of the slot of a memory counts content changes
+            state = MemoryState(memory, self._new_slot(memory, 0), self.pending_memories)
+            self.memories[memory] = state
+            return state
 
     def commit(self):
-        r = set()
-        for k, v in self.modifications.items():
-            if k not in self.signal_values or self.signal_values[k] != v:
-                self.signal_values[k] = v
-                r.add(k)
-        self.modifications.clear()
+        r = []
+        values, next, changed = self.values, self.next, self.changed
+        for slot in self.pending:
+            v = next[slot]
+            if values[slot] != v:
+                values[slot] = v
+                r.append(slot)
+                if not changed[slot]:
+                    changed[slot] = 1
+                    self.changed_slots.append(slot)
+        self.pending.clear()
+        for state in self.pending_memories:
+            if state.commit():
+                values[state.slot] += 1
+                next[state.slot] += 1
+                r.append(state.slot)
+        self.pending_memories.clear()
+        return r
+
+    def flush_changes(self):
+        r = self.changed_slots
+        changed = self.changed
+        for slot in r:
+            changed[slot] = 0
+        self.changed_slots = []
         return r
 
     def eval(self, node, postcommit=False):
@@ -119,14 +217,9 @@ class Evaluator:
             return node.value
         elif isinstance(node, Signal):
             if postcommit:
-                try:
-                    return self.modifications[node]
-                except KeyError:
-                    pass
-            try:
-                return self.signal_values[node]
-            except KeyError:
-                return node.reset.value
+                return self.next[self.slot(node)]
+            else:
+                return self.values[self.slot(node)]
         elif isinstance(node, _Operator):
             operands = [self.eval(o, postcommit) for o in node.operands]
             if node.op == "-":
@@ -159,8 +252,7 @@ class Evaluator:
             idx = min(len(node.choices) - 1, self.eval(node.key, postcommit))
             return self.eval(node.choices[idx], postcommit)
         elif isinstance(node, _MemoryLocation):
-            array = self.replaced_memories[node.memory]
-            return self.eval(array[self.eval(node.index, postcommit)], postcommit)
+            return self.memory(node.memory).read(self.eval(node.index, postcommit), postcommit)
         elif isinstance(node, ClockSignal):
             return self.eval(self.clock_domains[node.cd].clk, postcommit)
         elif isinstance(node, ResetSignal):
@@ -179,8 +271,9 @@ class Evaluator:
     def assign(self, node, value):
         if isinstance(node, Signal):
             assert not node.variable
-            self.modifications[node] = _truncate(value,
-                                                 node.nbits, node.signed)
+            slot = self.slot(node)
+            self.next[slot] = _truncate(value, node.nbits, node.signed)
+            self.pending.append(slot)
         elif isinstance(node, Cat):
             for element in node.l:
                 nbits = len(element)
@@ -198,8 +291,7 @@ class Evaluator:
             idx = min(len(node.choices) - 1, self.eval(node.key))
             self.assign(node.choices[idx], value)
         elif isinstance(node, _MemoryLocation):
-            array = self.replaced_memories[node.memory]
-            self.assign(array[self.eval(node.index)], value)
+            self.memory(node.memory).write(self.eval(node.index), value)
         else:
             raise NotImplementedError(node)
 
@@ -223,20 +315,272 @@ class Evaluator:
                         break
                 if not found and "default" in s.cases:
                     self.execute(s.cases["default"])
-            elif isinstance(s, collections.Iterable):
+            elif isinstance(s, _MemoryWrite):
+                self.memory(s.memory).write(self.eval(s.adr), self.eval(s.dat_w), s.mask)
+            elif isinstance(s, collections.abc.Iterable):
                 self.execute(s)
             elif isinstance(s, Display):
                 args = []
                 for arg in s.args:
                     assert isinstance(arg, _Value)
-                    try:
-                        args.append(self.signal_values[arg])
-                    except: # not yet evaluated
-                        args.append(arg.reset.value)
+                    args.append(self.eval(arg))
                 print(s.s %(*args,))
             else:
                 raise NotImplementedError
 
+    def compile(self, statements):
+        return lambda: self.execute(statements)
+
+
+class CompiledEvaluator(Evaluator):
+    """Evaluator running statements lowered to Python functions
+
+    The functions generated by ``StatementCompiler`` index the slot storage
+    directly. Statements given to ``compile`` are lowered once; the returned
+    functions are then called every cycle.
+    """
+    def __init__(self, clock_domains):
+        Evaluator.__init__(self, clock_domains)
+        self.compiler = StatementCompiler(self)
+
+    def compile(self, statements):
+        return self.compiler.compile(statements)
+
+
+class _CombInputLister(NodeVisitor):
+    def __init__(self, clock_domains):
+        self.clock_domains = clock_domains
+        self.output_list = set()
+        self.target_context = False
+
+    def visit_Signal(self, node):
+        if not self.target_context:
+            self.output_list.add(node)
+
+    def visit_ClockSignal(self, node):
+        if not self.target_context:
+            self.output_list.add(self.clock_domains[node.cd].clk)
+
+    def visit_ResetSignal(self, node):
+        rst = self.clock_domains[node.cd].rst
+        if not self.target_context and rst is not None:
+            self.output_list.add(rst)
+
+    def visit_Assign(self, node):
+        self.visit(node.r)
+        self.target_context = True
+        self.visit(node.l)
+        self.target_context = False
+
+    def visit_ArrayProxy(self, node):
+        for choice in node.choices:
+            self.visit(choice)
+        target_context, self.target_context = self.target_context, False
+        self.visit(node.key)
+        self.target_context = target_context
+
+    def visit_unknown(self, node):
+        if isinstance(node, _MemoryLocation):
+            if not self.target_context:
+                self.output_list.add(node.memory)
+            target_context, self.target_context = self.target_context, False
+            self.visit(node.index)
+            self.target_context = target_context
+
+
+def _signal_names(signals):
+    ns = build_namespace(signals)
+    return ", ".join(sorted(ns.get_name(s) for s in signals))
+
+
+def _strongly_connected_components(successors):
+    # Iterative Tarjan, components are returned in topological order.
+    index = [None]*len(successors)
+    lowlink = [0]*len(successors)
+    on_stack = [False]*len(successors)
+    stack = []
+    components = []
+    counter = 0
+    for root in range(len(successors)):
+        if index[root] is not None:
+            continue
+        work = [(root, iter(successors[root]))]
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        while work:
+            node, it = work[-1]
+            for succ in it:
+                if index[succ] is None:
+                    index[succ] = lowlink[succ] = counter
+                    counter += 1
+                    stack.append(succ)
+                    on_stack[succ] = True
+                    work.append((succ, iter(successors[succ])))
+                    break
+                elif on_stack[succ]:
+                    lowlink[node] = min(lowlink[node], index[succ])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(sorted(component))
+    components.reverse()
+    return components
+
+
+def _bit_dependencies(statements, clock_domains):
+    """Bits read and written by each assignment of combinatorial statements
+
+    Returns pairs of lists of (signal, bit), the bits read including those of the conditions of
+    the assignment. Bits of signals and of constant slices of signals are tracked individually,
+    all the bits of the signals of other expressions are assumed to be read or written.
+    """
+    def signal_bits(signal, start=0, stop=None):
+        return [(signal, i) for i in range(start, len(signal) if stop is None else stop)]
+
+    def read_bits(node):
+        if isinstance(node, Signal):
+            return signal_bits(node)
+        if isinstance(node, _Slice) and isinstance(node.value, Signal):
+            return signal_bits(node.value, node.start, node.stop)
+        lister = _CombInputLister(clock_domains)
+        lister.visit(node)
+        return [bit for signal in lister.output_list if isinstance(signal, Signal)
+            for bit in signal_bits(signal)]
+
+    def write_bits(node):
+        if isinstance(node, Signal):
+            return signal_bits(node)
+        if isinstance(node, _Slice) and isinstance(node.value, Signal):
+            return signal_bits(node.value, node.start, node.stop)
+        if isinstance(node, Cat):
+            return [bit for value in node.l for bit in write_bits(value)]
+        if isinstance(node, ClockSignal):
+            return signal_bits(clock_domains[node.cd].clk)
+        if isinstance(node, ResetSignal):
+            return signal_bits(clock_domains[node.cd].rst)
+        return [bit for signal in list_signals(node) for bit in signal_bits(signal)]
+
+    dependencies = []
+
+    def walk(node, conditions):
+        if isinstance(node, _Assign):
+            reads = read_bits(node.r) + conditions
+            if isinstance(node.l, _ArrayProxy):
+                reads += read_bits(node.l.key)
+            dependencies.append((reads, write_bits(node.l)))
+        elif isinstance(node, If):
+            conditions = conditions + read_bits(node.cond)
+            walk(node.t, conditions)
+            walk(node.f, conditions)
+        elif isinstance(node, Case):
+            conditions = conditions + read_bits(node.test)
+            for case in node.cases.values():
+                walk(case, conditions)
+        elif isinstance(node, collections.abc.Iterable):
+            for statement in node:
+                walk(statement, conditions)
+
+    walk(statements, [])
+    return dependencies
+
+
+def _has_bit_loop(statements, clock_domains):
+    """Whether a bit of combinatorial ``statements`` depends on itself"""
+    dependencies = _bit_dependencies(statements, clock_domains)
+    indexes = dict()
+    for reads, writes in dependencies:
+        for bit in writes:
+            if bit not in indexes:
+                indexes[bit] = len(indexes)
+    successors = [set() for _ in indexes]
+    for reads, writes in dependencies:
+        written = [indexes[bit] for bit in writes]
+        for bit in reads:
+            if bit in indexes:
+                successors[indexes[bit]].update(written)
+    return any(len(component) > 1 or component[0] in successors[component[0]]
+        for component in _strongly_connected_components(successors))
+
+
+class CombNetwork:
+    """Sensitivity analysis of the combinatorial statements of a fragment
+
+    Statements are grouped by targets and the groups are ordered topologically
+    from the signals they read and drive. Each resulting unit is a group, or a
+    set of groups forming a combinatorial loop, and is compiled into a single
+    callable by the evaluator.
+
+    ``readers`` maps the slot of each signal to the units to re-evaluate when
+    it changes, ``drivers`` maps the slot of each combinatorial target to the
+    unit driving it and
+    ``loops`` maps units containing a combinatorial loop to their targets.
+    ``bit_loops`` holds the units of ``loops`` in which a bit depends on itself:
+    the other ones only connect different bits of their signals, as in shift
+    chains, and always settle.
+    """
+    def __init__(self, statements, clock_domains, evaluator):
+        groups = group_by_targets(statements)
+        inputs = []
+        for targets, group in groups:
+            lister = _CombInputLister(clock_domains)
+            lister.visit(group)
+            inputs.append(lister.output_list)
+
+        drivers = dict()
+        for i, (targets, group) in enumerate(groups):
+            for target in targets:
+                drivers[target] = i
+        successors = [set() for _ in groups]
+        for i, group_inputs in enumerate(inputs):
+            for signal in group_inputs:
+                try:
+                    successors[drivers[signal]].add(i)
+                except KeyError:
+                    pass
+
+        self.units = []
+        self.loops = dict()
+        self.bit_loops = set()
+        self.iteration_limits = dict()
+        readers = collections.defaultdict(list)
+        self.drivers = dict()
+        for rank, component in enumerate(_strongly_connected_components(successors)):
+            unit_statements = []
+            unit_targets = set()
+            for i in component:
+                targets, group = groups[i]
+                unit_statements += group
+                unit_targets |= targets
+                for signal in inputs[i]:
+                    if isinstance(signal, Memory):
+                        slot = evaluator.memory(signal).slot
+                    else:
+                        slot = evaluator.slot(signal)
+                    if rank not in readers[slot]:
+                        readers[slot].append(rank)
+                for target in targets:
+                    self.drivers[evaluator.slot(target)] = rank
+            self.units.append(evaluator.compile(unit_statements))
+            if len(component) > 1 or component[0] in successors[component[0]]:
+                self.loops[rank] = unit_targets
+                # enough to settle one bit per iteration
+                self.iteration_limits[rank] = sum(len(s) for s in unit_targets) + 2
+                if _has_bit_loop(unit_statements, clock_domains):
+                    self.bit_loops.add(rank)
+        self.readers = {slot: tuple(units) for slot, units in readers.items()}
+
 
 class DummyAsyncResetSynchronizerImpl(Module):
     def __init__(self, cd, async_reset):
@@ -255,14 +599,13 @@ class DummyAsyncResetSynchronizer:
 # TODO: instances via Iverilog/VPI
 class Simulator:
     def __init__(self, fragment_or_module, generators, clocks={"sys": 10}, vcd_name=None,
-                 special_overrides={}):
+                 special_overrides={}, compiled=False, vcd_options={}, print_stats=False):
         if isinstance(fragment_or_module, _Fragment):
             self.fragment = fragment_or_module
         else:
             self.fragment = fragment_or_module.get_fragment()
 
-        mta = MemoryToArray()
-        mta.transform_fragment(None, self.fragment)
+        memories = lower_memories(self.fragment)
 
         overrides = {AsyncResetSynchronizer: DummyAsyncResetSynchronizer}
         overrides.update(special_overrides)
@@ -275,12 +618,18 @@ class Simulator:
         self.generators = dict()
         self.passive_generators = set()
         for k, v in generators.items():
-            if (isinstance(v, collections.Iterable)
+            if (isinstance(v, collections.abc.Iterable)
                     and not inspect.isgenerator(v)):
                 self.generators[k] = list(v)
             else:
                 self.generators[k] = [v]
 
+        self.waits = dict()
+        self.cycles = {cd: 0 for cd in clocks.keys()}
+        self.wake_cycles = {cd: 0 for cd in clocks.keys()}
+        self.print_stats = print_stats
+        self.stats = dict()
+
         clocks = collections.OrderedDict(sorted(clocks.items(),
                                                 key=operator.itemgetter(0)))
         self.time = TimeManager(clocks)
@@ -294,24 +643,43 @@ class Simulator:
         # comb signals return to their reset value if nothing assigns them
         self.fragment.comb[0:0] = [s.eq(s.reset)
                                    for s in list_targets(self.fragment.comb)]
-        self.evaluator = Evaluator(self.fragment.clock_domains,
-                                   mta.replacements)
+        if compiled:
+            self.evaluator = CompiledEvaluator(self.fragment.clock_domains)
+        else:
+            self.evaluator = Evaluator(self.fragment.clock_domains)
+        signals = list_signals(self.fragment)
+        for cd in self.fragment.clock_domains:
+            signals.add(cd.clk)
+            if cd.rst is not None:
+                signals.add(cd.rst)
+        for signal in sorted(signals, key=lambda x: x.duid):
+            self.evaluator.slot(signal)
+        for memory in memories:
+            self.evaluator.memory(memory)
+        self.comb = CombNetwork(self.fragment.comb, self.fragment.clock_domains,
+                                self.evaluator)
+        for rank in sorted(self.comb.bit_loops):
+            warnings.warn("Combinatorial loop between signals: "
+                          + _signal_names(self.comb.loops[rank]))
+        self.comb_queue = []
+        self.comb_scheduled = [False]*len(self.comb.units)
+        self.sync = {cd: self.evaluator.compile(statements)
+                     for cd, statements in self.fragment.sync.items()}
 
         if vcd_name is None:
             self.vcd = DummyVCDWriter()
         else:
-            self.vcd = VCDWriter(vcd_name)
-
-            signals = list_signals(self.fragment)
-            for cd in self.fragment.clock_domains:
-                signals.add(cd.clk)
-                if cd.rst is not None:
-                    signals.add(cd.rst)
-            for memory_array in mta.replacements.values():
-                signals |= set(memory_array)
+            if vcd_name.endswith(".lxw"):
+                self.vcd = LXWWriter(vcd_name, **vcd_options)
+            else:
+                self.vcd = StreamingVCDWriter(vcd_name, **vcd_options)
             self.vcd.init(signals)
-            for signal in sorted(signals, key=lambda x: x.duid):
-                self.vcd.set(signal, signal.reset.value)
+
+    def load_memory(self, memory, data, offset=0):
+        """Load ``data`` words into ``memory`` from word ``offset``"""
+        state = self.evaluator.memory(memory)
+        state.load(data, offset)
+        self._schedule_comb(self.comb.readers.get(state.slot, ()))
 
     def __enter__(self):
         return self
@@ -322,17 +690,37 @@ class Simulator:
     def close(self):
         self.vcd.close()
 
+    def _schedule_comb(self, units):
+        for unit in units:
+            if not self.comb_scheduled[unit]:
+                self.comb_scheduled[unit] = True
+                heapq.heappush(self.comb_queue, unit)
+
     def _commit_and_comb_propagate(self):
-        # TODO: optimize
-        all_modified = set()
-        modified = self.evaluator.commit()
-        all_modified |= modified
-        while modified:
-            self.evaluator.execute(self.fragment.comb)
-            modified = self.evaluator.commit()
-            all_modified |= modified
-        for signal in all_modified:
-            self.vcd.set(signal, self.evaluator.signal_values[signal])
+        comb = self.comb
+        evaluator = self.evaluator
+        modified = evaluator.commit()
+        for slot in modified:
+            self._schedule_comb(comb.readers.get(slot, ()))
+            # signals driven combinatorially return to their driven value
+            # when written by generators
+            if slot in comb.drivers:
+                self._schedule_comb((comb.drivers[slot],))
+        iterations = collections.Counter()
+        while self.comb_queue:
+            unit = heapq.heappop(self.comb_queue)
+            self.comb_scheduled[unit] = False
+            if unit in comb.loops:
+                iterations[unit] += 1
+                if iterations[unit] > comb.iteration_limits[unit]:
+                    raise ValueError("Combinatorial loop does not converge: "
+                                     + _signal_names(comb.loops[unit]))
+            comb.units[unit]()
+            for slot in evaluator.commit():
+                self._schedule_comb(comb.readers.get(slot, ()))
+        signals, values = evaluator.signals, evaluator.values
+        for slot in evaluator.flush_changes():
+            self.vcd.set(signals[slot], values[slot])
 
     def _evalexec_nested_lists(self, x):
         if isinstance(x, list):
@@ -346,14 +734,43 @@ class Simulator:
             raise ValueError
 
     def _process_generators(self, cd):
+        cycle = self.cycles[cd]
+        if cycle < self.wake_cycles[cd]:
+            return
+        wake_cycle = None
         exhausted = []
         for generator in self.generators[cd]:
+            wait = self.waits.get(generator)
+            if wait is not None:
+                if isinstance(wait, int):
+                    if cycle < wait:
+                        wake_cycle = wait if wake_cycle is None else min(wake_cycle, wait)
+                        continue
+                elif not self.evaluator.eval(wait):
+                    wake_cycle = cycle + 1
+                    continue
+                del self.waits[generator]
+            self.stats["resumes"] += 1
             reply = None
             while True:
                 try:
                     request = generator.send(reply)
                     if request is None:
+                        wake_cycle = cycle + 1
                         break  # next cycle
+                    elif isinstance(request, Wait):
+                        if request.cycles > 0:
+                            self.waits[generator] = cycle + request.cycles
+                            if wake_cycle is None or cycle + request.cycles < wake_cycle:
+                                wake_cycle = cycle + request.cycles
+                            break
+                        reply = None
+                    elif isinstance(request, WaitUntil):
+                        if not self.evaluator.eval(request.condition):
+                            self.waits[generator] = request.condition
+                            wake_cycle = cycle + 1
+                            break
+                        reply = None
                     elif isinstance(request, str):
                         if request == "passive":
                             self.passive_generators.add(generator)
@@ -369,24 +786,37 @@ class Simulator:
                     break
         for generator in exhausted:
             self.generators[cd].remove(generator)
+        self.wake_cycles[cd] = cycle + 1 if wake_cycle is None else wake_cycle
 
     def _continue_simulation(self):
         for cd_generators in self.generators.values():
-            if set(cd_generators) - self.passive_generators:
-                return True
+            for generator in cd_generators:
+                if generator not in self.passive_generators:
+                    return True
         return False
 
     def run(self):
-        self.evaluator.execute(self.fragment.comb)
+        """Run the simulation until all non-passive generators are exhausted
+
+        Statistics of the run are stored in ``stats`` (and printed if
+        ``print_stats`` is set): simulated time, clock cycles per domain,
+        generator resumes, wall time and simulated time per wall second.
+        """
+        self.stats["resumes"] = 0
+        start = time.perf_counter()
+        start_time = self.time.t
+
+        self._schedule_comb(range(len(self.comb.units)))
         self._commit_and_comb_propagate()
 
         while True:
             dt, rising, falling = self.time.tick()
             self.vcd.delay(dt)
             for cd in rising:
+                self.cycles[cd] += 1
                 self.evaluator.assign(self.fragment.clock_domains[cd].clk, 1)
-                if cd in self.fragment.sync:
-                    self.evaluator.execute(self.fragment.sync[cd])
+                if cd in self.sync:
+                    self.sync[cd]()
                 if cd in self.generators:
                     self._process_generators(cd)
             for cd in falling:
@@ -396,6 +826,16 @@ class Simulator:
             if not self._continue_simulation():
                 break
 
+        wall_time = time.perf_counter() - start
+        self.stats["time"] = self.time.t - start_time
+        self.stats["cycles"] = dict(self.cycles)
+        self.stats["wall_time"] = wall_time
+        self.stats["time_per_second"] = self.stats["time"]/wall_time if wall_time else 0
+        if self.print_stats:
+            print("Simulated {} time units in {:.3f}s ({:.1f} time units/s), cycles: {}".format(
+                self.stats["time"], wall_time, self.stats["time_per_second"],
+                ", ".join("{}: {}".format(cd, n) for cd, n in sorted(self.cycles.items()))))
+
 
 def run_simulation(*args, **kwargs):
     with Simulator(*args, **kwargs) as s:
@@ -0,0 +1,268 @@
+# License: BSD
+
+"""LiteX waveform files (.lxw)
+
+A compact binary alternative to VCD for long simulations. All integers are
+little-endian, varints are unsigned LEB128. A file starts with the magic
+``b"LXWAVE"`` followed by a version byte (1) and a reserved byte, then by
+chunks::
+
+    type    1 byte
+    length  4 bytes, length of the payload
+    payload
+
+Chunk types:
+
+``S`` (signals, once, before any ``V`` chunk)
+    zlib-compressed UTF-8 JSON list of ``[name, width]`` pairs. Signals are
+    identified by their index in this list.
+
+``V`` (values)
+    zlib-compressed sequence of timesteps, each made of:
+
+    * varint: time elapsed since the previous timestep (since 0 for the first)
+    * varint: number of changes
+    * for each change, in increasing signal order:
+
+      * varint: signal index minus the index of the previous change of the
+        timestep minus one, or the signal index for the first change
+      * varint: new value XOR previous value of the signal
+
+    All signals are 0 before their first change.
+
+``E`` (end)
+    varint: simulation time at the end of the dump.
+
+``lxw_to_vcd`` converts a file to VCD (also available as ``litex_lxw2vcd``).
+"""
+
+import json
+import struct
+import zlib
+import argparse
+
+from migen.fhdl.namer import build_namespace
+
+from litex.gen.sim.vcd import vcd_codes, _signal_filter
+
+
+magic = b"LXWAVE\x01\x00"
+
+
+def _append_varint(buf, n):
+    while n > 0x7f:
+        buf.append((n & 0x7f) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+
+def _read_varint(data, offset):
+    n = 0
+    shift = 0
+    while True:
+        b = data[offset]
+        offset += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, offset
+        shift += 7
+
+
+class LXWWriter:
+    """Waveform writer for .lxw files
+
+    Takes the same ``include``/``exclude``/``start``/``stop`` options as
+    ``StreamingVCDWriter``. Value blocks are compressed once ``block_size``
+    bytes of changes are buffered.
+    """
+    def __init__(self, filename, include=None, exclude=None, start=None, stop=None,
+                 block_size=2**20):
+        self.out_file = open(filename, "wb")
+        self.out_file.write(magic)
+        self.include = include
+        self.exclude = exclude
+        self.start = 0 if start is None else start
+        self.stop = stop
+        self.block_size = block_size
+        self.block = bytearray()
+        self.changes = dict()
+        self.ids = dict()
+        self.masks = []
+        self.signal_values = dict()
+        self.dumped_values = []
+        self.t = 0
+        self.last_t = 0
+        self.dumping = False
+
+    def _write_chunk(self, kind, payload):
+        self.out_file.write(kind + struct.pack("<I", len(payload)) + payload)
+
+    def _flush(self):
+        if self.block:
+            self._write_chunk(b"V", zlib.compress(bytes(self.block)))
+            self.block = bytearray()
+
+    def init(self, signals):
+        signals = set(signals)
+        ns = build_namespace(signals)
+        if self.include is not None:
+            signals = _signal_filter(self.include, signals, ns)
+        if self.exclude is not None:
+            signals -= _signal_filter(self.exclude, signals, ns)
+        table = []
+        for signal in sorted(signals, key=lambda x: x.duid):
+            self.ids[signal] = len(table)
+            self.masks.append(2**len(signal) - 1)
+            self.signal_values[signal] = signal.reset.value
+            self.dumped_values.append(0)
+            table.append([ns.get_name(signal), len(signal)])
+        self._write_chunk(b"S", zlib.compress(json.dumps(table).encode()))
+        self._update_window()
+
+    def _timestep(self):
+        changes = self.changes
+        dumped = self.dumped_values
+        block = self.block
+        _append_varint(block, self.t - self.last_t)
+        _append_varint(block, len(changes))
+        previous = -1
+        for i in sorted(changes):
+            value = changes[i]
+            _append_varint(block, i - previous - 1)
+            _append_varint(block, value ^ dumped[i])
+            dumped[i] = value
+            previous = i
+        changes.clear()
+        self.last_t = self.t
+        if len(block) >= self.block_size:
+            self._flush()
+
+    def _update_window(self):
+        if self.stop is not None and self.t >= self.stop:
+            self.dumping = False
+            self.start = None
+        elif self.start is not None and self.t >= self.start:
+            for signal, value in self.signal_values.items():
+                i = self.ids[signal]
+                value &= self.masks[i]
+                if value != self.dumped_values[i]:
+                    self.changes[i] = value
+            self.dumping = True
+            self.start = None
+
+    def set(self, signal, value):
+        try:
+            if self.signal_values[signal] == value:
+                return
+        except KeyError:
+            return
+        self.signal_values[signal] = value
+        if self.dumping:
+            i = self.ids[signal]
+            self.changes[i] = value & self.masks[i]
+
+    def delay(self, delay):
+        if self.changes:
+            self._timestep()
+        self.t += delay
+        if self.start is not None or self.dumping:
+            self._update_window()
+
+    def close(self):
+        if self.changes:
+            self._timestep()
+        self._flush()
+        end = bytearray()
+        _append_varint(end, self.t if self.stop is None else min(self.t, self.stop))
+        self._write_chunk(b"E", bytes(end))
+        self.out_file.close()
+
+
+def read_lxw(filename):
+    """Read a .lxw file
+
+    Returns the list of ``(name, width)`` of the signals, the list of
+    ``(time, [(signal index, value), ...])`` timesteps and the end time.
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+    if data[:len(magic)] != magic:
+        raise ValueError("{} is not a LiteX waveform file".format(filename))
+    offset = len(magic)
+    signals = None
+    timesteps = []
+    values = None
+    t = 0
+    end = None
+    while offset < len(data):
+        kind = data[offset:offset + 1]
+        length, = struct.unpack_from("<I", data, offset + 1)
+        payload = data[offset + 5:offset + 5 + length]
+        offset += 5 + length
+        if kind == b"S":
+            signals = [tuple(s) for s in json.loads(zlib.decompress(payload).decode())]
+            values = [0]*len(signals)
+        elif kind == b"V":
+            block = zlib.decompress(payload)
+            i = 0
+            while i < len(block):
+                dt, i = _read_varint(block, i)
+                n, i = _read_varint(block, i)
+                t += dt
+                changes = []
+                signal = -1
+                for _ in range(n):
+                    delta, i = _read_varint(block, i)
+                    xor, i = _read_varint(block, i)
+                    signal += delta + 1
+                    values[signal] ^= xor
+                    changes.append((signal, values[signal]))
+                timesteps.append((t, changes))
+        elif kind == b"E":
+            end, _ = _read_varint(payload, 0)
+        else:
+            raise ValueError("Unknown chunk type {!r}".format(kind))
+    return signals, timesteps, end
+
+
+def lxw_to_vcd(src, dst):
+    """Convert the .lxw file ``src`` to the VCD file ``dst``"""
+    signals, timesteps, end = read_lxw(src)
+    codegen = vcd_codes()
+    codes = [next(codegen) for _ in signals]
+
+    def fmt(i, value):
+        if signals[i][1] > 1:
+            return "b{:b} {}\n".format(value, codes[i])
+        else:
+            return "{}{}\n".format(value, codes[i])
+
+    with open(dst, "w") as f:
+        for (name, width), code in zip(signals, codes):
+            f.write("$var wire {} {} {} $end\n".format(width, code, name))
+        f.write("$enddefinitions $end\n")
+        values = [0]*len(signals)
+        for n, (t, changes) in enumerate(timesteps):
+            if n == 0:
+                for i, value in changes:
+                    values[i] = value
+                f.write("#{}\n$dumpvars\n".format(t))
+                f.write("".join(fmt(i, v) for i, v in enumerate(values)))
+                f.write("$end\n")
+            else:
+                f.write("#{}\n".format(t))
+                f.write("".join(fmt(i, value) for i, value in changes))
+        if end is not None:
+            f.write("#{}\n".format(end))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert LiteX waveform (.lxw) files to VCD")
+    parser.add_argument("lxw", help="input .lxw file")
+    parser.add_argument("vcd", help="output .vcd file")
+    args = parser.parse_args()
+    lxw_to_vcd(args.lxw, args.vcd)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# License: BSD
+
+from array import array
+
+from migen.fhdl.structure import *
+from migen.fhdl.structure import _Statement
+from migen.fhdl.specials import Memory, WRITE_FIRST, NO_CHANGE
+
+
+class MemoryState:
+    """Storage of a simulated memory
+
+    Words are held in an ``array`` of the smallest unsigned type fitting the
+    memory width (in a list above 64 bits). Writes are deferred until the
+    evaluator commits, as for signals; ``slot`` is the slot the evaluator
+    reports as changed when the contents of the memory change.
+    """
+    def __init__(self, memory, slot, pending_memories):
+        self.memory = memory
+        self.slot = slot
+        self.depth = memory.depth
+        self.mask = 2**memory.width - 1
+        self.pending = dict()
+        self.pending_memories = pending_memories
+
+        self.typecode = None
+        for typecode in "BHILQ":
+            if array(typecode).itemsize*8 >= memory.width:
+                self.typecode = typecode
+                break
+        if self.typecode is None:
+            self.storage = [0]*self.depth
+        else:
+            self.storage = array(self.typecode, bytes(array(self.typecode).itemsize*self.depth))
+        if memory.init is not None:
+            self.load(memory.init[:self.depth])
+
+    def load(self, data, offset=0):
+        if offset < 0 or offset + len(data) > self.depth:
+            raise ValueError("Data does not fit in memory of depth {}".format(self.depth))
+        mask = self.mask
+        words = [word & mask for word in data]
+        if self.typecode is not None:
+            words = array(self.typecode, words)
+        self.storage[offset:offset + len(words)] = words
+
+    def read(self, index, postcommit=False):
+        index = min(self.depth - 1, index)
+        if postcommit:
+            try:
+                return self.pending[index]
+            except KeyError:
+                pass
+        return self.storage[index]
+
+    def write(self, index, value, mask=None):
+        index = min(self.depth - 1, index)
+        if not self.pending:
+            self.pending_memories.append(self)
+        if mask is None:
+            self.pending[index] = value & self.mask
+        else:
+            previous = self.pending.get(index, self.storage[index])
+            self.pending[index] = (previous & ~mask) | (value & mask)
+
+    def commit(self):
+        storage = self.storage
+        modified = False
+        for index, value in self.pending.items():
+            if storage[index] != value:
+                storage[index] = value
+                modified = True
+        self.pending.clear()
+        return modified
+
+
+class _MemoryWrite(_Statement):
+    # Write of the bits of dat_w selected by the constant mask at memory[adr]
+    def __init__(self, memory, adr, dat_w, mask):
+        self.memory = memory
+        self.adr = wrap(adr)
+        self.dat_w = wrap(dat_w)
+        self.mask = mask
+
+
+def lower_memories(f):
+    """Replace the memories of fragment ``f`` and their ports by statements
+
+    The statements access memory locations, which the evaluator implements
+    natively. Returns the list of lowered memories.
+    """
+    memories = []
+    ports = set()
+    for memory in f.specials:
+        if not isinstance(memory, Memory):
+            continue
+        memories.append(memory)
+        for port in memory.ports:
+            sync = f.sync.setdefault(port.clock.cd, [])
+
+            # read
+            if port.async_read:
+                f.comb.append(port.dat_r.eq(memory[port.adr]))
+            else:
+                if port.mode == WRITE_FIRST:
+                    adr_reg = Signal.like(port.adr)
+                    rd_stmt = adr_reg.eq(port.adr)
+                    f.comb.append(port.dat_r.eq(memory[adr_reg]))
+                elif port.mode == NO_CHANGE and port.we is not None:
+                    rd_stmt = If(~port.we, port.dat_r.eq(memory[port.adr]))
+                else: # NO_CHANGE without write capability reduces to READ_FIRST
+                    rd_stmt = port.dat_r.eq(memory[port.adr])
+                if port.re is None:
+                    sync.append(rd_stmt)
+                else:
+                    sync.append(If(port.re, rd_stmt))
+
+            # write
+            if port.we is not None:
+                if port.we_granularity:
+                    for i in range(memory.width//port.we_granularity):
+                        mask = (2**port.we_granularity - 1) << i*port.we_granularity
+                        sync.append(If(port.we[i],
+                                       _MemoryWrite(memory, port.adr, port.dat_w, mask)))
+                else:
+                    sync.append(If(port.we,
+                                   memory[port.adr].eq(port.dat_w)))
+            ports.add(port)
+    f.specials -= set(memories)
+    f.specials -= ports
+    return memories
@@ -9,8 +9,12 @@ import tempfile
 import os
 from collections import OrderedDict
 import shutil
+import gzip
+from fnmatch import fnmatchcase
 
 from migen.fhdl.namer import build_namespace
+from migen.fhdl.module import Module
+from migen.fhdl.tools import list_signals
 
 
 def vcd_codes():
@@ -105,6 +109,136 @@ class VCDWriter:
         self.buffer_file.close()
 
 
+def _signal_filter(patterns, signals, ns):
+    # Signals matched by name patterns, or belonging to the given modules
+    selected = set()
+    for pattern in patterns:
+        if isinstance(pattern, Module):
+            selected |= list_signals(pattern._fragment) & signals
+        else:
+            selected |= {s for s in signals if fnmatchcase(ns.get_name(s), pattern)}
+    return selected
+
+
+class StreamingVCDWriter:
+    """VCD writer streaming through a large buffer
+
+    The set of dumped signals is fixed by ``init``: signals set later that were
+    not given to ``init`` are not dumped. Changes are batched per timestep and
+    written out once ``buffer_size`` characters are buffered.
+
+    ``include``/``exclude`` are lists of signal name patterns (as in
+    ``fnmatch``) or modules whose signals are selected/rejected; all signals
+    are included by default. Changes are only dumped between the ``start`` and
+    ``stop`` times. The file is compressed with gzip if ``compress`` is set,
+    or when not specified if the file name ends with ``.gz``.
+    """
+    def __init__(self, filename, include=None, exclude=None, start=None, stop=None,
+                 compress=None, buffer_size=2**20):
+        if compress is None:
+            compress = filename.endswith(".gz")
+        if compress:
+            self.out_file = gzip.open(filename, "wt")
+        else:
+            self.out_file = open(filename, "w")
+        self.include = include
+        self.exclude = exclude
+        self.start = 0 if start is None else start
+        self.stop = stop
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered = 0
+        self.changes = []
+        self.codes = dict()
+        self.formats = dict()
+        self.signal_values = dict()
+        self.t = 0
+        self.dumping = False
+
+    def _flush(self):
+        self.out_file.write("".join(self.buffer))
+        self.buffer.clear()
+        self.buffered = 0
+
+    def _emit(self, s):
+        self.buffer.append(s)
+        self.buffered += len(s)
+        if self.buffered >= self.buffer_size:
+            self._flush()
+
+    def _format(self, signal, value):
+        if value < 0:
+            value += 2**len(signal)
+        return self.formats[signal].format(value)
+
+    def _dump_all(self):
+        self._emit("#{}\n$dumpvars\n".format(self.t)
+            + "".join(self._format(s, v) for s, v in self.signal_values.items())
+            + "$end\n")
+
+    def init(self, signals):
+        signals = set(signals)
+        ns = build_namespace(signals)
+        if self.include is not None:
+            signals = _signal_filter(self.include, signals, ns)
+        if self.exclude is not None:
+            signals -= _signal_filter(self.exclude, signals, ns)
+
+        codegen = vcd_codes()
+        header = ""
+        for signal in sorted(signals, key=lambda x: x.duid):
+            code = next(codegen)
+            self.codes[signal] = code
+            if len(signal) > 1:
+                self.formats[signal] = "b{:b} " + code + "\n"
+            else:
+                self.formats[signal] = "{}" + code + "\n"
+            self.signal_values[signal] = signal.reset.value
+            header += "$var wire {len} {code} {name} $end\n".format(
+                name=ns.get_name(signal), code=code, len=len(signal))
+        header += "$enddefinitions $end\n"
+        self._emit(header)
+        self._update_window()
+
+    def _update_window(self):
+        if self.stop is not None and self.t >= self.stop:
+            if self.dumping:
+                self._emit("#{}\n".format(self.t))
+            self.dumping = False
+            self.start = None
+        elif self.start is not None and self.t >= self.start:
+            self._dump_all()
+            self.dumping = True
+            self.start = None
+
+    def set(self, signal, value):
+        try:
+            if self.signal_values[signal] == value:
+                return
+        except KeyError:
+            return
+        self.signal_values[signal] = value
+        if self.dumping:
+            self.changes.append(self._format(signal, value))
+
+    def delay(self, delay):
+        if self.changes:
+            self._emit("#{}\n".format(self.t) + "".join(self.changes))
+            self.changes.clear()
+        self.t += delay
+        if self.start is not None or self.dumping:
+            self._update_window()
+
+    def close(self):
+        if self.changes:
+            self._emit("#{}\n".format(self.t) + "".join(self.changes))
+            self.changes.clear()
+        if self.dumping:
+            self._emit("#{}\n".format(self.t))
+        self._flush()
+        self.out_file.close()
+
+
 class DummyVCDWriter:
     def init(self):
         pass
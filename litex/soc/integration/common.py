@@ -18,7 +18,10 @@ def mem_decoder(address, size=0x10000000):
     assert (address & (size - 1)) == 0
     address >>= 2 # bytes to words aligned
     size    >>= 2 # bytes to words aligned
-    return lambda a: (a[log2_int(size):-1] == (address >> log2_int(size)))
+    decoder = lambda a: (a[log2_int(size):-1] == (address >> log2_int(size)))
+    # compared bits of the 30-bit word address (the MSB is ignored), for minimal decoding
+    decoder.bits = {i: (address >> i) & 1 for i in range(log2_int(size), 29)}
+    return decoder
 
 def get_version(with_time=True):
     if with_time:
@@ -14,7 +14,8 @@
 
 import os
 import inspect
-from operator import itemgetter
+from functools import reduce
+from operator import itemgetter, or_
 
 from migen import *
 
@@ -96,7 +97,8 @@ class SoCCore(Module):
                 # Controller parameters
                 with_ctrl=True,
                 # Wishbone parameters
-                with_wishbone=True, wishbone_timeout_cycles=1e6,
+                with_wishbone=True, wishbone_timeout_cycles=1e6, wishbone_interconnect="shared",
+                wishbone_connectivity=None, wishbone_minimal_decoding=False,
                 **kwargs):
         self.platform = platform
         self.clk_freq = clk_freq
@@ -113,9 +115,11 @@ class SoCCore(Module):
         self.mem_regions = {}
         self.csr_regions = {}
 
-        # Wishbone masters/slaves lists
-        self._wb_masters = []
-        self._wb_slaves  = []
+        # Wishbone masters/slaves lists (and names, for the connectivity)
+        self._wb_masters      = []
+        self._wb_slaves       = []
+        self._wb_master_names = []
+        self._wb_slave_names  = []
 
         # CSR masters list
         self._csr_masters = []
@@ -147,8 +151,15 @@ class SoCCore(Module):
         self.with_uart     = with_uart
         self.uart_baudrate = uart_baudrate
 
-        self.with_wishbone           = with_wishbone
-        self.wishbone_timeout_cycles = wishbone_timeout_cycles
+        if wishbone_interconnect not in ["shared", "crossbar"]:
+            raise ValueError("Unsupported Wishbone interconnect: {}".format(wishbone_interconnect))
+        if wishbone_connectivity is not None and wishbone_interconnect != "crossbar":
+            raise ValueError("Wishbone connectivity requires the crossbar interconnect")
+        self.with_wishbone             = with_wishbone
+        self.wishbone_timeout_cycles   = wishbone_timeout_cycles
+        self.wishbone_interconnect     = wishbone_interconnect
+        self.wishbone_connectivity     = wishbone_connectivity
+        self.wishbone_minimal_decoding = wishbone_minimal_decoding
 
         # Modules instances ------------------------------------------------------------------------
 
@@ -183,11 +194,11 @@ class SoCCore(Module):
             self.config["CPU_RESET_ADDR"] = self.cpu.reset_address
 
             # Add CPU buses as 32-bit Wishbone masters
-            for cpu_bus in self.cpu.buses:
+            for n, cpu_bus in enumerate(self.cpu.buses):
                 assert cpu_bus.data_width in [32, 64, 128]
                 soc_bus = wishbone.Interface(data_width=32)
                 self.submodules += wishbone.Converter(cpu_bus, soc_bus)
-                self.add_wb_master(soc_bus)
+                self.add_wb_master(soc_bus, "cpu{}".format(n))
 
             # Add CPU CSR (dynamic)
             self.add_csr("cpu", allow_user_defined=True)
@@ -336,12 +347,13 @@ class SoCCore(Module):
     def initialize_rom(self, data):
         self.rom.mem.init = data
 
-    def add_wb_master(self, wbm):
+    def add_wb_master(self, wbm, name=None):
         if self.finalized:
             raise FinalizeError
         self._wb_masters.append(wbm)
+        self._wb_master_names.append(name)
 
-    def add_wb_slave(self, address_or_address_decoder, interface, size=None):
+    def add_wb_slave(self, address_or_address_decoder, interface, size=None, name=None):
         if self.finalized:
             raise FinalizeError
         if size is not None:
@@ -349,6 +361,23 @@ class SoCCore(Module):
         else:
             address_decoder = address_or_address_decoder
         self._wb_slaves.append((address_decoder, interface))
+        self._wb_slave_names.append(name)
+
+    def get_wb_connectivity(self):
+        # wishbone_connectivity maps master names to the names of the slaves they access,
+        # masters not listed access all the slaves.
+        connectivity = [range(len(self._wb_slaves))]*len(self._wb_masters)
+        if self.wishbone_connectivity is None:
+            return connectivity
+        for master_name, slave_names in self.wishbone_connectivity.items():
+            if master_name not in self._wb_master_names:
+                raise ValueError("Unknown Wishbone master {}".format(master_name))
+            for slave_name in slave_names:
+                if slave_name not in self._wb_slave_names:
+                    raise ValueError("Unknown Wishbone slave {}".format(slave_name))
+            connectivity[self._wb_master_names.index(master_name)] = \
+                [self._wb_slave_names.index(slave_name) for slave_name in slave_names]
+        return connectivity
 
     def add_csr_master(self, csrm):
         # CSR masters are not arbitrated, use this with precaution.
@@ -383,11 +412,11 @@ class SoCCore(Module):
         self.mem_regions[name] = SoCMemRegion(origin, length)
 
     def register_mem(self, name, address, interface, size=0x10000000):
-        self.add_wb_slave(address, interface, size)
+        self.add_wb_slave(address, interface, size, name)
         self.add_memory_region(name, address, size)
 
     def register_rom(self, interface, rom_size=0xa000):
-        self.add_wb_slave(self.soc_mem_map["rom"], interface, rom_size)
+        self.add_wb_slave(self.soc_mem_map["rom"], interface, rom_size, "rom")
         self.add_memory_region("rom", self.cpu.reset_address, rom_size)
 
     def check_csr_range(self, name, addr):
@@ -438,10 +467,24 @@ class SoCCore(Module):
 
         # Add the Wishbone Masters/Slaves interconnect
         if len(self._wb_masters):
-            self.submodules.wishbonecon = wishbone.InterconnectShared(self._wb_masters,
-                self._wb_slaves, register=True, timeout_cycles=self.wishbone_timeout_cycles)
-            if self.with_ctrl and (self.wishbone_timeout_cycles is not None):
-                self.comb += self.ctrl.bus_error.eq(self.wishbonecon.timeout.error)
+            if self.wishbone_minimal_decoding:
+                for (address_decoder, interface), name in zip(self._wb_slaves, self._wb_slave_names):
+                    if not hasattr(address_decoder, "bits"):
+                        raise ValueError("Wishbone slave {} needs a mem_decoder region for minimal "
+                            "decoding".format(name if name is not None else interface))
+            if self.wishbone_interconnect == "shared":
+                self.submodules.wishbonecon = wishbone.InterconnectShared(self._wb_masters,
+                    self._wb_slaves, register=True, timeout_cycles=self.wishbone_timeout_cycles,
+                    minimal=self.wishbone_minimal_decoding)
+                timeouts = [self.wishbonecon.timeout] if self.wishbone_timeout_cycles is not None else []
+            else:
+                self.submodules.wishbonecon = wishbone.Crossbar(self._wb_masters,
+                    self._wb_slaves, register=True, connectivity=self.get_wb_connectivity(),
+                    minimal=self.wishbone_minimal_decoding,
+                    timeout_cycles=self.wishbone_timeout_cycles)
+                timeouts = self.wishbonecon.timeouts
+            if self.with_ctrl and timeouts:
+                self.comb += self.ctrl.bus_error.eq(reduce(or_, [t.error for t in timeouts]))
 
         # Collect and create CSRs
         self.submodules.csrbankarray = csr_bus.CSRBankArray(self,
@@ -523,6 +566,12 @@ def soc_core_args(parser):
                         help="size/enable the integrated main RAM")
     parser.add_argument("--uart-stub", default=False, type=bool,
                         help="enable uart stub")
+    parser.add_argument("--csr-data-width", default=None, type=int, choices=[8, 32],
+                        help="CSR bus data width, 32 to access 32-bit CSRs with a single load")
+    parser.add_argument("--wishbone-interconnect", default=None, choices=["shared", "crossbar"],
+                        help="select Wishbone interconnect: shared bus or crossbar")
+    parser.add_argument("--wishbone-minimal-decoding", action="store_true", default=None,
+                        help="only decode the address bits telling the Wishbone slaves apart")
 
 
 def soc_core_argdict(args):
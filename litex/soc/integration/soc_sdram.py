@@ -24,12 +24,17 @@ class SoCSDRAM(SoCCore):
     }
     csr_map.update(SoCCore.csr_map)
 
-    def __init__(self, platform, clk_freq, l2_size=8192, **kwargs):
+    def __init__(self, platform, clk_freq, l2_size=8192, l2_ways=1, l2_linesize=None,
+                 l2_write_through=False, with_l2_stats=False, **kwargs):
         SoCCore.__init__(self, platform, clk_freq, **kwargs)
         if not self.integrated_main_ram_size:
             if self.cpu_type is not None and self.csr_data_width != 8:
                  raise NotImplementedError("BIOS supports SDRAM initialization only for csr_data_width=8")
         self.l2_size = l2_size
+        self.l2_ways = l2_ways
+        self.l2_linesize = l2_linesize
+        self.l2_write_through = l2_write_through
+        self.with_l2_stats = with_l2_stats
 
         self._sdram_phy    = []
         self._wb_sdram_ifs = []
@@ -64,7 +69,10 @@ class SoCSDRAM(SoCCore):
                                 geom_settings.colbits)*phy.settings.databits//8
             main_ram_size = min(main_ram_size, 0x20000000) # FIXME: limit to 512MB for now
 
-            l2_size = max(self.l2_size, int(2*port.data_width/8)) # L2 has a minimal size, use it if lower
+            l2_linesize = self.l2_linesize
+            if l2_linesize is None:
+                l2_linesize = max(32//port.data_width, 1)         # Default to a master word per line
+            l2_size = max(self.l2_size, int(2*self.l2_ways*l2_linesize*port.data_width/8)) # L2 has a minimal size, use it if lower
             l2_size = 2**int(log2(l2_size))                       # Round to nearest power of 2
 
             # SoC <--> L2 Cache Wishbone interface -------------------------------------------------
@@ -73,7 +81,9 @@ class SoCSDRAM(SoCCore):
             self.register_mem("main_ram", self.mem_map["main_ram"], wb_sdram, main_ram_size)
 
             # L2 Cache -----------------------------------------------------------------------------
-            l2_cache = wishbone.Cache(l2_size//4, self._wb_sdram, wishbone.Interface(port.data_width))
+            l2_cache = wishbone.Cache(l2_size//4, self._wb_sdram, wishbone.Interface(port.data_width),
+                ways=self.l2_ways, linesize=l2_linesize, write_through=self.l2_write_through,
+                with_csr=self.with_l2_stats)
             # XXX Vivado ->2018.2 workaround, Vivado is not able to map correctly our L2 cache.
             # Issue is reported to Xilinx, Remove this if ever fixed by Xilinx...
             from litex.build.xilinx.vivado import XilinxVivadoToolchain
@@ -83,6 +93,8 @@ class SoCSDRAM(SoCCore):
             else:
                 self.submodules.l2_cache = l2_cache
             self.config["L2_SIZE"] = l2_size
+            if self.l2_ways > 1:
+                self.config["L2_WAYS"] = self.l2_ways
 
             # L2 Cache <--> LiteDRAM bridge --------------------------------------------------------
             self.submodules.wishbone_bridge = LiteDRAMWishbone2Native(self.l2_cache.slave, port)
@@ -205,7 +205,7 @@ class SoCZynq(SoCCore):
         wb = wishbone.Interface()
         axi2wishbone = axi.AXI2Wishbone(axi_port, wb, base_address)
         self.submodules += axi2wishbone
-        self.add_wb_master(wb)
+        self.add_wb_master(wb, "axi2wishbone")
 
     def do_finalize(self):
         SoCCore.do_finalize(self)
@@ -4,7 +4,8 @@
 # License: BSD
 
 from functools import reduce
-from operator import or_
+from operator import or_, and_
+from itertools import combinations
 
 from migen import *
 from migen.genlib import roundrobin
@@ -31,6 +32,21 @@ _layout = [
     ("err",              1, DIR_S_TO_M)
 ]
 
+_pipelined_layout = _layout + [
+    ("stall",            1, DIR_S_TO_M)
+]
+
+# Cycle type identifiers and burst type extensions of registered feedback bursts
+CTI_BURST_NONE         = 0b000
+CTI_BURST_CONSTANT     = 0b001
+CTI_BURST_INCREMENTING = 0b010
+CTI_BURST_END          = 0b111
+
+BTE_LINEAR  = 0b00
+BTE_WRAP_4  = 0b01
+BTE_WRAP_8  = 0b10
+BTE_WRAP_16 = 0b11
+
 
 class Interface(Record):
     def __init__(self, data_width=32, adr_width=30):
@@ -69,6 +85,103 @@ class Interface(Record):
         yield from self._do_transaction()
         return (yield self.dat_r)
 
+    def _burst_adrs(self, adr, length, bte):
+        wrap = {BTE_LINEAR: 0, BTE_WRAP_4: 4, BTE_WRAP_8: 8, BTE_WRAP_16: 16}[bte]
+        if not wrap:
+            return [adr + i for i in range(length)]
+        return [adr - adr%wrap + (adr + i)%wrap for i in range(length)]
+
+    def _do_burst(self, adrs, datas=None):
+        yield self.cyc.eq(1)
+        yield self.stb.eq(1)
+        results = []
+        for i, adr in enumerate(adrs):
+            yield self.adr.eq(adr)
+            yield self.cti.eq(CTI_BURST_END if i == len(adrs) - 1 else CTI_BURST_INCREMENTING)
+            if datas is not None:
+                yield self.dat_w.eq(datas[i])
+            yield
+            while not (yield self.ack):
+                yield
+            results.append((yield self.dat_r))
+        yield self.cyc.eq(0)
+        yield self.stb.eq(0)
+        yield self.cti.eq(CTI_BURST_NONE)
+        yield self.bte.eq(BTE_LINEAR)
+        return results
+
+    def write_burst(self, adr, datas, sel=None, bte=BTE_LINEAR):
+        if sel is None:
+            sel = 2**len(self.sel) - 1
+        yield self.sel.eq(sel)
+        yield self.we.eq(1)
+        yield self.bte.eq(bte)
+        yield from self._do_burst(self._burst_adrs(adr, len(datas), bte), datas)
+
+    def read_burst(self, adr, length, bte=BTE_LINEAR):
+        yield self.we.eq(0)
+        yield self.bte.eq(bte)
+        return (yield from self._do_burst(self._burst_adrs(adr, length, bte)))
+
+
+class PipelinedInterface(Record):
+    """Pipelined interface
+
+    Wishbone B4 pipelined mode: a request is accepted in each cycle stb is asserted and stall is
+    not, the master does not wait for the ack of a request to issue the next one. Acks are
+    returned in the order of the requests, the master keeps cyc asserted until all the requests
+    it issued are acked.
+    """
+    def __init__(self, data_width=32, adr_width=30):
+        self.data_width = data_width
+        self.adr_width  = adr_width
+        Record.__init__(self, set_layout_parameters(_pipelined_layout,
+            adr_width=adr_width,
+            data_width=data_width,
+            sel_width=data_width//8))
+
+    @staticmethod
+    def like(other):
+        return PipelinedInterface(len(other.dat_w))
+
+    def _do_pipelined(self, adrs, datas=None):
+        yield self.cyc.eq(1)
+        results = []
+        n = 0
+        while len(results) < len(adrs):
+            if n < len(adrs):
+                yield self.stb.eq(1)
+                yield self.adr.eq(adrs[n])
+                if datas is not None:
+                    yield self.dat_w.eq(datas[n])
+            else:
+                yield self.stb.eq(0)
+            yield
+            if n < len(adrs) and not (yield self.stall):
+                n += 1
+            if (yield self.ack):
+                results.append((yield self.dat_r))
+        yield self.cyc.eq(0)
+        yield self.stb.eq(0)
+        return results
+
+    def write_pipelined(self, adrs, datas, sel=None):
+        if sel is None:
+            sel = 2**len(self.sel) - 1
+        yield self.sel.eq(sel)
+        yield self.we.eq(1)
+        yield from self._do_pipelined(adrs, datas)
+
+    def read_pipelined(self, adrs):
+        yield self.we.eq(0)
+        return (yield from self._do_pipelined(adrs))
+
+    def write(self, adr, dat, sel=None):
+        yield from self.write_pipelined([adr], [dat], sel)
+
+    def read(self, adr):
+        return (yield from self.read_pipelined([adr]))[0]
+
 
 class InterconnectPointToPoint(Module):
     def __init__(self, master, slave):
@@ -76,23 +189,32 @@ class InterconnectPointToPoint(Module):
 
 
 class Arbiter(Module):
+    """Arbiter
+
+    Grants the target to the masters in round-robin order. A master keeps the grant as long as
+    it asserts cyc, bursts are not interleaved with the accesses of other masters. Masters and
+    target are either classic Interfaces or PipelinedInterfaces: a pipelined master keeps the
+    grant until its outstanding requests are acked and the other masters are stalled.
+    """
     def __init__(self, masters, target):
         self.submodules.rr = roundrobin.RoundRobin(len(masters))
 
         # mux master->slave signals
-        for name, size, direction in _layout:
+        for name, size, direction in target.layout:
             if direction == DIR_M_TO_S:
                 choices = Array(getattr(m, name) for m in masters)
                 self.comb += getattr(target, name).eq(choices[self.rr.grant])
 
         # connect slave->master signals
-        for name, size, direction in _layout:
+        for name, size, direction in target.layout:
             if direction == DIR_S_TO_M:
                 source = getattr(target, name)
                 for i, m in enumerate(masters):
                     dest = getattr(m, name)
                     if name == "ack" or name == "err":
                         self.comb += dest.eq(source & (self.rr.grant == i))
+                    elif name == "stall":
+                        self.comb += dest.eq(source | (self.rr.grant != i))
                     else:
                         self.comb += dest.eq(source)
 
@@ -101,6 +223,50 @@ class Arbiter(Module):
         self.comb += self.rr.request.eq(Cat(*reqs))
 
 
+def _minimal_decoders(decoders):
+    """Minimal address decoders
+
+    ``decoders`` are address decoding functions with a ``bits`` attribute, a dict of the address
+    bits they compare and of their values (see mem_decoder). Returns decoding functions comparing
+    the fewest address bits telling the regions apart: addresses of a region select its decoder
+    only, other addresses select at most one decoder.
+    """
+    for i, decoder in enumerate(decoders):
+        if not hasattr(decoder, "bits"):
+            raise ValueError("Decoder of slave {} does not describe the address bits it compares, "
+                "minimal decoding needs mem_decoder regions".format(i))
+
+    # bits telling each pair of regions apart
+    pairs = {}
+    for i, j in combinations(range(len(decoders)), 2):
+        bits_i, bits_j = decoders[i].bits, decoders[j].bits
+        pairs[i, j] = set(b for b in bits_i if b in bits_j and bits_i[b] != bits_j[b])
+        if not pairs[i, j]:
+            raise ValueError("Address regions {} and {} overlap".format(i, j))
+
+    # compare the bits telling most pairs apart first
+    selected = set()
+    while pairs:
+        counts = {}
+        for bits in pairs.values():
+            for b in bits:
+                counts[b] = counts.get(b, 0) + 1
+        bit = max(counts, key=lambda b: (counts[b], b))
+        selected.add(bit)
+        pairs = {pair: bits for pair, bits in pairs.items() if bit not in bits}
+
+    def minimal_decoder(bits):
+        compared = sorted(b for b in bits if b in selected)
+        value = sum(bits[b] << n for n, b in enumerate(compared))
+        if compared:
+            decoder = lambda a: Cat(*[a[b] for b in compared]) == value
+        else:
+            decoder = lambda a: 1
+        decoder.bits = {b: bits[b] for b in compared}
+        return decoder
+    return [minimal_decoder(decoder.bits) for decoder in decoders]
+
+
 class Decoder(Module):
     # slaves is a list of pairs:
     # 0) function that takes the address signal and returns a FHDL expression
@@ -108,11 +274,18 @@ class Decoder(Module):
     # 1) wishbone.Slave reference.
     # register adds flip-flops after the address comparators. Improves timing,
     # but breaks Wishbone combinatorial feedback.
-    def __init__(self, master, slaves, register=False):
+    # minimal only compares the address bits telling the slaves apart, the functions
+    # must then describe the bits they compare (see mem_decoder). Unmapped addresses
+    # are no longer decoded as errors but alias on the slaves.
+    def __init__(self, master, slaves, register=False, minimal=False):
         ns = len(slaves)
         slave_sel = Signal(ns)
         slave_sel_r = Signal(ns)
 
+        if minimal:
+            matches, busses = zip(*slaves)
+            slaves = list(zip(_minimal_decoders(matches), busses))
+
         # decode slave addresses
         self.comb += [slave_sel[i].eq(fun(master.adr))
             for i, (fun, bus) in enumerate(slaves)]
@@ -142,6 +315,71 @@ class Decoder(Module):
         self.comb += master.dat_r.eq(reduce(or_, masked))
 
 
+class PipelinedDecoder(Module):
+    """Pipelined decoder
+
+    Decodes the requests of a pipelined master to pipelined slaves, ``slaves`` being pairs of
+    address decoding functions and PipelinedInterfaces as for the Decoder. Requests to a slave
+    are issued while the previous ones are outstanding, up to ``max_pending`` requests. A
+    request to another slave is stalled until the outstanding requests are acked, acks are
+    then returned in order.
+    """
+    def __init__(self, master, slaves, max_pending=16):
+        ns = len(slaves)
+        slave_sel = Signal(ns)
+        slave_sel_r = Signal(ns)
+        resp_sel = Signal(ns)
+        pending = Signal(max=max_pending + 1)
+        accept = Signal()
+        stall = Signal()
+
+        # decode slave addresses
+        self.comb += [slave_sel[i].eq(fun(master.adr))
+            for i, (fun, bus) in enumerate(slaves)]
+
+        # track the slave and the number of outstanding requests
+        self.comb += [
+            stall.eq((pending == max_pending) | ((pending != 0) & (slave_sel != slave_sel_r))),
+            accept.eq(master.cyc & master.stb & ~master.stall),
+            # acks in the cycle of the request come from the decoded slave
+            resp_sel.eq(Mux(pending == 0, slave_sel, slave_sel_r))
+        ]
+        self.sync += [
+            If(accept, slave_sel_r.eq(slave_sel)),
+            If(~master.cyc,
+                pending.eq(0)
+            ).Elif(accept & ~(master.ack | master.err),
+                pending.eq(pending + 1)
+            ).Elif(~accept & (master.ack | master.err),
+                pending.eq(pending - 1)
+            )
+        ]
+
+        # connect master->slaves signals except cyc and stb
+        for slave in slaves:
+            for name, size, direction in _pipelined_layout:
+                if direction == DIR_M_TO_S and name not in ["cyc", "stb"]:
+                    self.comb += getattr(slave[1], name).eq(getattr(master, name))
+
+        # slaves keep cyc while they have outstanding requests
+        self.comb += [slave[1].cyc.eq(master.cyc & (slave_sel[i] | (slave_sel_r[i] & (pending != 0))))
+            for i, slave in enumerate(slaves)]
+        self.comb += [slave[1].stb.eq(master.stb & slave_sel[i] & ~stall)
+            for i, slave in enumerate(slaves)]
+
+        # generate master ack, err and stall
+        self.comb += [
+            master.ack.eq(reduce(or_, [slave[1].ack & resp_sel[i] for i, slave in enumerate(slaves)])),
+            master.err.eq(reduce(or_, [slave[1].err & resp_sel[i] for i, slave in enumerate(slaves)])),
+            master.stall.eq(stall | reduce(or_, [slave[1].stall & slave_sel[i]
+                for i, slave in enumerate(slaves)]))
+        ]
+
+        # mux (1-hot) slave data return
+        masked = [Replicate(resp_sel[i], len(master.dat_r)) & slaves[i][1].dat_r for i in range(ns)]
+        self.comb += master.dat_r.eq(reduce(or_, masked))
+
+
 class Timeout(Module):
     def __init__(self, master, cycles):
         self.error = Signal()
@@ -161,25 +399,59 @@ class Timeout(Module):
 
 
 class InterconnectShared(Module):
-    def __init__(self, masters, slaves, register=False, timeout_cycles=1e6):
+    def __init__(self, masters, slaves, register=False, timeout_cycles=1e6, minimal=False):
         shared = Interface()
         self.submodules.arbiter = Arbiter(masters, shared)
-        self.submodules.decoder = Decoder(shared, slaves, register)
+        self.submodules.decoder = Decoder(shared, slaves, register, minimal)
         if timeout_cycles is not None:
             self.submodules.timeout = Timeout(shared, timeout_cycles)
 
 
+class PipelinedInterconnectShared(Module):
+    def __init__(self, masters, slaves, max_pending=16):
+        shared = PipelinedInterface()
+        self.submodules.arbiter = Arbiter(masters, shared)
+        self.submodules.decoder = PipelinedDecoder(shared, slaves, max_pending)
+
+
 class Crossbar(Module):
-    def __init__(self, masters, slaves, register=False):
-        matches, busses = zip(*slaves)
-        access = [[Interface() for j in slaves] for i in masters]
+    """Crossbar
+
+    Each slave has its own Arbiter: masters accessing different slaves are not serialized.
+    ``connectivity`` gives, for each master, the indices of the slaves it is connected to, for a
+    partial crossbar (all the slaves when None). ``register`` is passed to the Decoder of each
+    master. With ``minimal``, minimal decoders are computed over all the slaves, so a master
+    accessing a slave it is not connected to still selects none. With ``timeout_cycles``, a
+    Timeout is added on each master, listed in ``timeouts``.
+    """
+    def __init__(self, masters, slaves, register=False, connectivity=None, minimal=False,
+                 timeout_cycles=None):
+        if connectivity is None:
+            connectivity = [range(len(slaves))]*len(masters)
+        if minimal:
+            matches, busses = zip(*slaves)
+            slaves = list(zip(_minimal_decoders(matches), busses))
+        columns = [[] for slave in slaves]
         # decode each master into its access row
-        for row, master in zip(access, masters):
-            row = list(zip(matches, row))
+        for master, indices in zip(masters, connectivity):
+            row = []
+            for j in indices:
+                access = Interface()
+                row.append((slaves[j][0], access))
+                columns[j].append(access)
+            if not row:
+                raise ValueError("Master not connected to any slave")
             self.submodules += Decoder(master, row, register)
         # arbitrate each access column onto its slave
-        for column, bus in zip(zip(*access), busses):
-            self.submodules += Arbiter(column, bus)
+        for column, (match, bus) in zip(columns, slaves):
+            if column:
+                self.submodules += Arbiter(column, bus)
+        self.timeouts = []
+        if timeout_cycles is not None:
+            for master in masters:
+                timeout = Timeout(master, timeout_cycles)
+                self.submodules += timeout
+                self.timeouts.append(timeout)
 
 
 class DownConverter(Module):
@@ -196,6 +468,8 @@ class DownConverter(Module):
         Read from master are splitted in N reads to the the slave. Read datas from
         the slave are cached before being presented concatenated on the last access.
 
+    The N accesses are done as an incrementing burst on the slave, which continues
+    over the accesses of a linear incrementing burst of the master.
     """
     def __init__(self, master, slave):
         dw_from = len(master.dat_r)
@@ -206,6 +480,8 @@ class DownConverter(Module):
 
         read = Signal()
         write = Signal()
+        burst = Signal()
+        self.comb += burst.eq((master.cti == CTI_BURST_INCREMENTING) & (master.bte == BTE_LINEAR))
 
         counter = Signal(max=ratio)
         counter_reset = Signal()
@@ -241,7 +517,9 @@ class DownConverter(Module):
                     counter_ce.eq(1),
                     If(counter_done,
                         master.ack.eq(1),
-                        NextState("IDLE")
+                        If(~burst,
+                            NextState("IDLE")
+                        )
                     )
                 )
             ).Elif(~master.cyc,
@@ -257,7 +535,9 @@ class DownConverter(Module):
                     counter_ce.eq(1),
                     If(counter_done,
                         master.ack.eq(1),
-                        NextState("IDLE")
+                        If(~burst,
+                            NextState("IDLE")
+                        )
                     )
                 )
             ).Elif(~master.cyc,
@@ -267,10 +547,10 @@ class DownConverter(Module):
 
         # Address
         self.comb += [
-            If(counter_done,
-                slave.cti.eq(7) # indicate end of burst
+            If(counter_done & ~burst,
+                slave.cti.eq(CTI_BURST_END)
             ).Else(
-                slave.cti.eq(2)
+                slave.cti.eq(CTI_BURST_INCREMENTING)
             ),
             slave.adr.eq(Cat(counter, master.adr))
         ]
@@ -425,7 +705,7 @@ class UpConverter(Module):
 
         # Address
         self.comb += [
-            slave.cti.eq(7), # we are not able to generate bursts since up-converting
+            slave.cti.eq(CTI_BURST_END), # we are not able to generate bursts since up-converting
             slave.adr.eq(address.q[ratiobits:])
         ]
 
@@ -489,13 +769,112 @@ class Converter(Module):
             self.comb += master.connect(slave)
 
 
-class Cache(Module):
+class ClassicToPipelined(Module):
+    """Classic to pipelined bridge
+
+    Issues each access of a classic master as a single request to a pipelined slave.
+    """
+    def __init__(self, master, slave):
+        self.master = master
+        self.slave = slave
+
+        # # #
+
+        issued = Signal()
+        for name, size, direction in _layout:
+            if direction == DIR_M_TO_S and name != "stb":
+                self.comb += getattr(slave, name).eq(getattr(master, name))
+            elif direction == DIR_S_TO_M:
+                self.comb += getattr(master, name).eq(getattr(slave, name))
+        self.comb += slave.stb.eq(master.stb & ~issued)
+        self.sync += [
+            If(slave.cyc & slave.stb & ~slave.stall, issued.eq(1)),
+            If(~master.cyc | slave.ack | slave.err, issued.eq(0))
+        ]
+
+
+class PipelinedToClassic(Module):
+    """Pipelined to classic bridge
+
+    Stalls the requests of a pipelined master until they are acked by a classic slave, a single
+    request is outstanding at a time.
+    """
+    def __init__(self, master, slave):
+        self.master = master
+        self.slave = slave
+
+        # # #
+
+        for name, size, direction in _layout:
+            if direction == DIR_M_TO_S:
+                self.comb += getattr(slave, name).eq(getattr(master, name))
+            else:
+                self.comb += getattr(master, name).eq(getattr(slave, name))
+        self.comb += master.stall.eq(master.stb & ~(slave.ack | slave.err))
+
+
+class _PseudoLRU(Module):
+    """Tree pseudo-LRU replacement state of the sets of a cache
+
+    ``victim`` is the way to replace in the set ``adr``, ``we`` records an access to ``way``.
+    """
+    def __init__(self, ways, setbits):
+        self.adr = Signal(setbits)
+        self.we = Signal()
+        self.way = Signal(max=ways)
+        self.victim = Signal(max=ways)
+
+        # # #
+
+        levels = log2_int(ways)
+
+        # one bit per node of the tree, pointing to the half holding the victim
+        mem = Memory(ways - 1, 2**setbits)
+        port = mem.get_port(write_capable=True)
+        self.specials += mem, port
+        bits = Signal(ways - 1)
+        new_bits = Signal(ways - 1)
+        self.comb += [
+            port.adr.eq(self.adr),
+            bits.eq(port.dat_r),
+            port.dat_w.eq(new_bits),
+            port.we.eq(self.we)
+        ]
+
+        def path(way):
+            node = 1
+            for level in range(levels):
+                direction = (way >> (levels - 1 - level)) & 1
+                yield node - 1, direction
+                node = 2*node + direction
+
+        for way in range(ways):
+            self.comb += [
+                If(reduce(and_, [bits[n] == d for n, d in path(way)]),
+                    self.victim.eq(way)
+                ),
+                # an accessed way is pointed away from
+                If(self.way == way,
+                    new_bits.eq(bits),
+                    *[new_bits[n].eq(1 - d) for n, d in path(way)]
+                )
+            ]
+
+
+class Cache(Module, csr.AutoCSR):
     """Cache
 
     This module is a write-back wishbone cache that can be used as a L2 cache.
-    Cachesize (in 32-bit words) is the size of the data store and must be a power of 2
+    Cachesize (in 32-bit words) is the size of the data store and must be a power of 2.
+
+    The cache is ``ways``-way set-associative with a pseudo-LRU replacement. Lines are
+    ``linesize`` slave words long (a power of 2, at least a master word), they are evicted and
+    refilled with incrementing bursts on the slave. With ``write_through``, writes are performed
+    on the slave and update the lines they hit, no line is allocated on writes. ``with_csr`` adds
+    CSRs counting the hits, the misses and the evictions of dirty lines.
     """
-    def __init__(self, cachesize, master, slave):
+    def __init__(self, cachesize, master, slave, ways=1, linesize=None, write_through=False,
+                 with_csr=False):
         self.master = master
         self.slave = slave
 
@@ -509,67 +888,35 @@ class Cache(Module):
             raise ValueError("Master data width must be a multiple of {dw}".format(dw=dw_to))
 
         # Split address:
-        # TAG | LINE NUMBER | LINE OFFSET
+        # TAG | SET | ROW | OFFSET
+        # Rows of the data memories hold a slave word, or a master word when wider. Lines are
+        # made of rows, the slave address of a word of a line is TAG | SET | WORD.
         offsetbits = log2_int(max(dw_to//dw_from, 1))
-        addressbits = len(slave.adr) + offsetbits
-        linebits = log2_int(cachesize) - offsetbits
-        tagbits = addressbits - linebits
         wordbits = log2_int(max(dw_from//dw_to, 1))
-        adr_offset, adr_line, adr_tag = split(master.adr, offsetbits, linebits, tagbits)
-        word = Signal(wordbits) if wordbits else None
-
-        # Data memory
-        data_mem = Memory(dw_to*2**wordbits, 2**linebits)
-        data_port = data_mem.get_port(write_capable=True, we_granularity=8)
-        self.specials += data_mem, data_port
-
-        write_from_slave = Signal()
-        if adr_offset is None:
-            adr_offset_r = None
-        else:
-            adr_offset_r = Signal(offsetbits)
-            self.sync += adr_offset_r.eq(adr_offset)
-
-        self.comb += [
-            data_port.adr.eq(adr_line),
-            If(write_from_slave,
-                displacer(slave.dat_r, word, data_port.dat_w),
-                displacer(Replicate(1, dw_to//8), word, data_port.we)
-            ).Else(
-                data_port.dat_w.eq(Replicate(master.dat_w, max(dw_to//dw_from, 1))),
-                If(master.cyc & master.stb & master.we & master.ack,
-                    displacer(master.sel, adr_offset, data_port.we, 2**offsetbits, reverse=True)
-                )
-            ),
-            chooser(data_port.dat_r, word, slave.dat_w),
-            slave.sel.eq(2**(dw_to//8)-1),
-            chooser(data_port.dat_r, adr_offset_r, master.dat_r, reverse=True)
-        ]
-
-
-        # Tag memory
-        tag_layout = [("tag", tagbits), ("dirty", 1)]
-        tag_mem = Memory(layout_len(tag_layout), 2**linebits)
-        tag_port = tag_mem.get_port(write_capable=True)
-        self.specials += tag_mem, tag_port
-        tag_do = Record(tag_layout)
-        tag_di = Record(tag_layout)
-        self.comb += [
-            tag_do.raw_bits().eq(tag_port.dat_r),
-            tag_port.dat_w.eq(tag_di.raw_bits())
-        ]
-
-        self.comb += [
-            tag_port.adr.eq(adr_line),
-            tag_di.tag.eq(adr_tag)
-        ]
-        if word is not None:
-            self.comb += slave.adr.eq(Cat(word, adr_line, tag_do.tag))
-        else:
-            self.comb += slave.adr.eq(Cat(adr_line, tag_do.tag))
+        if linesize is None:
+            linesize = 2**wordbits
+        linewordbits = log2_int(linesize)
+        if linewordbits < wordbits:
+            raise ValueError("Line size must be at least {} slave words".format(2**wordbits))
+        rowbits = linewordbits - wordbits
+        setbits = log2_int(cachesize//ways) - offsetbits - rowbits
+        if setbits < 1:
+            raise ValueError("Cache size must be at least {} words".format(
+                2*ways*2**(offsetbits + rowbits)))
+        tagbits = len(slave.adr) - linewordbits - setbits
+        adr_offset, adr_row, adr_set, adr_tag = split(master.adr,
+            offsetbits, rowbits, setbits, tagbits)
+
+        def cat(*parts):
+            return Cat(*[part for part in parts if part is not None])
+
+        def select(values, index):
+            return values[0] if len(values) == 1 else Array(values)[index]
 
         # slave word computation, word_clr and word_inc will be simplified
-        # at synthesis when wordbits=0
+        # at synthesis when linesize=1
+        word = Signal(linewordbits) if linewordbits else None
+        word_next = Signal(linewordbits) if linewordbits else None
         word_clr = Signal()
         word_inc = Signal()
         if word is not None:
@@ -579,15 +926,163 @@ class Cache(Module):
                 ).Elif(word_inc,
                     word.eq(word+1)
                 )
+            self.comb += word_next.eq(word + word_inc)
 
-        def word_is_last(word):
-            if word is not None:
-                return word == 2**wordbits-1
+        def word_bits(word, start, end):
+            return word[start:end] if end > start else None
+
+        def word_is_last(bits):
+            if bits:
+                return word[:bits] == 2**bits-1
             else:
                 return 1
 
-        # Control FSM
         self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+
+        # Ways: the hit way is accessed when testing hits, the way latched then otherwise
+        hit = Signal()
+        hit_way = Signal(max=max(ways, 2))
+        victim = Signal(max=max(ways, 2))
+        way = Signal(max=max(ways, 2))
+        way_ce = Signal()
+        cur_way = Signal(max=max(ways, 2))
+        self.sync += If(way_ce, way.eq(Mux(hit, hit_way, victim)))
+        self.comb += cur_way.eq(Mux(fsm.ongoing("TEST_HIT"), hit_way, way))
+
+        # Data memories
+        data_adr = Signal(setbits + rowbits)
+        self.comb += \
+            If(fsm.ongoing("REFILL"),
+                data_adr.eq(cat(word_bits(word, wordbits, linewordbits), adr_set))
+            ).Elif(fsm.ongoing("EVICT"),
+                # read ahead, for the word sent after the current one is acked
+                data_adr.eq(cat(word_bits(word_next, wordbits, linewordbits), adr_set))
+            ).Else(
+                data_adr.eq(cat(adr_row, adr_set))
+            )
+
+        write_from_slave = Signal()
+        write_from_master = Signal()
+        data_ports = []
+        for i in range(ways):
+            data_mem = Memory(dw_to*2**wordbits, 2**(setbits + rowbits))
+            data_port = data_mem.get_port(write_capable=True, we_granularity=8)
+            self.specials += data_mem, data_port
+            data_ports.append(data_port)
+            self.comb += [
+                data_port.adr.eq(data_adr),
+                If(write_from_slave,
+                    displacer(slave.dat_r, word_bits(word, 0, wordbits), data_port.dat_w),
+                    If(cur_way == i,
+                        displacer(Replicate(1, dw_to//8), word_bits(word, 0, wordbits), data_port.we)
+                    )
+                ).Else(
+                    data_port.dat_w.eq(Replicate(master.dat_w, max(dw_to//dw_from, 1))),
+                    If(write_from_master & (cur_way == i),
+                        displacer(master.sel, adr_offset, data_port.we, 2**offsetbits, reverse=True)
+                    )
+                )
+            ]
+        data_dat_r = select([data_port.dat_r for data_port in data_ports], cur_way)
+        self.comb += chooser(data_dat_r, adr_offset, master.dat_r, reverse=True)
+
+        # Tag memories
+        tag_layout = [("tag", tagbits), ("dirty", 1), ("valid", 1)]
+        tag_we = Signal()
+        tag_di = Record(tag_layout)
+        tag_dos = []
+        for i in range(ways):
+            tag_mem = Memory(layout_len(tag_layout), 2**setbits)
+            tag_port = tag_mem.get_port(write_capable=True)
+            self.specials += tag_mem, tag_port
+            tag_do = Record(tag_layout)
+            tag_dos.append(tag_do)
+            self.comb += [
+                tag_do.raw_bits().eq(tag_port.dat_r),
+                tag_port.dat_w.eq(tag_di.raw_bits()),
+                tag_port.adr.eq(adr_set),
+                tag_port.we.eq(tag_we & (cur_way == i))
+            ]
+        self.comb += [
+            tag_di.tag.eq(adr_tag),
+            tag_di.valid.eq(1)
+        ]
+
+        # Hit detection and replacement: the first invalid way, or the pseudo-LRU one
+        hits = Signal(ways)
+        self.comb += [
+            hits.eq(Cat(*[tag_do.valid & (tag_do.tag == adr_tag) for tag_do in tag_dos])),
+            hit.eq(hits != 0)
+        ]
+        for i in reversed(range(ways)):
+            self.comb += If(hits[i], hit_way.eq(i))
+        lru_we = Signal()
+        if ways > 1:
+            self.submodules.lru = lru = _PseudoLRU(ways, setbits)
+            self.comb += [
+                lru.adr.eq(adr_set),
+                lru.we.eq(lru_we),
+                lru.way.eq(hit_way),
+                victim.eq(lru.victim)
+            ]
+            for i in reversed(range(ways)):
+                self.comb += If(~tag_dos[i].valid, victim.eq(i))
+        victim_do = select(tag_dos, victim)
+
+        # Slave
+        slave_tag = Signal(tagbits)
+        self.comb += [
+            If(fsm.ongoing("EVICT"),
+                slave_tag.eq(select(tag_dos, way).tag)
+            ).Else(
+                slave_tag.eq(adr_tag)
+            ),
+            If(fsm.ongoing("WRITE"),
+                slave.adr.eq(cat(word_bits(word, 0, wordbits), adr_row, adr_set, adr_tag)),
+                slave.dat_w.eq(Replicate(master.dat_w, max(dw_to//dw_from, 1))),
+                displacer(master.sel, adr_offset, slave.sel, 2**offsetbits, reverse=True)
+            ).Else(
+                slave.adr.eq(cat(word, adr_set, slave_tag)),
+                slave.sel.eq(2**(dw_to//8)-1)
+            )
+        ]
+        if wordbits:
+            self.comb += If(fsm.ongoing("WRITE"),
+                chooser(master.dat_w, word_bits(word, 0, wordbits), slave.dat_w),
+                chooser(master.sel, word_bits(word, 0, wordbits), slave.sel)
+            ).Else(
+                chooser(data_dat_r, word_bits(word, 0, wordbits), slave.dat_w)
+            )
+        else:
+            self.comb += If(~fsm.ongoing("WRITE"), slave.dat_w.eq(data_dat_r))
+        if rowbits:
+            # data of the first word read after entering the state
+            evict_ready = Signal()
+            self.sync += evict_ready.eq(fsm.ongoing("EVICT"))
+        else:
+            evict_ready = 1
+
+        # Statistics
+        hit_event = Signal()
+        miss_event = Signal()
+        eviction_event = Signal()
+        missed = Signal() # hits after the refills of misses are not counted
+        self.sync += If(master.ack, missed.eq(0)).Elif(miss_event, missed.eq(1))
+        if with_csr:
+            self._hits = csr.CSRStatus(32, name="hits")
+            self._misses = csr.CSRStatus(32, name="misses")
+            self._evictions = csr.CSRStatus(32, name="evictions")
+            self._clear = csr.CSR(name="clear")
+            for counter, event in [(self._hits, hit_event), (self._misses, miss_event),
+                                   (self._evictions, eviction_event)]:
+                self.sync += \
+                    If(self._clear.re,
+                        counter.status.eq(0)
+                    ).Elif(event,
+                        counter.status.eq(counter.status + 1)
+                    )
+
+        # Control FSM
         fsm.act("IDLE",
             If(master.cyc & master.stb,
                 NextState("TEST_HIT")
@@ -595,56 +1090,87 @@ class Cache(Module):
         )
         fsm.act("TEST_HIT",
             word_clr.eq(1),
-            If(tag_do.tag == adr_tag,
+            way_ce.eq(1),
+            If(master.we & write_through,
+                hit_event.eq(hit),
+                miss_event.eq(~hit),
+                lru_we.eq(hit),
+                write_from_master.eq(hit),
+                NextState("WRITE")
+            ).Elif(hit,
+                hit_event.eq(~missed),
+                lru_we.eq(1),
                 master.ack.eq(1),
                 If(master.we,
+                    write_from_master.eq(1),
                     tag_di.dirty.eq(1),
-                    tag_port.we.eq(1)
+                    tag_we.eq(1)
                 ),
                 NextState("IDLE")
             ).Else(
-                If(tag_do.dirty,
+                miss_event.eq(~missed),
+                If(victim_do.valid & victim_do.dirty,
+                    eviction_event.eq(1),
                     NextState("EVICT")
                 ).Else(
                     NextState("REFILL_WRTAG")
                 )
             )
         )
-
-        fsm.act("EVICT",
+        fsm.act("WRITE",
             slave.stb.eq(1),
             slave.cyc.eq(1),
             slave.we.eq(1),
+            slave.cti.eq(Mux(word_is_last(wordbits), CTI_BURST_END, CTI_BURST_INCREMENTING)),
             If(slave.ack,
                 word_inc.eq(1),
-                 If(word_is_last(word),
+                If(word_is_last(wordbits),
+                    master.ack.eq(1),
+                    NextState("IDLE")
+                )
+            )
+        )
+        fsm.act("EVICT",
+            slave.stb.eq(evict_ready),
+            slave.cyc.eq(1),
+            slave.we.eq(1),
+            slave.cti.eq(Mux(word_is_last(linewordbits), CTI_BURST_END, CTI_BURST_INCREMENTING)),
+            If(slave.stb & slave.ack,
+                word_inc.eq(1),
+                If(word_is_last(linewordbits),
                     NextState("REFILL_WRTAG")
                 )
             )
         )
         fsm.act("REFILL_WRTAG",
             # Write the tag first to set the slave address
-            tag_port.we.eq(1),
+            tag_we.eq(1),
             word_clr.eq(1),
             NextState("REFILL")
         )
+        # the data memories are read again in IDLE
         fsm.act("REFILL",
             slave.stb.eq(1),
             slave.cyc.eq(1),
             slave.we.eq(0),
+            slave.cti.eq(Mux(word_is_last(linewordbits), CTI_BURST_END, CTI_BURST_INCREMENTING)),
             If(slave.ack,
                 write_from_slave.eq(1),
                 word_inc.eq(1),
-                If(word_is_last(word),
-                    NextState("TEST_HIT"),
-                ).Else(
-                    NextState("REFILL")
+                If(word_is_last(linewordbits),
+                    NextState("IDLE")
                 )
             )
         )
 
 
 class SRAM(Module):
+    """SRAM
+
+    Classic accesses are acked every other cycle. During incrementing bursts (linear or
+    wrapping) the next word is read while the current one is acked: one word is acked per
+    cycle.
+    """
     def __init__(self, mem_or_size, read_only=None, init=None, bus=None):
         if bus is None:
             bus = Interface()
@@ -671,9 +1197,27 @@ class SRAM(Module):
         if not read_only:
             self.comb += [port.we[i].eq(self.bus.cyc & self.bus.stb & self.bus.we & self.bus.sel[i])
                 for i in range(bus_data_width//8)]
+        # burst: address of the next word
+        burst = Signal()
+        adr_inc = Signal(len(self.bus.adr))
+        adr_next = Signal(len(self.bus.adr))
+        self.comb += [
+            burst.eq(self.bus.cyc & self.bus.stb & (self.bus.cti == CTI_BURST_INCREMENTING)),
+            adr_inc.eq(self.bus.adr + 1),
+            Case(self.bus.bte, {
+                BTE_LINEAR:  adr_next.eq(adr_inc),
+                BTE_WRAP_4:  adr_next.eq(Cat(adr_inc[:2], self.bus.adr[2:])),
+                BTE_WRAP_8:  adr_next.eq(Cat(adr_inc[:3], self.bus.adr[3:])),
+                BTE_WRAP_16: adr_next.eq(Cat(adr_inc[:4], self.bus.adr[4:]))
+            })
+        ]
         # address and data
         self.comb += [
-            port.adr.eq(self.bus.adr[:len(port.adr)]),
+            If(burst & self.bus.ack & ~self.bus.we,
+                port.adr.eq(adr_next[:len(port.adr)])
+            ).Else(
+                port.adr.eq(self.bus.adr[:len(port.adr)])
+            ),
             self.bus.dat_r.eq(port.dat_r)
         ]
         if not read_only:
@@ -681,10 +1225,54 @@ class SRAM(Module):
         # generate ack
         self.sync += [
             self.bus.ack.eq(0),
-            If(self.bus.cyc & self.bus.stb & ~self.bus.ack,    self.bus.ack.eq(1))
+            If(self.bus.cyc & self.bus.stb & (~self.bus.ack | burst), self.bus.ack.eq(1))
         ]
 
 
+class PipelinedSRAM(Module):
+    """Pipelined SRAM
+
+    SRAM on a PipelinedInterface: requests are never stalled and acked in the next cycle, one
+    word is transferred per cycle.
+    """
+    def __init__(self, mem_or_size, read_only=None, init=None, bus=None):
+        if bus is None:
+            bus = PipelinedInterface()
+        self.bus = bus
+        bus_data_width = len(self.bus.dat_r)
+        if isinstance(mem_or_size, Memory):
+            assert(mem_or_size.width <= bus_data_width)
+            self.mem = mem_or_size
+        else:
+            self.mem = Memory(bus_data_width, mem_or_size//(bus_data_width//8), init=init)
+        if read_only is None:
+            if hasattr(self.mem, "bus_read_only"):
+                read_only = self.mem.bus_read_only
+            else:
+                read_only = False
+
+        ###
+
+        # memory
+        port = self.mem.get_port(write_capable=not read_only, we_granularity=8,
+            mode=READ_FIRST if read_only else WRITE_FIRST)
+        self.specials += self.mem, port
+        # generate write enable signal
+        if not read_only:
+            self.comb += [port.we[i].eq(self.bus.cyc & self.bus.stb & self.bus.we & self.bus.sel[i])
+                for i in range(bus_data_width//8)]
+        # address and data
+        self.comb += [
+            port.adr.eq(self.bus.adr[:len(port.adr)]),
+            self.bus.dat_r.eq(port.dat_r),
+            self.bus.stall.eq(0)
+        ]
+        if not read_only:
+            self.comb += port.dat_w.eq(self.bus.dat_w),
+        # generate ack
+        self.sync += self.bus.ack.eq(self.bus.cyc & self.bus.stb)
+
+
 class CSRBank(csr.GenericBank):
     def __init__(self, description, bus=None):
         if bus is None:
@@ -9,6 +9,11 @@ from litex.soc.interconnect import csr_bus, wishbone
 
 
 class WB2CSR(Module):
+    """Wishbone to CSR bridge
+
+    Writes are acked in the cycle they are issued, reads in the next cycle, with the data
+    registered by the CSR banks.
+    """
     def __init__(self, bus_wishbone=None, bus_csr=None):
         if bus_wishbone is None:
             bus_wishbone = wishbone.Interface()
@@ -30,7 +35,11 @@ class WB2CSR(Module):
             If(self.wishbone.cyc & self.wishbone.stb,
                 self.csr.adr.eq(self.wishbone.adr),
                 self.csr.we.eq(self.wishbone.we),
-                NextState("ACK")
+                If(self.wishbone.we,
+                    self.wishbone.ack.eq(1)
+                ).Else(
+                    NextState("ACK")
+                )
             )
         )
         fsm.act("ACK",
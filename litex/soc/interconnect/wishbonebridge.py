@@ -17,11 +17,18 @@ class WishboneStreamingBridge(Module):
         "read": 0x02
     }
 
-    def __init__(self, phy, clk_freq):
+    def __init__(self, phy, clk_freq, fifo_depth=32):
         self.wishbone = wishbone.Interface()
 
         # # #
 
+        # commands received while the previous one is executed are buffered, so that the host can
+        # pipeline its requests
+        rx_fifo = stream.SyncFIFO([("data", 8)], fifo_depth)
+        self.submodules += rx_fifo
+        self.comb += phy.source.connect(rx_fifo.sink)
+        source = rx_fifo.source
+
         byte_counter = Signal(3, reset_less=True)
         byte_counter_reset = Signal()
         byte_counter_ce = Signal()
@@ -32,7 +39,7 @@ class WishboneStreamingBridge(Module):
                 byte_counter.eq(byte_counter + 1)
             )
 
-        word_counter = Signal(3, reset_less=True)
+        word_counter = Signal(8, reset_less=True)
         word_counter_reset = Signal()
         word_counter_ce = Signal()
         self.sync += \
@@ -56,11 +63,11 @@ class WishboneStreamingBridge(Module):
         tx_data_ce = Signal()
 
         self.sync += [
-            If(cmd_ce, cmd.eq(phy.source.data)),
-            If(length_ce, length.eq(phy.source.data)),
-            If(address_ce, address.eq(Cat(phy.source.data, address[0:24]))),
+            If(cmd_ce, cmd.eq(source.data)),
+            If(length_ce, length.eq(source.data)),
+            If(address_ce, address.eq(Cat(source.data, address[0:24]))),
             If(rx_data_ce,
-                data.eq(Cat(phy.source.data, data[0:24]))
+                data.eq(Cat(source.data, data[0:24]))
             ).Elif(tx_data_ce,
                 data.eq(self.wishbone.dat_r)
             )
@@ -69,15 +76,13 @@ class WishboneStreamingBridge(Module):
         fsm = ResetInserter()(FSM(reset_state="IDLE"))
         timer = WaitTimer(clk_freq//10)
         self.submodules += fsm, timer
-        self.comb += [
-            fsm.reset.eq(timer.done),
-            phy.source.ready.eq(1)
-        ]
+        self.comb += fsm.reset.eq(timer.done)
         fsm.act("IDLE",
-            If(phy.source.valid,
+            source.ready.eq(1),
+            If(source.valid,
                 cmd_ce.eq(1),
-                If((phy.source.data == self.cmds["write"]) |
-                   (phy.source.data == self.cmds["read"]),
+                If((source.data == self.cmds["write"]) |
+                   (source.data == self.cmds["read"]),
                     NextState("RECEIVE_LENGTH")
                 ),
                 byte_counter_reset.eq(1),
@@ -85,13 +90,15 @@ class WishboneStreamingBridge(Module):
             )
         )
         fsm.act("RECEIVE_LENGTH",
-            If(phy.source.valid,
+            source.ready.eq(1),
+            If(source.valid,
                 length_ce.eq(1),
                 NextState("RECEIVE_ADDRESS")
             )
         )
         fsm.act("RECEIVE_ADDRESS",
-            If(phy.source.valid,
+            source.ready.eq(1),
+            If(source.valid,
                 address_ce.eq(1),
                 byte_counter_ce.eq(1),
                 If(byte_counter == 3,
@@ -105,7 +112,8 @@ class WishboneStreamingBridge(Module):
             )
         )
         fsm.act("RECEIVE_DATA",
-            If(phy.source.valid,
+            source.ready.eq(1),
+            If(source.valid,
                 rx_data_ce.eq(1),
                 byte_counter_ce.eq(1),
                 If(byte_counter == 3,
@@ -159,7 +167,11 @@ class WishboneStreamingBridge(Module):
             )
         )
 
-        self.comb += timer.wait.eq(~fsm.ongoing("IDLE"))
+        # the timeout is restarted by each byte transferred, frames of up to 255 words last longer
+        # than the timeout at low baudrates
+        self.comb += timer.wait.eq(~fsm.ongoing("IDLE") &
+            ~(source.valid & source.ready) &
+            ~(phy.sink.valid & phy.sink.ready))
 
         self.comb += phy.sink.last.eq((byte_counter == 3) & (word_counter == length - 1))
 
@@ -110,7 +110,12 @@ void flush_cpu_dcache(void)
 void flush_l2_cache(void)
 {
 	unsigned int i;
+#ifdef CONFIG_L2_WAYS
+	/* pseudo-LRU sets: more misses are needed to replace all the ways */
+	for(i=0;i<3*CONFIG_L2_SIZE/4;i++) {
+#else
 	for(i=0;i<2*CONFIG_L2_SIZE/4;i++) {
+#endif
 		((volatile unsigned int *) MAIN_RAM_BASE)[i];
 	}
 }
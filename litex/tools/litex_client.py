@@ -3,13 +3,120 @@
 # License: BSD
 
 import socket
+import collections
 
-from litex.tools.remote.etherbone import EtherbonePacket, EtherboneRecord
-from litex.tools.remote.etherbone import EtherboneReads, EtherboneWrites
+from litex.tools.remote.etherbone import PackedRecord, pack_packet, unpack_packet
 from litex.tools.remote.etherbone import EtherboneIPC
 from litex.tools.remote.csr_builder import CSRBuilder
 
 
+class RemoteRead:
+    """Read queued in a RemoteBatch, its result is available once the batch is flushed"""
+    def __init__(self, addr, length):
+        self.addr = addr
+        self.length = length
+        self.datas = []
+
+    @property
+    def done(self):
+        return len(self.datas) == (1 if self.length is None else self.length)
+
+    def result(self):
+        if not self.done:
+            raise ValueError("Read @ 0x{:08x} not completed, flush the batch first".format(self.addr))
+        return self.datas[0] if self.length is None else self.datas
+
+
+class RemoteBatch:
+    """Queue of reads and writes sent to the server in as few packets as possible
+
+    Reads (of any addresses) and writes (to consecutive addresses) are packed into Etherbone
+    records of up to 255 accesses, one record per packet. Packets are sent as soon as their record
+    is full and up to ``window`` packets with reads are kept in flight: replies are matched to the
+    packets in order.
+
+    Accesses are performed in the order they are queued. Reads return RemoteRead objects,
+    ``flush`` waits for all the replies and returns the results of the reads queued since the
+    previous flush. Batches can be used as context managers, flushing on exit.
+    """
+    max_count = 255
+
+    def __init__(self, client, window=8):
+        self.client = client
+        self.window = window
+        self.queued = []
+        self.inflight = collections.deque()
+        self._new_record()
+
+    def _new_record(self):
+        self.base_addr = None
+        self.writes = []
+        self.reads = []
+        self.targets = [] # (RemoteRead, number of datas in this record)
+
+    def _send(self):
+        if not self.writes and not self.reads:
+            return
+        record = PackedRecord(base_addr=self.base_addr, writes=self.writes, reads=self.reads)
+        self.client.send_packet(self.client.socket, pack_packet([record]))
+
+        if self.reads:
+            self.inflight.append(self.targets)
+        self._new_record()
+        while len(self.inflight) > self.window:
+            self._receive()
+
+    def _receive(self):
+        targets = self.inflight.popleft()
+        packet = self.client.receive_packet(self.client.socket)
+        if packet == 0:
+            raise ConnectionError("Connection closed by the server")
+        datas = unpack_packet(packet)[-1].writes
+        offset = 0
+        for read, n in targets:
+            read.datas += datas[offset:offset + n]
+            offset += n
+
+    def read(self, addr, length=None):
+        read = RemoteRead(addr, length)
+        self.queued.append(read)
+        length_int = 1 if length is None else length
+        offset = 0
+        while offset < length_int:
+            if len(self.reads) == self.max_count:
+                self._send()
+            n = min(length_int - offset, self.max_count - len(self.reads))
+            self.reads += [addr + 4*(offset + j) for j in range(n)]
+            self.targets.append((read, n))
+            offset += n
+        return read
+
+    def write(self, addr, datas):
+        datas = datas if isinstance(datas, list) else [datas]
+        for i, data in enumerate(datas):
+            # writes of a record are performed before its reads, at consecutive addresses
+            if (self.reads or len(self.writes) == self.max_count or
+                (self.writes and addr + 4*i != self.base_addr + 4*len(self.writes))):
+                self._send()
+            if not self.writes:
+                self.base_addr = addr + 4*i
+            self.writes.append(data)
+
+    def flush(self):
+        self._send()
+        while self.inflight:
+            self._receive()
+        reads, self.queued = self.queued, []
+        return [read.result() for read in reads]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+
 class RemoteClient(EtherboneIPC, CSRBuilder):
     def __init__(self, host="localhost", port=1234, csr_csv="csr.csv", csr_data_width=None, debug=False):
         if csr_csv is not None:
@@ -32,38 +139,24 @@ class RemoteClient(EtherboneIPC, CSRBuilder):
         self.socket.close()
         del self.socket
 
+    def batch(self, window=8):
+        return RemoteBatch(self, window)
+
     def read(self, addr, length=None):
-        length_int = 1 if length is None else length
-        # prepare packet
-        record = EtherboneRecord()
-        record.reads = EtherboneReads(addrs=[addr + 4*j for j in range(length_int)])
-        record.rcount = len(record.reads)
-
-        # send packet
-        packet = EtherbonePacket()
-        packet.records = [record]
-        packet.encode()
-        self.send_packet(self.socket, packet[:])
-
-        # receive response
-        packet = EtherbonePacket(self.receive_packet(self.socket))
-        packet.decode()
-        datas = packet.records.pop().writes.get_datas()
+        batch = self.batch()
+        read = batch.read(addr, length)
+        batch.flush()
+        datas = read.datas
         if self.debug:
             for i, data in enumerate(datas):
                 print("read {:08x} @ {:08x}".format(data, addr + 4*i))
-        return datas[0] if length is None else datas
+        return read.result()
 
     def write(self, addr, datas):
         datas = datas if isinstance(datas, list) else [datas]
-        record = EtherboneRecord()
-        record.writes = EtherboneWrites(base_addr=addr, datas=[d for d in datas])
-        record.wcount = len(record.writes)
-
-        packet = EtherbonePacket()
-        packet.records = [record]
-        packet.encode()
-        self.send_packet(self.socket, packet)
+        batch = self.batch()
+        batch.write(addr, datas)
+        batch.flush()
 
         if self.debug:
             for i, data in enumerate(datas):
@@ -9,19 +9,37 @@ import argparse
 
 import sys
 import socket
-import time
+import asyncio
 import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from litex.tools.remote.etherbone import EtherbonePacket, EtherboneRecord, EtherboneWrites
+from litex.tools.remote.etherbone import etherbone_magic, etherbone_packet_header_length
+from litex.tools.remote.etherbone import etherbone_record_header_length
+from litex.tools.remote.etherbone import PackedRecord, pack_packet, unpack_record
 from litex.tools.remote.etherbone import EtherboneIPC
 
 
 class RemoteServer(EtherboneIPC):
+    """Etherbone server sharing a comm link between clients
+
+    Clients are served concurrently by an asyncio event loop. The records they send are queued to
+    a single worker performing the accesses on the comm link in order: reads of consecutive
+    addresses that are adjacent in the queue, from the same or from different clients, are merged
+    into a single comm read.
+
+    Every record of a packet is processed and each record with reads gets its own reply packet.
+    Within a TCP stream, a packet header is recognized by the Etherbone magic in place of a record
+    header.
+    """
+    max_burst = 255 # reads merged into a single comm read
+    max_pending = 64 # records of a client waiting for their replies
+
     def __init__(self, comm, bind_ip, bind_port=1234):
         self.comm = comm
         self.bind_ip = bind_ip
         self.bind_port = bind_port
-        self.lock = False
+        self.stats = {"records": 0, "comm_reads": 0, "comm_writes": 0}
+        self.running = threading.Event()
 
     def open(self):
         if hasattr(self, "socket"):
@@ -34,72 +52,178 @@ class RemoteServer(EtherboneIPC):
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.setsockopt(socket.SOL_SOCKET, socket_flags, 1)
         self.socket.bind((self.bind_ip, self.bind_port))
-        print("tcp port: {:d}".format(self.bind_port))
-        self.socket.listen(1)
+        print("tcp port: {:d}".format(self.socket.getsockname()[1]))
+        self.socket.listen(16)
         self.comm.open()
 
     def close(self):
+        if self.running.is_set():
+            self.running.clear()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            if hasattr(self, "thread"):
+                self.thread.join()
+                del self.thread
         self.comm.close()
         if not hasattr(self, "socket"):
             return
         self.socket.close()
         del self.socket
 
-    def _serve_thread(self):
+    # Comm link accesses (worker thread) -----------------------------------------------------------
+
+    def _execute(self, records):
+        results = [[] for record in records]
+        reads = [] # (address, index of the record)
+
+        def flush_reads():
+            i = 0
+            while i < len(reads):
+                j = i + 1
+                while (j < len(reads) and j - i < self.max_burst and
+                       reads[j][0] == reads[j - 1][0] + 4):
+                    j += 1
+                datas = self.comm.read(reads[i][0], j - i)
+                self.stats["comm_reads"] += 1
+                for (addr, n), data in zip(reads[i:j], datas):
+                    results[n].append(data)
+                i = j
+            del reads[:]
+
+        for n, record in enumerate(records):
+            # writes of a record are performed before its reads
+            if len(record.writes):
+                flush_reads()
+                self.comm.write(record.base_addr, list(record.writes))
+                self.stats["comm_writes"] += 1
+            reads.extend((addr, n) for addr in record.reads)
+        flush_reads()
+        self.stats["records"] += len(records)
+        return results
+
+    # Event loop -----------------------------------------------------------------------------------
+
+    async def _worker(self):
         while True:
-            client_socket, addr = self.socket.accept()
-            print("Connected with " + addr[0] + ":" + str(addr[1]))
+            jobs = [await self.queue.get()]
+            while not self.queue.empty():
+                jobs.append(self.queue.get_nowait())
             try:
-                while True:
-                    try:
-                        packet = self.receive_packet(client_socket)
-                        if packet == 0:
-                            break
-                    except:
-                        break
-                    packet = EtherbonePacket(packet)
-                    packet.decode()
-
-                    record = packet.records.pop()
-
-                    # wait for lock
-                    while self.lock:
-                        time.sleep(0.01)
-
-                    # set lock
-                    self.lock = True
-
-                    # handle writes:
-                    if record.writes != None:
-                        self.comm.write(record.writes.base_addr, record.writes.get_datas())
-
-                    # handle reads
-                    if record.reads != None:
-                        reads = []
-                        for addr in record.reads.get_addrs():
-                            reads.append(self.comm.read(addr))
-
-                        record = EtherboneRecord()
-                        record.writes = EtherboneWrites(datas=reads)
-                        record.wcount = len(record.writes)
-
-                        packet = EtherbonePacket()
-                        packet.records = [record]
-                        packet.encode()
-                        self.send_packet(client_socket, packet)
-
-                    # release lock
-                    self.lock = False
+                results = await self.loop.run_in_executor(self.executor,
+                    self._execute, [record for record, future in jobs])
+            except Exception as e:
+                for record, future in jobs:
+                    future.set_exception(e)
+            else:
+                for (record, future), result in zip(jobs, results):
+                    future.set_result(result)
+
+    async def _receive_record(self, reader, first):
+        header = await reader.readexactly(etherbone_record_header_length)
+        if header[:2] == etherbone_magic.to_bytes(2, "big"):
+            await reader.readexactly(etherbone_packet_header_length - etherbone_record_header_length)
+            header = await reader.readexactly(etherbone_record_header_length)
+        elif first:
+            raise ValueError("Invalid Etherbone magic")
+        wcount, rcount = header[2], header[3]
+        length = 0
+        if wcount:
+            length += 4*(wcount + 1)
+        if rcount:
+            length += 4*(rcount + 1)
+        record, _ = unpack_record(header + await reader.readexactly(length))
+        return record
 
+    async def _send_replies(self, writer, replies):
+        connected = True
+        while True:
+            reply = await replies.get()
+            if reply is None:
+                return
+            record, future = reply
+            try:
+                datas = await future
+            except Exception as e:
+                print("Comm error: {}".format(e))
+                connected = False
+                writer.close()
+                continue
+            if len(record.reads) and connected:
+                writer.write(pack_packet([PackedRecord(base_addr=record.base_ret_addr, writes=datas)]))
+                try:
+                    await writer.drain()
+                except ConnectionError:
+                    connected = False
+
+    async def _handle_client(self, reader, writer):
+        if not self.running.is_set():
+            writer.close()
+            return
+        addr = writer.get_extra_info("peername")
+        print("Connected with " + addr[0] + ":" + str(addr[1]))
+        self.writers.add(writer)
+        replies = asyncio.Queue(self.max_pending)
+        sender = asyncio.ensure_future(self._send_replies(writer, replies))
+        try:
+            first = True
+            while not sender.done():
+                record = await self._receive_record(reader, first)
+                first = False
+                future = self.loop.create_future()
+                self.queue.put_nowait((record, future))
+                await replies.put((record, future))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            try:
+                await replies.put(None)
+                await sender
             finally:
                 print("Disconnect")
-                client_socket.close()
+                self.writers.discard(writer)
+                writer.close()
+
+    def run(self):
+        """Serve clients from the current thread, until close is called"""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        # comm links are not thread-safe: all the accesses are done from a single thread
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.queue = asyncio.Queue()
+        self.writers = set()
+        server = self.loop.run_until_complete(asyncio.start_server(self._handle_client, sock=self.socket))
+        worker = asyncio.ensure_future(self._worker())
+        self.loop.call_soon(self.running.set)
+        try:
+            self.loop.run_forever()
+        finally:
+            # disconnect the clients and let their pending records complete, connections accepted
+            # meanwhile are closed by their handler
+            self.running.clear()
+            all_tasks = getattr(asyncio, "all_tasks", None) or asyncio.Task.all_tasks
+            while True:
+                for writer in list(self.writers):
+                    writer.close()
+                self.loop.run_until_complete(asyncio.sleep(0))
+                clients = [task for task in all_tasks(self.loop) if task is not worker and not task.done()]
+                if not clients:
+                    break
+                self.loop.run_until_complete(asyncio.gather(*clients, return_exceptions=True))
+            server.close()
+            worker.cancel()
+            self.loop.run_until_complete(asyncio.gather(worker, return_exceptions=True))
+            self.loop.close()
+            self.executor.shutdown()
+            del self.loop
 
-    def start(self, nthreads):
-        for i in range(nthreads):
-            self.serve_thread = threading.Thread(target=self._serve_thread)
-            self.serve_thread.setDaemon(True)
-            self.serve_thread.start()
+    def start(self, nthreads=None):
+        """Serve clients from a background thread
+
+        ``nthreads`` is unused, all the clients are served by the event loop of this thread.
+        """
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        self.running.wait()
 
 
 def main():
@@ -118,6 +242,10 @@ def main():
                         help="Set UART port")
     parser.add_argument("--uart-baudrate", default=115200,
                         help="Set UART baudrate")
+    parser.add_argument("--uart-max-length", default=8,
+                        help="Set words per UART frame (up to 255, for bridges supporting bursts)")
+    parser.add_argument("--uart-window", default=1,
+                        help="Set outstanding UART read requests (for bridges buffering requests)")
 
     # UDP arguments
     parser.add_argument("--udp", action="store_true",
@@ -126,6 +254,9 @@ def main():
                         help="Set UDP remote IP address")
     parser.add_argument("--udp-port", default=1234,
                         help="Set UDP remote port")
+    parser.add_argument("--udp-write-acks", action="store_true",
+                        help="Acknowledge and retry UDP writes (no register resetting the link "
+                             "or with side effects on reads must be written)")
 
     # PCIe arguments
     parser.add_argument("--pcie", action="store_true",
@@ -133,6 +264,15 @@ def main():
     parser.add_argument("--pcie-bar", default=None,
                         help="Set PCIe BAR")
 
+    # Simulation arguments
+    parser.add_argument("--sim", action="store_true",
+                        help="Select simulation interface")
+    parser.add_argument("--sim-port", default=None,
+                        help="Set TCP port of a litex_sim UART bridge (--with-uartbone), "
+                             "an in-process SRAM model is simulated otherwise")
+    parser.add_argument("--sim-ram-size", default="0x10000",
+                        help="Set size of the in-process SRAM model")
+
     # USB arguments
     parser.add_argument("--usb", action="store_true",
                         help="Select USB interface")
@@ -142,6 +282,8 @@ def main():
                         help="Set USB product ID")
     parser.add_argument("--usb-max-retries", default=10,
                         help="Number of times to try reconnecting to USB")
+    parser.add_argument("--usb-max-length", default=1,
+                        help="Words per USB transfer, for bridges supporting bursts")
     args = parser.parse_args()
 
 
@@ -153,13 +295,14 @@ def main():
         uart_port = args.uart_port
         uart_baudrate = int(float(args.uart_baudrate))
         print("[CommUART] port: {} / baudrate: {} / ".format(uart_port, uart_baudrate), end="")
-        comm = CommUART(uart_port, uart_baudrate)
+        comm = CommUART(uart_port, uart_baudrate, max_length=int(args.uart_max_length),
+            window=int(args.uart_window))
     elif args.udp:
         from litex.tools.remote.comm_udp import CommUDP
         udp_ip = args.udp_ip
         udp_port = int(args.udp_port)
         print("[CommUDP] ip: {} / port: {} / ".format(udp_ip, udp_port), end="")
-        comm = CommUDP(udp_ip, udp_port)
+        comm = CommUDP(udp_ip, udp_port, write_acks=args.udp_write_acks)
     elif args.pcie:
         from litex.tools.remote.comm_pcie import CommPCIe
         pcie_bar = args.pcie_bar
@@ -168,6 +311,17 @@ def main():
             exit()
         print("[CommPCIe] bar: {} / ".format(args.pcie_bar), end="")
         comm = CommPCIe(args.pcie_bar)
+    elif args.sim:
+        if args.sim_port is not None:
+            from litex.tools.remote.comm_uart import CommUART
+            sim_port = int(args.sim_port)
+            print("[CommUART] litex_sim port: {} / ".format(sim_port), end="")
+            comm = CommUART("socket://localhost:{}".format(sim_port), max_length=255, window=4)
+        else:
+            from litex.tools.remote.comm_sim import CommSim
+            sim_ram_size = int(args.sim_ram_size, base=0)
+            print("[CommSim] sram: {} bytes / ".format(sim_ram_size), end="")
+            comm = CommSim(size=sim_ram_size)
     elif args.usb:
         from litex.tools.remote.comm_usb import CommUSB
         if args.usb_pid is None and args.usb_vid is None:
@@ -180,17 +334,16 @@ def main():
         vid = args.usb_vid
         if vid is not None:
             vid = int(vid, base=0)
-        comm = CommUSB(vid=vid, pid=pid, max_retries=args.usb_max_retries)
+        comm = CommUSB(vid=vid, pid=pid, max_retries=int(args.usb_max_retries),
+            max_length=int(args.usb_max_length))
     else:
         parser.print_help()
         exit()
 
     server = RemoteServer(comm, args.bind_ip, int(args.bind_port))
     server.open()
-    server.start(4)
     try:
-        import time
-        while True: time.sleep(100)
+        server.run()
     except KeyboardInterrupt:
         pass
 
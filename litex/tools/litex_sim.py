@@ -17,6 +17,7 @@ from litex.soc.integration.soc_core import *
 from litex.soc.integration.soc_sdram import *
 from litex.soc.integration.builder import *
 from litex.soc.cores import uart
+from litex.soc.interconnect.wishbonebridge import WishboneStreamingBridge
 
 from litedram.common import PhySettings
 from litedram.modules import MT48LC16M16
@@ -48,6 +49,15 @@ _io = [
         Subsignal("sink_ready", SimPins()),
         Subsignal("sink_data", SimPins(8)),
     ),
+    ("uartbone", 0,
+        Subsignal("source_valid", SimPins()),
+        Subsignal("source_ready", SimPins()),
+        Subsignal("source_data", SimPins(8)),
+
+        Subsignal("sink_valid", SimPins()),
+        Subsignal("sink_ready", SimPins()),
+        Subsignal("sink_data", SimPins(8)),
+    ),
     ("eth_clocks", 0,
         Subsignal("none", SimPins()),
     ),
@@ -97,6 +107,7 @@ class SimSoC(SoCSDRAM):
         with_ethernet=False,
         with_etherbone=False, etherbone_mac_address=0x10e2d5000000, etherbone_ip_address="192.168.1.50",
         with_analyzer=False,
+        with_uartbone=False,
         **kwargs):
         platform = Platform()
         sys_clk_freq = int(1e6)
@@ -114,6 +125,12 @@ class SimSoC(SoCSDRAM):
         self.add_csr("uart")
         self.add_interrupt("uart")
 
+        # uartbone
+        if with_uartbone:
+            self.submodules.uartbone_phy = uart.RS232PHYModel(platform.request("uartbone"))
+            self.submodules.uartbone = WishboneStreamingBridge(self.uartbone_phy, sys_clk_freq)
+            self.add_wb_master(self.uartbone.wishbone, "uartbone")
+
         # sdram
         if with_sdram:
             sdram_module =  MT48LC16M16(100e6, "1:1") # use 100MHz timings
@@ -152,7 +169,7 @@ class SimSoC(SoCSDRAM):
             if with_etherbone:
                 ethmac = ClockDomainsRenamer({"eth_tx": "ethphy_eth_tx", "eth_rx":  "ethphy_eth_rx"})(ethmac)
             self.submodules.ethmac = ethmac
-            self.add_wb_slave(self.mem_map["ethmac"], self.ethmac.bus, 0x2000)
+            self.add_wb_slave(self.mem_map["ethmac"], self.ethmac.bus, 0x2000, "ethmac")
             self.add_memory_region("ethmac", self.mem_map["ethmac"], 0x2000, io_region=True)
             self.add_csr("ethmac")
             self.add_interrupt("ethmac")
@@ -170,7 +187,7 @@ class SimSoC(SoCSDRAM):
             self.submodules.etherbonecore = etherbonecore
             # etherbone
             self.submodules.etherbone = LiteEthEtherbone(self.etherbonecore.udp, 1234, mode="master")
-            self.add_wb_master(self.etherbone.wishbone.bus)
+            self.add_wb_master(self.etherbone.wishbone.bus, "etherbone")
 
         # analyzer
         if with_analyzer:
@@ -201,6 +218,10 @@ def main():
                         help="enable Etherbone support")
     parser.add_argument("--with-analyzer", action="store_true",
                         help="enable Analyzer support")
+    parser.add_argument("--with-uartbone", action="store_true",
+                        help="enable UART Wishbone bridge, on a TCP port (for litex_server --sim)")
+    parser.add_argument("--uartbone-port", default=2000,
+                        help="TCP port of the UART Wishbone bridge (default=2000)")
     parser.add_argument("--trace", action="store_true",
                         help="enable VCD tracing")
     parser.add_argument("--trace-start", default=0,
@@ -235,12 +256,15 @@ def main():
         sim_config.add_module("ethernet", "eth", args={"interface": "tap0", "ip": "192.168.1.100"})
     if args.with_etherbone:
         sim_config.add_module('ethernet', "eth", args={"interface": "tap1", "ip": "192.168.1.101"})
+    if args.with_uartbone:
+        sim_config.add_module("serial2tcp", "uartbone", args={"port": str(args.uartbone_port)})
 
     soc = SimSoC(
         with_sdram=args.with_sdram,
         with_ethernet=args.with_ethernet,
         with_etherbone=args.with_etherbone,
         with_analyzer=args.with_analyzer,
+        with_uartbone=args.with_uartbone,
         **soc_kwargs)
     if args.ram_init is not None:
         soc.add_constant("ROM_BOOT_ADDRESS", 0x40000000)
@@ -9,10 +9,13 @@ import sys
 import signal
 import os
 import time
+import mmap
 import serial
+import binascii
 import threading
 import argparse
 import json
+import collections
 
 
 if sys.platform == "win32":
@@ -67,47 +70,8 @@ sfl_ack_unknown  = b"U"
 sfl_ack_error    = b"E"
 
 
-crc16_table = [
-    0x0000, 0x1021, 0x2042, 0x3063, 0x4084, 0x50A5, 0x60C6, 0x70E7,
-    0x8108, 0x9129, 0xA14A, 0xB16B, 0xC18C, 0xD1AD, 0xE1CE, 0xF1EF,
-    0x1231, 0x0210, 0x3273, 0x2252, 0x52B5, 0x4294, 0x72F7, 0x62D6,
-    0x9339, 0x8318, 0xB37B, 0xA35A, 0xD3BD, 0xC39C, 0xF3FF, 0xE3DE,
-    0x2462, 0x3443, 0x0420, 0x1401, 0x64E6, 0x74C7, 0x44A4, 0x5485,
-    0xA56A, 0xB54B, 0x8528, 0x9509, 0xE5EE, 0xF5CF, 0xC5AC, 0xD58D,
-    0x3653, 0x2672, 0x1611, 0x0630, 0x76D7, 0x66F6, 0x5695, 0x46B4,
-    0xB75B, 0xA77A, 0x9719, 0x8738, 0xF7DF, 0xE7FE, 0xD79D, 0xC7BC,
-    0x48C4, 0x58E5, 0x6886, 0x78A7, 0x0840, 0x1861, 0x2802, 0x3823,
-    0xC9CC, 0xD9ED, 0xE98E, 0xF9AF, 0x8948, 0x9969, 0xA90A, 0xB92B,
-    0x5AF5, 0x4AD4, 0x7AB7, 0x6A96, 0x1A71, 0x0A50, 0x3A33, 0x2A12,
-    0xDBFD, 0xCBDC, 0xFBBF, 0xEB9E, 0x9B79, 0x8B58, 0xBB3B, 0xAB1A,
-    0x6CA6, 0x7C87, 0x4CE4, 0x5CC5, 0x2C22, 0x3C03, 0x0C60, 0x1C41,
-    0xEDAE, 0xFD8F, 0xCDEC, 0xDDCD, 0xAD2A, 0xBD0B, 0x8D68, 0x9D49,
-    0x7E97, 0x6EB6, 0x5ED5, 0x4EF4, 0x3E13, 0x2E32, 0x1E51, 0x0E70,
-    0xFF9F, 0xEFBE, 0xDFDD, 0xCFFC, 0xBF1B, 0xAF3A, 0x9F59, 0x8F78,
-    0x9188, 0x81A9, 0xB1CA, 0xA1EB, 0xD10C, 0xC12D, 0xF14E, 0xE16F,
-    0x1080, 0x00A1, 0x30C2, 0x20E3, 0x5004, 0x4025, 0x7046, 0x6067,
-    0x83B9, 0x9398, 0xA3FB, 0xB3DA, 0xC33D, 0xD31C, 0xE37F, 0xF35E,
-    0x02B1, 0x1290, 0x22F3, 0x32D2, 0x4235, 0x5214, 0x6277, 0x7256,
-    0xB5EA, 0xA5CB, 0x95A8, 0x8589, 0xF56E, 0xE54F, 0xD52C, 0xC50D,
-    0x34E2, 0x24C3, 0x14A0, 0x0481, 0x7466, 0x6447, 0x5424, 0x4405,
-    0xA7DB, 0xB7FA, 0x8799, 0x97B8, 0xE75F, 0xF77E, 0xC71D, 0xD73C,
-    0x26D3, 0x36F2, 0x0691, 0x16B0, 0x6657, 0x7676, 0x4615, 0x5634,
-    0xD94C, 0xC96D, 0xF90E, 0xE92F, 0x99C8, 0x89E9, 0xB98A, 0xA9AB,
-    0x5844, 0x4865, 0x7806, 0x6827, 0x18C0, 0x08E1, 0x3882, 0x28A3,
-    0xCB7D, 0xDB5C, 0xEB3F, 0xFB1E, 0x8BF9, 0x9BD8, 0xABBB, 0xBB9A,
-    0x4A75, 0x5A54, 0x6A37, 0x7A16, 0x0AF1, 0x1AD0, 0x2AB3, 0x3A92,
-    0xFD2E, 0xED0F, 0xDD6C, 0xCD4D, 0xBDAA, 0xAD8B, 0x9DE8, 0x8DC9,
-    0x7C26, 0x6C07, 0x5C64, 0x4C45, 0x3CA2, 0x2C83, 0x1CE0, 0x0CC1,
-    0xEF1F, 0xFF3E, 0xCF5D, 0xDF7C, 0xAF9B, 0xBFBA, 0x8FD9, 0x9FF8,
-    0x6E17, 0x7E36, 0x4E55, 0x5E74, 0x2E93, 0x3EB2, 0x0ED1, 0x1EF0
-]
-
-
 def crc16(l):
-    crc = 0
-    for d in l:
-        crc = crc16_table[((crc >> 8) ^ d) & 0xff] ^ (crc << 8)
-    return crc & 0xffff
+    return binascii.crc_hqx(bytes(l), 0)
 
 
 class SFLFrame:
@@ -126,8 +90,21 @@ class SFLFrame:
         return packet
 
 
+class StreamMatcher:
+    """Detects a pattern in a stream of chunks, across their boundaries"""
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.tail = bytes()
+
+    def feed(self, data):
+        data = self.tail + data
+        self.tail = data[1 - len(self.pattern):]
+        return self.pattern in data
+
+
 class LiteXTerm:
-    def __init__(self, serial_boot, kernel_image, kernel_address, json_images, no_crc):
+    def __init__(self, serial_boot, kernel_image, kernel_address, json_images, no_crc, upload_window=1,
+                 log_file=None):
         self.serial_boot = serial_boot
         assert not (kernel_image is not None and json_images is not None)
         self.mem_regions = {}
@@ -140,12 +117,17 @@ class LiteXTerm:
             self.boot_address = self.mem_regions[list(self.mem_regions.keys())[-1]]
             f.close()
         self.no_crc = no_crc
+        self.upload_window = upload_window
 
         self.reader_alive = False
         self.writer_alive = False
 
-        self.prompt_detect_buffer = bytes(len(sfl_prompt_req))
-        self.magic_detect_buffer = bytes(len(sfl_magic_req))
+        self.prompt_matcher = StreamMatcher(sfl_prompt_req)
+        self.magic_matcher = StreamMatcher(sfl_magic_req)
+
+        self.log = None
+        if log_file is not None:
+            self.log = open(log_file, "ab")
 
         self.console = Console()
 
@@ -158,6 +140,9 @@ class LiteXTerm:
         self.port = serial.serial_for_url(port, baudrate)
 
     def close(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
         if not hasattr(self, "port"):
             return
         self.port.close()
@@ -194,34 +179,61 @@ class LiteXTerm:
 
     def upload(self, filename, address):
         f = open(filename, "rb")
-        f.seek(0, 2)
-        length = f.tell()
-        f.seek(0, 0)
+        length = os.fstat(f.fileno()).st_size
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if length else bytes()
         print("[LXTERM] Uploading {} to 0x{:08x} ({} bytes)...".format(filename, address, length))
-        current_address = address
+        try:
+            start = time.time()
+            resent = self.send_frames(data, address)
+            elapsed = max(time.time() - start, 1e-6)
+        finally:
+            if length:
+                data.close()
+            f.close()
+        if resent is None:
+            return
+        # 10 bits per byte on the line
+        efficiency = 100*(length/elapsed)/(self.port.baudrate/10)
+        print("[LXTERM] Upload complete ({0:.1f}KB/s, {1:.0f}% of the line rate, {2} frames resent).".format(
+            length/(elapsed*1024), efficiency, resent))
+        return length, elapsed
+
+    def send_frames(self, data, address):
+        # up to upload_window frames are sent before their acknowledgement is received, frames with
+        # a CRC error are sent again
+        length = len(data)
+        pending = collections.deque()
+        resend = collections.deque()
+        resent = 0
         position = 0
-        start = time.time()
-        remaining = length
-        while remaining:
-            sys.stdout.write("|{}>{}| {}%\r".format('=' * (20*position//length),
-                                                    ' ' * (20-20*position//length),
-                                                    100*position//length))
-            sys.stdout.flush()
-            frame = SFLFrame()
-            frame_data = f.read(min(remaining, sfl_payload_length))
-            frame.cmd = sfl_cmd_load if not self.no_crc else sfl_cmd_load_no_crc
-            frame.payload = current_address.to_bytes(4, "big")
-            frame.payload += frame_data
-            if self.send_frame(frame) == 0:
-                return
-            current_address += len(frame_data)
-            position += len(frame_data)
-            remaining -= len(frame_data)
-        end = time.time()
-        elapsed = end - start
-        f.close()
-        print("[LXTERM] Upload complete ({0:.1f}KB/s).".format(length/(elapsed*1024)))
-        return length
+        while position < length or pending or resend:
+            while len(pending) < self.upload_window and (resend or position < length):
+                if resend:
+                    frame = resend.popleft()
+                else:
+                    sys.stdout.write("|{}>{}| {}%\r".format('=' * (20*position//length),
+                                                            ' ' * (20-20*position//length),
+                                                            100*position//length))
+                    sys.stdout.flush()
+                    frame = SFLFrame()
+                    frame.cmd = sfl_cmd_load if not self.no_crc else sfl_cmd_load_no_crc
+                    frame.payload = (address + position).to_bytes(4, "big")
+                    frame.payload += data[position:position + sfl_payload_length]
+                    position += len(frame.payload) - 4
+                self.port.write(frame.encode())
+                if not self.no_crc:
+                    pending.append(frame)
+            if pending:
+                # Get the reply from the device
+                reply = self.port.read()
+                frame = pending.popleft()
+                if reply == sfl_ack_crcerror:
+                    resend.append(frame)
+                    resent += 1
+                elif reply != sfl_ack_success:
+                    print("[LXTERM] Got unknown reply '{}' from the device, aborting.".format(reply))
+                    return None
+        return resent
 
     def boot(self):
         print("[LXTERM] Booting the device.")
@@ -231,38 +243,41 @@ class LiteXTerm:
         self.send_frame(frame)
 
     def detect_prompt(self, data):
-        if len(data):
-            self.prompt_detect_buffer = self.prompt_detect_buffer[1:] + data
-            return self.prompt_detect_buffer == sfl_prompt_req
-        else:
-            return False
+        return self.prompt_matcher.feed(data)
 
     def answer_prompt(self):
         print("[LXTERM] Received serial boot prompt from the device.")
         self.port.write(sfl_prompt_ack)
 
     def detect_magic(self, data):
-        if len(data):
-            self.magic_detect_buffer = self.magic_detect_buffer[1:] + data
-            return self.magic_detect_buffer == sfl_magic_req
-        else:
-            return False
+        return self.magic_matcher.feed(data)
 
     def answer_magic(self):
         print("[LXTERM] Received firmware download request from the device.")
         if(len(self.mem_regions)):
             self.port.write(sfl_magic_ack)
+        report = []
         for filename, base in self.mem_regions.items():
-            self.upload(filename, int(base, 16))
+            r = self.upload(filename, int(base, 16))
+            if r is not None:
+                report.append((filename, r))
+        if len(report) > 1:
+            for filename, (length, elapsed) in report:
+                print("[LXTERM] {}: {} bytes in {:.1f}s ({:.1f}KB/s)".format(
+                    filename, length, elapsed, length/(elapsed*1024)))
         self.boot()
         print("[LXTERM] Done.");
 
     def reader(self):
         try:
             while self.reader_alive:
-                c = self.port.read()
+                # everything received so far, waiting for at least one byte
+                c = self.port.read(max(1, self.port.in_waiting))
                 sys.stdout.buffer.write(c)
                 sys.stdout.flush()
+                if self.log is not None:
+                    self.log.write(c)
+                    self.log.flush()
                 if len(self.mem_regions):
                     if self.serial_boot and self.detect_prompt(c):
                         self.answer_prompt()
@@ -334,12 +349,16 @@ def _get_args():
     parser.add_argument("--kernel-adr", default="0x40000000", help="kernel address")
     parser.add_argument("--images", default=None, help="json description of the images to load to memory")
     parser.add_argument("--no-crc", default=False, action='store_true', help="disable CRC check (speedup serialboot)")
+    parser.add_argument("--upload-window", default=1, type=int,
+                        help="frames sent ahead of their acknowledgement (speedup serialboot)")
+    parser.add_argument("--log", default=None, help="log the received data to a file")
     return parser.parse_args()
 
 
 def main():
     args = _get_args()
-    term = LiteXTerm(args.serial_boot, args.kernel, args.kernel_adr, args.images, args.no_crc)
+    term = LiteXTerm(args.serial_boot, args.kernel, args.kernel_adr, args.images, args.no_crc,
+        args.upload_window, args.log)
     term.open(args.port, int(float(args.speed)))
     term.console.configure()
     term.start()
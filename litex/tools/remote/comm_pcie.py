@@ -1,10 +1,24 @@
 # This file is Copyright (c) 2015-2019 Florent Kermarrec <florent@enjoy-digital.fr>
 # License: BSD
 
+import sys
 import mmap
+import array
+
+
+def _word_typecode():
+    for typecode in "IL":
+        if array.array(typecode).itemsize == 4:
+            return typecode
+    raise NotImplementedError("No 32-bit array type on this host")
 
 
 class CommPCIe:
+    """PCIe BAR link
+
+    Block accesses go through a view of the mapped BAR as 32-bit words, so the BAR only sees
+    aligned 32-bit accesses. ``view`` gives a zero-copy access to the BAR.
+    """
     def __init__(self, bar, debug=False):
         self.bar = bar
         self.debug = debug
@@ -15,32 +29,54 @@ class CommPCIe:
         self.sysfs = open(self.bar, "r+b")
         self.sysfs.flush()
         self.mmap = mmap.mmap(self.sysfs.fileno(), 0)
+        self.typecode = _word_typecode()
+        self.words = memoryview(self.mmap).cast(self.typecode)
 
     def close(self):
         if not hasattr(self, "sysfs"):
             return
+        # the views returned by view must have been released
+        self.words.release()
+        del self.words
         self.mmap.close()
         del self.mmap
         self.sysfs.close()
         del self.sysfs
 
+    def view(self, addr, length):
+        """Memoryview of ``length`` 32-bit words of the BAR, in the byte order of the host
+
+        The view must be released before the link is closed.
+        """
+        return self._words(addr, length)
+
+    def _words(self, addr, length):
+        if addr % 4:
+            raise ValueError("Unaligned PCIe access @ {:08x}".format(addr))
+        return self.words[addr//4:addr//4 + length]
+
     def read(self, addr, length=None):
-        data = []
         length_int = 1 if length is None else length
-        for i in range(length_int):
-            self.mmap.seek(addr + 4*i)
-            value = int.from_bytes(self.mmap.read(4), byteorder="little")
-            if self.debug:
+        # tolist loads the words one by one
+        datas = self._words(addr, length_int).tolist()
+        if sys.byteorder != "little":
+            datas = array.array(self.typecode, datas)
+            datas.byteswap()
+            datas = datas.tolist()
+        if self.debug:
+            for i, value in enumerate(datas):
                 print("read {:08x} @ {:08x}".format(value, addr + 4*i))
-            if length is None:
-                return value
-            data.append(value)
-        return data
+        return datas[0] if length is None else datas
 
     def write(self, addr, data):
         data = data if isinstance(data, list) else [data]
-        length = len(data)
-        for i, value in enumerate(data):
-            self.mmap[addr + 4*i:addr + 4*(i + 1)] = value.to_bytes(4, byteorder="little")
-            if self.debug:
+        datas = array.array(self.typecode, data)
+        if sys.byteorder != "little":
+            datas.byteswap()
+        # stores the words one by one, a slice assignment would be a memcpy
+        words = self._words(addr, len(datas))
+        for i, value in enumerate(datas):
+            words[i] = value
+        if self.debug:
+            for i, value in enumerate(data):
                 print("write {:08x} @ {:08x}".format(value, addr + 4*i))
@@ -0,0 +1,114 @@
+# License: BSD
+
+import queue
+import threading
+from concurrent.futures import Future
+
+from litex.gen.sim import run_simulation
+
+from litex.soc.interconnect import wishbone
+
+
+class CommSim:
+    """Simulation link
+
+    Accesses are performed on ``bus``, a Wishbone interface of ``dut`` driven by the link, by a
+    generator of a litex.gen.sim simulation running in a background thread. ``dut`` defaults to
+    a Wishbone SRAM of ``size`` bytes. ``kwargs`` are passed to ``run_simulation``, e.g. clocks
+    or vcd_name.
+
+    ``stats`` counts the reads and writes performed and the simulated cycles. A litex_sim
+    Verilator model is reached through its UART bridge with CommUART, see litex_server.
+    """
+    def __init__(self, dut=None, bus=None, size=0x10000, debug=False, **kwargs):
+        if dut is None:
+            dut = wishbone.SRAM(size)
+            bus = dut.bus
+        self.dut = dut
+        self.bus = bus
+        self.debug = debug
+        self.kwargs = kwargs
+        self.stats = {"reads": 0, "writes": 0, "cycles": 0}
+
+    def open(self):
+        if hasattr(self, "thread"):
+            return
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=run_simulation,
+            args=(self.dut, self._master()), kwargs=self.kwargs)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        if not hasattr(self, "thread"):
+            return
+        self.requests.put(None)
+        self.thread.join()
+        del self.thread
+
+    # Simulation (simulation thread) ---------------------------------------------------------------
+
+    def _transaction(self):
+        yield self.bus.cyc.eq(1)
+        yield self.bus.stb.eq(1)
+        yield
+        self.stats["cycles"] += 1
+        while not (yield self.bus.ack):
+            yield
+            self.stats["cycles"] += 1
+        yield self.bus.cyc.eq(0)
+        yield self.bus.stb.eq(0)
+
+    def _read(self, addr, length):
+        datas = []
+        yield self.bus.we.eq(0)
+        for i in range(length):
+            yield self.bus.adr.eq((addr >> 2) + i)
+            yield from self._transaction()
+            datas.append((yield self.bus.dat_r))
+        self.stats["reads"] += length
+        return datas
+
+    def _write(self, addr, datas):
+        yield self.bus.we.eq(1)
+        yield self.bus.sel.eq(2**len(self.bus.sel) - 1)
+        for i, data in enumerate(datas):
+            yield self.bus.adr.eq((addr >> 2) + i)
+            yield self.bus.dat_w.eq(data)
+            yield from self._transaction()
+        yield self.bus.we.eq(0)
+        self.stats["writes"] += len(datas)
+
+    def _master(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            access, args, future = request
+            try:
+                result = yield from access(*args)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    # Accesses -------------------------------------------------------------------------------------
+
+    def _request(self, access, *args):
+        future = Future()
+        self.requests.put((access, args, future))
+        return future.result()
+
+    def read(self, addr, length=None):
+        datas = self._request(self._read, addr, 1 if length is None else length)
+        if self.debug:
+            for i, value in enumerate(datas):
+                print("read {:08x} @ {:08x}".format(value, addr + 4*i))
+        return datas[0] if length is None else datas
+
+    def write(self, addr, data):
+        data = data if isinstance(data, list) else [data]
+        self._request(self._write, addr, data)
+        if self.debug:
+            for i, value in enumerate(data):
+                print("write {:08x} @ {:08x}".format(value, addr + 4*i))
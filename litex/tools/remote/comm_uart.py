@@ -3,16 +3,30 @@
 
 import serial
 import struct
+import collections
 
 
 class CommUART:
+    """UART bridge link
+
+    Accesses are split into frames of up to ``max_length`` words, each built into a single buffer
+    before being written to the port. Up to ``window`` read requests are kept outstanding, the
+    bridge buffers the requests received while it sends a reply.
+
+    The defaults (``max_length=8``, ``window=1``) suit all bridges, including those built before
+    frames of more than 8 words and buffered requests were supported. Bridges supporting them
+    are used at full speed with ``max_length=255`` and ``window=4``.
+    """
     msg_type = {
         "write": 0x01,
         "read":  0x02
     }
-    def __init__(self, port, baudrate=115200, debug=False):
+    def __init__(self, port, baudrate=115200, max_length=8, window=1, debug=False):
+        assert 1 <= max_length <= 255
         self.port = port
         self.baudrate = str(baudrate)
+        self.max_length = max_length
+        self.window = window
         self.debug = debug
         self.port = serial.serial_for_url(port, baudrate)
 
@@ -45,33 +59,52 @@ class CommUART:
         if self.port.inWaiting() > 0:
             self.port.read(self.port.inWaiting())
 
-    def read(self, addr, length=None):
+    def _frame(self, cmd, addr, length, datas=None):
+        frame = struct.pack(">BBI", self.msg_type[cmd], length, addr//4)
+        if datas is not None:
+            frame += struct.pack(">{}I".format(length), *datas)
+        return frame
+
+    def _chunks(self, addr, length):
+        for offset in range(0, length, self.max_length):
+            yield addr + 4*offset, offset, min(length - offset, self.max_length)
+
+    def read_block(self, addr, length):
+        """Read ``length`` words from consecutive addresses"""
         self._flush()
-        data = []
-        length_int = 1 if length is None else length
-        self._write([self.msg_type["read"], length_int])
-        self._write(list((addr//4).to_bytes(4, byteorder="big")))
-        for i in range(length_int):
-            value = int.from_bytes(self._read(4), "big")
-            if self.debug:
+        datas = []
+        pending = collections.deque()
+        for chunk_addr, offset, size in self._chunks(addr, length):
+            if len(pending) == self.window:
+                datas += self._read_reply(pending.popleft())
+            self._write(self._frame("read", chunk_addr, size))
+            pending.append((chunk_addr, size))
+        while pending:
+            datas += self._read_reply(pending.popleft())
+        return datas
+
+    def _read_reply(self, request):
+        addr, size = request
+        datas = struct.unpack(">{}I".format(size), self._read(4*size))
+        if self.debug:
+            for i, value in enumerate(datas):
                 print("read {:08x} @ {:08x}".format(value, addr + 4*i))
-            if length is None:
-                return value
-            data.append(value)
-        return data
+        return datas
+
+    def write_block(self, addr, datas):
+        """Write ``datas`` to consecutive addresses"""
+        frames = bytearray()
+        for chunk_addr, offset, size in self._chunks(addr, len(datas)):
+            frames += self._frame("write", chunk_addr, size, datas[offset:offset + size])
+        self._write(frames)
+        if self.debug:
+            for i, value in enumerate(datas):
+                print("write {:08x} @ {:08x}".format(value, addr + 4*i))
+
+    def read(self, addr, length=None):
+        datas = self.read_block(addr, 1 if length is None else length)
+        return datas[0] if length is None else datas
 
     def write(self, addr, data):
-        self._flush()
         data = data if isinstance(data, list) else [data]
-        length = len(data)
-        offset = 0
-        while length:
-            size = min(length, 8)
-            self._write([self.msg_type["write"], size])
-            self._write(list(((addr+offset)//4).to_bytes(4, byteorder="big")))
-            for i, value in enumerate(data[offset:offset+size]):
-                self._write(list(value.to_bytes(4, byteorder="big")))
-                if self.debug:
-                    print("write {:08x} @ {:08x}".format(value, addr + offset, 4*i))
-            offset += size
-            length -= size
+        self.write_block(addr, data)
@@ -2,17 +2,53 @@
 # This file is Copyright (c) 2016 Tim 'mithro' Ansell <mithro@mithis.com>
 # License: BSD
 
+import time
 import socket
 
-from litex.tools.remote.etherbone import EtherbonePacket, EtherboneRecord
-from litex.tools.remote.etherbone import EtherboneReads, EtherboneWrites
+from litex.tools.remote.etherbone import PackedRecord, pack_packet, unpack_packet
+
+
+class UDPRequest:
+    """Packet waiting for its reply"""
+    def __init__(self, index, packet, length):
+        self.index = index
+        self.packet = packet
+        self.length = length
+        self.retries = 0
+        self.deadline = None
 
 
 class CommUDP:
-    def __init__(self, server="192.168.1.50", port=1234, debug=False):
+    """UDP Etherbone link
+
+    Accesses are split into records of up to 255 words fitting in the MTU, one record per packet.
+    Up to ``window`` packets are kept in flight, a packet is resent when its reply is not received
+    within ``timeout`` seconds, up to ``retries`` times. Replies are matched to the packets by the
+    return address of their reads, which carries a non-zero tag of the packet, and by their number
+    of words.
+
+    Writes are sent once and not acknowledged, as with the original link. With ``write_acks``,
+    they are acknowledged by a read of their last word in the same record and retried like
+    reads: only use it when no written register resets the link or has side effects on reads,
+    retried writes may be performed twice. The packets of an access may be performed out of
+    order.
+    """
+    # IPv4 and UDP headers, Etherbone packet and record headers, base address and base return
+    # address, read of a write acknowledgement
+    overhead = 20 + 8 + 8 + 4 + 4 + 4 + 4
+
+    def __init__(self, server="192.168.1.50", port=1234, window=8, timeout=0.1, retries=5, mtu=1500,
+                 write_acks=False, debug=False):
         self.server = server
         self.port = port
+        self.window = window
+        self.timeout = timeout
+        self.retries = retries
+        self.max_length = min(255, (mtu - self.overhead)//4)
+        self.write_acks = write_acks
         self.debug = debug
+        self.tag = 1
+        self.stats = {"packets": 0, "retries": 0, "stale_replies": 0}
 
     def open(self):
         if hasattr(self, "tx_socket"):
@@ -29,21 +65,75 @@ class CommUDP:
         self.rx_socket.close()
         del self.rx_socket
 
+    def _send(self, packet):
+        self.tx_socket.sendto(packet, (self.server, self.port))
+        self.stats["packets"] += 1
+
+    def _receive(self, timeout):
+        self.rx_socket.settimeout(timeout)
+        try:
+            packet, addr = self.rx_socket.recvfrom(8192)
+            return unpack_packet(packet)[0]
+        except (socket.timeout, ValueError, IndexError):
+            return None
+
+    def _transfer(self, records):
+        """Send a packet per record and return the datas read by each record"""
+        results = [None]*len(records)
+        pending = {} # tag: UDPRequest
+        n = 0
+        while n < len(records) or pending:
+            # fill the window
+            while n < len(records) and len(pending) < self.window:
+                record = records[n]
+                if not len(record.reads):
+                    self._send(pack_packet([record]))
+                    results[n] = []
+                else:
+                    record.base_ret_addr = self.tag
+                    request = UDPRequest(n, pack_packet([record]), len(record.reads))
+                    request.deadline = time.monotonic() + self.timeout
+                    pending[self.tag] = request
+                    self._send(request.packet)
+                    # tag 0 is the base address of records without writes
+                    self.tag = self.tag % 0xffffffff + 1
+                n += 1
+            if not pending:
+                continue
+
+            # resend the packets whose reply is late
+            now = time.monotonic()
+            for request in pending.values():
+                if request.deadline <= now:
+                    if request.retries == self.retries:
+                        raise TimeoutError("No reply from {}:{} after {} retries".format(
+                            self.server, self.port, self.retries))
+                    request.retries += 1
+                    request.deadline = now + self.timeout
+                    self._send(request.packet)
+                    self.stats["retries"] += 1
+
+            reply = self._receive(min(request.deadline for request in pending.values()) - now)
+            if reply is None:
+                continue
+            request = pending.get(reply.base_addr)
+            if request is None or len(reply.writes) != request.length:
+                # reply to a packet that was resent, or to an earlier access
+                self.stats["stale_replies"] += 1
+                continue
+            del pending[reply.base_addr]
+            results[request.index] = list(reply.writes)
+        return results
+
+    def _chunks(self, addr, length):
+        for offset in range(0, length, self.max_length):
+            yield addr + 4*offset, offset, min(length - offset, self.max_length)
+
     def read(self, addr, length=None):
         length_int = 1 if length is None else length
-        record = EtherboneRecord()
-        record.reads = EtherboneReads(addrs=[addr+4*j for j in range(length_int)])
-        record.rcount = len(record.reads)
-
-        packet = EtherbonePacket()
-        packet.records = [record]
-        packet.encode()
-        self.tx_socket.sendto(bytes(packet), (self.server, self.port))
-
-        datas, dummy = self.rx_socket.recvfrom(8192)
-        packet = EtherbonePacket(datas)
-        packet.decode()
-        datas = packet.records.pop().writes.get_datas()
+        records = [PackedRecord(reads=[chunk_addr + 4*j for j in range(size)])
+            for chunk_addr, offset, size in self._chunks(addr, length_int)]
+        datas = [data for result in self._transfer(records) for data in result]
         if self.debug:
             for i, value in enumerate(datas):
                 print("read {:08x} @ {:08x}".format(value, addr + 4*i))
@@ -51,15 +141,12 @@ class CommUDP:
 
     def write(self, addr, datas):
         datas = datas if isinstance(datas, list) else [datas]
-        length = len(datas)
-        record = EtherboneRecord()
-        record.writes = EtherboneWrites(base_addr=addr, datas=iter(datas))
-        record.wcount = len(record.writes)
-
-        packet = EtherbonePacket()
-        packet.records = [record]
-        packet.encode()
-        self.tx_socket.sendto(bytes(packet), (self.server, self.port))
+        records = []
+        for chunk_addr, offset, size in self._chunks(addr, len(datas)):
+            reads = [chunk_addr + 4*(size - 1)] if self.write_acks else []
+            records.append(PackedRecord(base_addr=chunk_addr,
+                writes=datas[offset:offset + size], reads=reads))
+        self._transfer(records)
 
         if self.debug:
             for i, value in enumerate(datas):
@@ -1,8 +1,10 @@
 # This file is Copyright (c) 2019 Sean Cross <sean@xobs.io>
 # License: BSD
 
-import usb.core
 import time
+import errno
+import array
+import struct
 
 # Wishbone USB Protocol Bridge
 # ============================
@@ -50,105 +52,162 @@ import time
 # We reuse these two 16-bit values as a single 32-bit ADDRESS packet.  Note that
 # USB is big endian.
 #
-# Finally, the last two bytes indicate the length of the transaction.  Since
-# we only support 32-bit reads and writes, this is always 4.  On big endian
-# USB, this has the value {04, 00}.
+# Finally, the last two bytes indicate the length of the transaction.  Single
+# 32-bit reads and writes have a length of 4, on big endian USB this has the
+# value {04, 00}.  Bridges supporting bursts also accept multiples of 4 and
+# access consecutive addresses, the words are sent in little endian order.
+
+
+class USBLoopback:
+    """Stand-in for a USB device with a Wishbone bridge, backed by a dict of words
+
+    It does not need libusb. The ``failures`` next transfers fail with an IOError, like pyusb's
+    USBError.
+    """
+    def __init__(self, failures=0):
+        self.mem = {}
+        self.failures = failures
+        self.transfers = []
+
+    def ctrl_transfer(self, bmRequestType, bRequest=0, wValue=0, wIndex=0, data_or_wLength=None,
+                      timeout=None):
+        if self.failures:
+            self.failures -= 1
+            raise IOError(errno.EPIPE, "Pipe error")
+        addr = (wIndex << 16) | wValue
+        if bmRequestType == 0xc3:
+            length = data_or_wLength//4
+            self.transfers.append(("read", addr, length))
+            datas = [self.mem.get(addr + 4*i, 0) for i in range(length)]
+            return array.array("B", struct.pack("<{}I".format(length), *datas))
+        else:
+            length = len(data_or_wLength)//4
+            self.transfers.append(("write", addr, length))
+            for i, value in enumerate(struct.unpack("<{}I".format(length), data_or_wLength)):
+                self.mem[addr + 4*i] = value
+            return 4*length
+
 
 class CommUSB:
-    def __init__(self, vid=None, pid=None, max_retries=10, debug=False):
+    """USB bridge link
+
+    Accesses are split into control transfers of up to ``max_length`` words, the default of a
+    single word is supported by every bridge. A failed transfer is retried up to ``max_retries``
+    times, the device being looked for once after a delay doubling from ``backoff`` seconds.
+
+    ``device`` replaces the device found by its vendor and product IDs, e.g. by a
+    ``USBLoopback``.
+    """
+    def __init__(self, vid=None, pid=None, max_retries=10, max_length=1, backoff=0.01,
+                 device=None, debug=False):
+        assert 1 <= max_length <= 0xffff//4
         self.vid = vid
         self.pid = pid
         self.debug = debug
         self.max_retries = max_retries
-        self.MAX_RECURSION_COUNT = 5
+        self.max_length = max_length
+        self.backoff = backoff
+        self.device = device
+        self.stats = {"transfers": 0, "retries": 0, "bytes": 0, "elapsed": 0.0}
+
+    def _find(self):
+        """Single attempt to find the device"""
+        if self.device is not None:
+            self.dev = self.device
+            return True
+        import usb.core
+        args = {}
+        if self.vid is not None:
+            args['idVendor'] = self.vid
+        if self.pid is not None:
+            args['idProduct'] = self.pid
+        dev = usb.core.find(**args)
+        if dev is None:
+            return False
+        self.dev = dev
+        return True
 
     def open(self):
         if hasattr(self, "dev"):
-            return
+            return True
         for t in range(self.max_retries):
-            args = {}
-            if self.vid is not None:
-                args['idVendor'] = self.vid
-            if self.pid is not None:
-                args['idProduct'] = self.pid
-            self.dev = usb.core.find(**args)
-            if self.dev is not None:
+            if self._find():
                 if self.debug:
                     print("device connected after {} tries".format(t+1))
                 return True
-            del self.dev
             time.sleep(0.2 * t)
         print("unable to find usb device after {} tries".format(self.max_retries))
         return False
 
-
     def close(self):
         if not hasattr(self, "dev"):
             return
         del self.dev
 
+    def throughput(self):
+        """Bytes per second transferred, over the time spent in transfers"""
+        if not self.stats["elapsed"]:
+            return 0.0
+        return self.stats["bytes"]/self.stats["elapsed"]
+
+    def _transfer(self, bmRequestType, addr, data_or_wLength):
+        length = data_or_wLength if isinstance(data_or_wLength, int) else len(data_or_wLength)
+        for retry in range(self.max_retries + 1):
+            if retry:
+                self.stats["retries"] += 1
+                self.close()
+                time.sleep(self.backoff*2**(retry - 1))
+                # a single attempt per retry, the retries are bounded by max_retries
+                if not self._find():
+                    continue
+            start = time.monotonic()
+            try:
+                value = self.dev.ctrl_transfer(bmRequestType=bmRequestType,
+                            bRequest=0x00,
+                            wValue=addr & 0xffff,
+                            wIndex=(addr >> 16) & 0xffff,
+                            data_or_wLength=data_or_wLength,
+                            timeout=None)
+            except IOError as e:
+                # pyusb's USBError is an IOError
+                if e.errno == errno.EACCES:
+                    print("Access Denied. Maybe try using sudo?")
+                    raise
+                continue
+            finally:
+                self.stats["elapsed"] += time.monotonic() - start
+            # the value ends up as None or short when the device disconnects during a transaction
+            if bmRequestType == 0xc3:
+                if value is None or len(value) != length:
+                    continue
+            elif value != length:
+                continue
+            self.stats["transfers"] += 1
+            self.stats["bytes"] += length
+            return value
+        raise IOError("USB transfer at {:08x} failed after {} retries".format(addr,
+            self.max_retries))
+
+    def _chunks(self, addr, length):
+        for offset in range(0, length, self.max_length):
+            yield addr + 4*offset, offset, min(length - offset, self.max_length)
+
     def read(self, addr, length=None):
-        data = []
         length_int = 1 if length is None else length
-        for i in range(length_int):
-            value = self.usb_read(addr)
-            # Note that sometimes, the value ends up as None when the device
-            # disconnects during a transaction.  Paper over this fact by
-            # replacing it with a sentinal.
-            if value is None:
-                value = 0xffffffff
-            if self.debug:
-                print("read {:08x} @ {:08x}".format(value, addr))
-            if length is None:
-                return value
-            data.append(value)
-        return data
-
-    def usb_read(self, addr, depth=0):
-        try:
-            value = self.dev.ctrl_transfer(bmRequestType=0xc3,
-                        bRequest=0x00,
-                        wValue=addr & 0xffff,
-                        wIndex=(addr >> 16) & 0xffff,
-                        data_or_wLength=4)
-            if value is None:
-                raise TypeError
-            return int.from_bytes(value, byteorder="little")
-        except usb.core.USBError as e:
-            if e.errno == 13:
-                print("Access Denied. Maybe try using sudo?")
-            self.close()
-            self.open()
-            if depth < self.MAX_RECURSION_COUNT:
-                return self.usb_read(addr, depth+1)
-        except TypeError:
-            self.close()
-            self.open()
-            if depth < self.MAX_RECURSION_COUNT:
-                return self.usb_read(addr, depth+1)
+        datas = []
+        for chunk_addr, offset, size in self._chunks(addr, length_int):
+            value = self._transfer(0xc3, chunk_addr, 4*size)
+            datas += struct.unpack("<{}I".format(size), bytes(value))
+        if self.debug:
+            for i, value in enumerate(datas):
+                print("read {:08x} @ {:08x}".format(value, addr + 4*i))
+        return datas[0] if length is None else datas
 
     def write(self, addr, data):
         data = data if isinstance(data, list) else [data]
-        length = len(data)
-        for i, value in enumerate(data):
-            self.usb_write(addr, value)
-            if self.debug:
+        for chunk_addr, offset, size in self._chunks(addr, len(data)):
+            self._transfer(0x43, chunk_addr,
+                struct.pack("<{}I".format(size), *data[offset:offset + size]))
+        if self.debug:
+            for i, value in enumerate(data):
                 print("write {:08x} @ {:08x}".format(value, addr + 4*i))
-
-    def usb_write(self, addr, value, depth=0):
-        try:
-            value = self.dev.ctrl_transfer(bmRequestType=0x43, bRequest=0x00,
-                    wValue=addr & 0xffff,
-                    wIndex=(addr >> 16) & 0xffff,
-                    data_or_wLength=bytes([(value >> 0) & 0xff,
-                                           (value >> 8) & 0xff,
-                                           (value >> 16) & 0xff,
-                                           (value >> 24) & 0xff]
-                                          ), timeout=None)
-        except usb.core.USBError as e:
-            if e.errno == 13:
-                print("Access Denied. Maybe try using sudo?")
-            self.close()
-            self.open()
-            if depth < self.MAX_RECURSION_COUNT:
-                return self.usb_write(addr, value, depth+1)
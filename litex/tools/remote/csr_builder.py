@@ -31,26 +31,32 @@ class CSRRegister:
         self.data_width = data_width
         self.mode = mode
 
+    def decode(self, datas):
+        data = 0
+        for i in range(self.length):
+            data = data << self.data_width
+            data |= datas[i]
+        return data
+
+    def encode(self, value):
+        datas = []
+        for i in range(self.length):
+            datas.append((value >> ((self.length-1-i)*self.data_width)) & (2**self.data_width-1))
+        return datas
+
     def read(self):
         if self.mode not in ["rw", "ro"]:
-            raise KeyError(self.name + "register not readable")
+            raise KeyError(self.name + " register not readable")
         datas = self.readfn(self.addr, length=self.length)
         if isinstance(datas, int):
             return datas
         else:
-            data = 0
-            for i in range(self.length):
-                data = data << self.data_width
-                data |= datas[i]
-            return data
+            return self.decode(datas)
 
     def write(self, value):
         if self.mode not in ["rw", "wo"]:
-            raise KeyError(self.name + "register not writable")
-        datas = []
-        for i in range(self.length):
-            datas.append((value >> ((self.length-1-i)*self.data_width)) & (2**self.data_width-1))
-        self.writefn(self.addr, datas)
+            raise KeyError(self.name + " register not writable")
+        self.writefn(self.addr, self.encode(value))
 
 
 class CSRMemoryRegion:
@@ -81,7 +87,8 @@ class CSRBuilder:
 
     @staticmethod
     def get_csr_items(csr_csv):
-        return list(csv.reader(filter(lambda row: row[0] != "#", open(csr_csv))))
+        with open(csr_csv) as f:
+            return list(csv.reader(filter(lambda row: row[0] != "#", f)))
 
     def build_bases(self):
         d = {}
@@ -119,3 +126,104 @@ class CSRBuilder:
             if group == "memory_region":
                 d[name] = CSRMemoryRegion(int(base, 16), int(size))
         return CSRElements(d)
+
+
+class CSRCache:
+    """Cache of the registers of a CSRBuilder
+
+    ``rw`` registers written through the cache are read from a shadow of the written value, unless
+    they are listed in ``volatile`` (registers also updated by the design after being written, or
+    with side effects on reads). Registers not written through the cache are read on the link and
+    not cached, ``rw`` registers of the csv include the plain CSRs and the storages updated by the
+    design. ``wo`` registers read their last written value and ``ro`` registers are always read on
+    the link.
+
+    ``read_many`` and ``snapshot`` read the registers in as few block reads as possible, registers
+    at adjacent addresses are read together. ``snapshot`` reads all the registers of a bank but
+    the volatile ones on the link, including registers with side effects on reads (e.g. the
+    ``rxtx`` register of a UART). ``comm`` defaults to the builder (RemoteClient).
+    """
+    def __init__(self, builder, comm=None, volatile=[]):
+        comm = builder if comm is None else comm
+        self.readfn = comm.read
+        self.writefn = comm.write
+        self.regs = builder.regs
+        self.bases = builder.bases
+        self.volatile = set(volatile)
+        self.shadows = {}
+        self.stats = {"hits": 0, "misses": 0, "reads": 0}
+
+    def _register(self, reg):
+        return reg if isinstance(reg, CSRRegister) else getattr(self.regs, reg)
+
+    def _cached(self, reg):
+        if reg.mode == "wo":
+            if reg.name not in self.shadows:
+                raise KeyError(reg.name + " register not written")
+            return True
+        return reg.mode == "rw" and reg.name not in self.volatile and reg.name in self.shadows
+
+    def _fetch(self, regs):
+        values = {}
+        regs = sorted(regs, key=lambda reg: reg.addr)
+        i = 0
+        while i < len(regs):
+            j = i + 1
+            while j < len(regs) and regs[j].addr == regs[j - 1].addr + 4*regs[j - 1].length:
+                j += 1
+            datas = self.readfn(regs[i].addr, length=sum(reg.length for reg in regs[i:j]))
+            if isinstance(datas, int):
+                datas = [datas]
+            self.stats["reads"] += 1
+            offset = 0
+            for reg in regs[i:j]:
+                values[reg.name] = reg.decode(datas[offset:offset + reg.length])
+                offset += reg.length
+            i = j
+        return values
+
+    def read_many(self, regs):
+        """Values of registers given by name or as CSRRegister"""
+        regs = [self._register(reg) for reg in regs]
+        fetch = {reg.name: reg for reg in regs if not self._cached(reg)}
+        values = self._fetch(fetch.values())
+        r = []
+        for reg in regs:
+            if reg.name in values:
+                self.stats["misses"] += 1
+                r.append(values[reg.name])
+            else:
+                self.stats["hits"] += 1
+                r.append(self.shadows[reg.name])
+        return r
+
+    def read(self, reg):
+        return self.read_many([reg])[0]
+
+    def write(self, reg, value):
+        reg = self._register(reg)
+        if reg.mode not in ["rw", "wo"]:
+            raise KeyError(reg.name + " register not writable")
+        self.writefn(reg.addr, reg.encode(value))
+        self.shadows[reg.name] = value
+
+    def invalidate(self, reg=None):
+        if reg is None:
+            self.shadows.clear()
+        else:
+            self.shadows.pop(self._register(reg).name, None)
+
+    def bank_registers(self, bank):
+        base = getattr(self.bases, bank)
+        ends = [addr for addr in self.bases.d.values() if addr > base]
+        end = min(ends) if ends else None
+        return [reg for reg in self.regs.d.values()
+            if reg.addr >= base and (end is None or reg.addr < end)]
+
+    def snapshot(self, bank):
+        """Values of the readable, non-volatile registers of a CSR bank, read on the link"""
+        regs = [reg for reg in self.bank_registers(bank)
+            if reg.mode in ["rw", "ro"] and reg.name not in self.volatile]
+        values = self._fetch(regs)
+        self.stats["misses"] += len(values)
+        return values
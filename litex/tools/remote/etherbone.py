@@ -2,8 +2,10 @@
 # This file is Copyright (c) 2017 Tim Ansell <mithro@mithis.com>
 # License: BSD
 
+import sys
 import math
 import struct
+from array import array
 
 from litex.soc.interconnect.stream_packet import HeaderField, Header
 
@@ -62,12 +64,116 @@ def get_field_data(field, datas):
     return (v >> field.offset) & (2**field.width-1)
 
 
+# Packed codec -------------------------------------------------------------------------------------
+
+# Encodes and decodes packets directly from bytes-like objects, words are handled as arrays.
+
+_packet_header = struct.Struct(">HBB4x")
+_record_header = struct.Struct(">BBBB")
+_word = struct.Struct(">I")
+_word_type = "I" if array("I").itemsize == 4 else "L"
+_swap_words = sys.byteorder == "little"
+
+# fields of the first byte of the record header
+_record_flags = [(k, v) for k, v in sorted(etherbone_record_header_fields.items()) if v.byte == 0]
+
+
+def _pack_words(base, words):
+    a = array(_word_type, [base])
+    a.extend(words)
+    if _swap_words:
+        a.byteswap()
+    return a.tobytes()
+
+
+def _unpack_words(data, offset, n):
+    end = offset + 4*n
+    if len(data) < end:
+        raise ValueError("Truncated Etherbone record")
+    words = array(_word_type)
+    words.frombytes(memoryview(data)[offset:end])
+    if _swap_words:
+        words.byteswap()
+    return words
+
+
+class PackedRecord:
+    """Etherbone record of the packed codec
+
+    ``writes`` and ``reads`` are sequences of 32-bit words (arrays when decoded), ``flags`` is the
+    first byte of the record header (bca, rca, rff, cyc, wca and wff bits).
+    """
+    __slots__ = ("base_addr", "writes", "base_ret_addr", "reads", "flags", "byte_enable")
+
+    def __init__(self, base_addr=0, writes=(), base_ret_addr=0, reads=(), flags=0, byte_enable=0xf):
+        self.base_addr = base_addr
+        self.writes = writes
+        self.base_ret_addr = base_ret_addr
+        self.reads = reads
+        self.flags = flags
+        self.byte_enable = byte_enable
+
+
+def pack_record(record):
+    wcount = len(record.writes)
+    rcount = len(record.reads)
+    if wcount > 255 or rcount > 255:
+        raise ValueError("Etherbone records hold at most 255 writes and 255 reads")
+    r = [_record_header.pack(record.flags, record.byte_enable, wcount, rcount)]
+    if wcount:
+        r.append(_pack_words(record.base_addr, record.writes))
+    if rcount:
+        r.append(_pack_words(record.base_ret_addr, record.reads))
+    return b"".join(r)
+
+
+def unpack_record(data, offset=0):
+    """Decode the record at ``offset`` of ``data``, returns it with the offset following it"""
+    if len(data) < offset + etherbone_record_header_length:
+        raise ValueError("Truncated Etherbone record")
+    flags, byte_enable, wcount, rcount = _record_header.unpack_from(data, offset)
+    offset += etherbone_record_header_length
+    record = PackedRecord(flags=flags, byte_enable=byte_enable)
+    if wcount:
+        record.writes = _unpack_words(data, offset + 4, wcount)
+        record.base_addr, = _word.unpack_from(data, offset)
+        offset += 4*(wcount + 1)
+    if rcount:
+        record.reads = _unpack_words(data, offset + 4, rcount)
+        record.base_ret_addr, = _word.unpack_from(data, offset)
+        offset += 4*(rcount + 1)
+    return record, offset
+
+
+def pack_packet(records, nr=0, pr=0, pf=0):
+    header = _packet_header.pack(etherbone_magic, (etherbone_version << 4) | (nr << 2) | (pr << 1) | pf,
+        ((32//8) << 4) | (32//8))
+    return b"".join([header] + [pack_record(record) for record in records])
+
+
+def unpack_packet(data):
+    """Decode the records of the packet ``data`` (bytes, bytearray or memoryview)"""
+    if len(data) < etherbone_packet_header_length:
+        raise ValueError("Truncated Etherbone packet")
+    magic, _, _ = _packet_header.unpack_from(data)
+    if magic != etherbone_magic:
+        raise ValueError("Invalid Etherbone magic 0x{:04x}".format(magic))
+    records = []
+    offset = etherbone_packet_header_length
+    while offset < len(data):
+        record, offset = unpack_record(data, offset)
+        records.append(record)
+    return records
+
+# Compatibility classes ----------------------------------------------------------------------------
+
+# Packets as lists of bytes, encoded and decoded with the packed codec.
+
 class Packet(list):
     def __init__(self, init=[]):
         self.ongoing = False
         self.done = False
-        for data in init:
-            self.append(data)
+        self.extend(init)
 
 
 class EtherboneWrite:
@@ -90,43 +196,28 @@ class EtherboneWrites(Packet):
     def __init__(self, init=[], base_addr=0, datas=[]):
         Packet.__init__(self, init)
         self.base_addr = base_addr
-        self.writes = []
+        self.writes = [EtherboneWrite(data) for data in datas]
         self.encoded = init != []
-        for data in datas:
-            self.add(EtherboneWrite(data))
 
     def add(self, write):
         self.writes.append(write)
 
     def get_datas(self):
-        datas = []
-        for write in self.writes:
-            datas.append(write.data)
-        return datas
+        return [write.data for write in self.writes]
 
     def encode(self):
         if self.encoded:
             raise ValueError
-        for byte in split_bytes(self.base_addr, 4):
-            self.append(byte)
-        for write in self.writes:
-            for byte in split_bytes(write.data, 4):
-                self.append(byte)
+        self.extend(_pack_words(self.base_addr, self.get_datas()))
         self.encoded = True
 
     def decode(self):
         if not self.encoded:
             raise ValueError
-        base_addr = []
-        for i in range(4):
-            base_addr.append(self.pop(0))
-        self.base_addr = merge_bytes(base_addr)
-        self.writes = []
-        while len(self) != 0:
-            write = []
-            for i in range(4):
-                write.append(self.pop(0))
-            self.writes.append(EtherboneWrite(merge_bytes(write)))
+        words = _unpack_words(bytes(self), 0, len(self)//4)
+        self.base_addr = words[0]
+        self.writes = [EtherboneWrite(data) for data in words[1:]]
+        self.clear()
         self.encoded = False
 
     def __repr__(self):
@@ -142,43 +233,28 @@ class EtherboneReads(Packet):
     def __init__(self, init=[], base_ret_addr=0, addrs=[]):
         Packet.__init__(self, init)
         self.base_ret_addr = base_ret_addr
-        self.reads = []
+        self.reads = [EtherboneRead(addr) for addr in addrs]
         self.encoded = init != []
-        for addr in addrs:
-            self.add(EtherboneRead(addr))
 
     def add(self, read):
         self.reads.append(read)
 
     def get_addrs(self):
-        addrs = []
-        for read in self.reads:
-            addrs.append(read.addr)
-        return addrs
+        return [read.addr for read in self.reads]
 
     def encode(self):
         if self.encoded:
             raise ValueError
-        for byte in split_bytes(self.base_ret_addr, 4):
-            self.append(byte)
-        for read in self.reads:
-            for byte in split_bytes(read.addr, 4):
-                self.append(byte)
+        self.extend(_pack_words(self.base_ret_addr, self.get_addrs()))
         self.encoded = True
 
     def decode(self):
         if not self.encoded:
             raise ValueError
-        base_ret_addr = []
-        for i in range(4):
-            base_ret_addr.append(self.pop(0))
-        self.base_ret_addr = merge_bytes(base_ret_addr)
-        self.reads = []
-        while len(self) != 0:
-            read = []
-            for i in range(4):
-                read.append(self.pop(0))
-            self.reads.append(EtherboneRead(merge_bytes(read)))
+        words = _unpack_words(bytes(self), 0, len(self)//4)
+        self.base_ret_addr = words[0]
+        self.reads = [EtherboneRead(addr) for addr in words[1:]]
+        self.clear()
         self.encoded = False
 
     def __repr__(self):
@@ -206,68 +282,51 @@ class EtherboneRecord(Packet):
         self.rcount = 0
         self.encoded = init != []
 
-
-    def get_writes(self):
-        if self.wcount == 0:
-            return None
-        else:
-            writes = []
-            for i in range((self.wcount+1)*4):
-                writes.append(self.pop(0))
-            return EtherboneWrites(writes)
-
-    def get_reads(self):
-        if self.rcount == 0:
-            return None
-        else:
-            reads = []
-            for i in range((self.rcount+1)*4):
-                reads.append(self.pop(0))
-            return EtherboneReads(reads)
+    def to_packed(self):
+        flags = 0
+        for k, v in _record_flags:
+            flags |= (getattr(self, k) & (2**v.width - 1)) << v.offset
+        record = PackedRecord(flags=flags, byte_enable=self.byte_enable)
+        if self.writes is not None:
+            record.base_addr = self.writes.base_addr
+            record.writes = self.writes.get_datas()
+        if self.reads is not None:
+            record.base_ret_addr = self.reads.base_ret_addr
+            record.reads = self.reads.get_addrs()
+        return record
+
+    @classmethod
+    def from_packed(cls, record):
+        r = cls()
+        for k, v in _record_flags:
+            setattr(r, k, (record.flags >> v.offset) & (2**v.width - 1))
+        r.byte_enable = record.byte_enable
+        r.wcount = len(record.writes)
+        r.rcount = len(record.reads)
+        if r.wcount:
+            r.writes = EtherboneWrites(base_addr=record.base_addr, datas=record.writes)
+        if r.rcount:
+            r.reads = EtherboneReads(base_ret_addr=record.base_ret_addr, addrs=record.reads)
+        return r
 
     def decode(self):
         if not self.encoded:
             raise ValueError
-        header = []
-        for byte in self[:etherbone_record_header.length]:
-            header.append(self.pop(0))
-        for k, v in sorted(etherbone_record_header.fields.items()):
-            setattr(self, k, get_field_data(v, header))
-        self.writes = self.get_writes()
-        if self.writes is not None:
-            self.writes.decode()
-        self.reads = self.get_reads()
-        if self.reads is not None:
-            self.reads.decode()
+        record, length = unpack_record(bytes(self))
+        decoded = self.from_packed(record)
+        for k in ["writes", "reads", "byte_enable", "wcount", "rcount"] + [k for k, v in _record_flags]:
+            setattr(self, k, getattr(decoded, k))
+        # the following records remain
+        del self[:length]
         self.encoded = False
 
-    def set_writes(self, writes):
-        self.wcount = len(writes.writes)
-        writes.encode()
-        for byte in writes:
-            self.append(byte)
-
-    def set_reads(self, reads):
-        self.rcount = len(reads.reads)
-        reads.encode()
-        for byte in reads:
-            self.append(byte)
-
     def encode(self):
         if self.encoded:
             raise ValueError
-        if self.writes is not None:
-            self.set_writes(self.writes)
-        if self.reads is not None:
-            self.set_reads(self.reads)
-        header = 0
-        for k, v in sorted(etherbone_record_header.fields.items()):
-            value = merge_bytes(split_bytes(getattr(self, k),
-                                            math.ceil(v.width/8)),
-                                            "little")
-            header += (value << v.offset+(v.byte*8))
-        for d in split_bytes(header, etherbone_record_header.length):
-            self.insert(0, d)
+        record = self.to_packed()
+        self.wcount = len(record.writes)
+        self.rcount = len(record.reads)
+        self.extend(pack_record(record))
         self.encoded = True
 
     def __repr__(self, n=0):
@@ -300,44 +359,27 @@ class EtherbonePacket(Packet):
         self.pr = 0
         self.pf = 0
 
-    def get_records(self):
-        records = []
-        done = False
-        payload = self
-        while len(payload) != 0:
-            record = EtherboneRecord(payload)
-            record.decode()
-            records.append(record)
-            payload = record[:]
-        return records
-
     def decode(self):
         if not self.encoded:
             raise ValueError
-        header = []
-        for byte in self[:etherbone_packet_header.length]:
-            header.append(self.pop(0))
+        data = bytes(self)
+        header = data[:etherbone_packet_header.length]
         for k, v in sorted(etherbone_packet_header.fields.items()):
             setattr(self, k, get_field_data(v, header))
-        self.records = self.get_records()
+        self.records = [EtherboneRecord.from_packed(record) for record in unpack_packet(data)]
+        self.clear()
         self.encoded = False
 
-    def set_records(self, records):
-        for record in records:
-            record.encode()
-            for byte in record:
-                self.append(byte)
-
     def encode(self):
         if self.encoded:
             raise ValueError
-        self.set_records(self.records)
         header = 0
         for k, v in sorted(etherbone_packet_header.fields.items()):
             value = merge_bytes(split_bytes(getattr(self, k), math.ceil(v.width/8)), "little")
             header += (value << v.offset+(v.byte*8))
-        for d in split_bytes(header, etherbone_packet_header.length):
-            self.insert(0, d)
+        self.extend(split_bytes(header, etherbone_packet_header.length, "little"))
+        for record in self.records:
+            self.extend(pack_record(record.to_packed()))
         self.encoded = True
 
     def __repr__(self):
@@ -359,6 +401,13 @@ class EtherboneIPC:
         socket.sendall(bytes(packet))
 
     def receive_packet(self, socket):
+        """Receive a packet of a single record
+
+        Etherbone packets do not give their length: a packet can only be delimited on the stream
+        when it holds a single record, as sent by the server (a reply packet per record) and by
+        the clients. Records following the first one of a packet are not read, they are detected
+        by their missing magic on the next call.
+        """
         header_length = etherbone_packet_header_length + etherbone_record_header_length
         packet = bytes()
         while len(packet) < header_length:
@@ -367,9 +416,17 @@ class EtherboneIPC:
                 return 0
             else:
                 packet += chunk
+        magic, = struct.unpack(">H", packet[:2])
+        if magic != etherbone_magic:
+            raise ValueError("Invalid Etherbone magic 0x{:04x}, packets must hold a single "
+                "record".format(magic))
         wcount, rcount = struct.unpack(">BB", packet[header_length-2:])
-        counts = wcount + rcount
-        packet_size = header_length + 4*(counts + 1)
+        # writes and reads are each preceded by their base address
+        packet_size = header_length
+        if wcount:
+            packet_size += 4*(wcount + 1)
+        if rcount:
+            packet_size += 4*(rcount + 1)
         while len(packet) < packet_size:
             chunk = socket.recv(packet_size - len(packet))
             if len(chunk) == 0:
@@ -41,6 +41,7 @@ setup(
             "litex_server=litex.tools.litex_server:main",
             "litex_sim=litex.tools.litex_sim:main",
             "litex_read_verilog=litex.tools.litex_read_verilog:main",
+            "litex_lxw2vcd=litex.gen.sim.lxw:main",
             "litex_simple=litex.boards.targets.simple:main",
             # short names
             "lxterm=litex.tools.litex_term:main",
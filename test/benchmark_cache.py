@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+# License: BSD
+
+"""Wishbone cache benchmark
+
+Simulates a firmware-like access pattern (a loop over code, a stack and a walk over a data
+buffer, conflicting in a direct-mapped cache) on a wishbone.Cache in front of a Wishbone SRAM,
+for several associativities and line sizes, and prints the hits, misses and evictions counted by
+the cache CSRs and the cycles per access.
+"""
+
+import random
+import argparse
+
+from migen import *
+
+from litex.soc.interconnect import wishbone
+
+
+class DUT(Module):
+    def __init__(self, cachesize, ways, linesize, write_through):
+        self.master = wishbone.Interface()
+        self.submodules.sram = wishbone.SRAM(0x10000)
+        self.submodules.cache = wishbone.Cache(cachesize, self.master, self.sram.bus,
+            ways=ways, linesize=linesize, write_through=write_through, with_csr=True)
+
+
+def accesses(cachesize, length, seed=0):
+    prng = random.Random(seed)
+    code, stack, data = 0, cachesize, 2*cachesize + 8
+    pc = sp = 0
+    for i in range(length):
+        kind = prng.random()
+        if kind < 0.5:
+            pc = (pc + 1) % (cachesize//2)
+            yield False, code + pc
+        elif kind < 0.7:
+            sp = max(0, min(15, sp + prng.choice([-1, 1])))
+            yield prng.random() < 0.5, stack + sp
+        else:
+            yield prng.random() < 0.3, data + prng.randrange(4*cachesize)
+
+
+def measure(cachesize, ways, linesize, write_through, length):
+    dut = DUT(cachesize, ways, linesize, write_through)
+    results = {}
+
+    def generator():
+        for write, adr in accesses(cachesize, length):
+            if write:
+                yield from dut.master.write(adr, adr)
+            else:
+                yield from dut.master.read(adr)
+        yield
+        for name in ["hits", "misses", "evictions"]:
+            results[name] = (yield getattr(dut.cache, "_" + name).status)
+
+    @passive
+    def timer():
+        while True:
+            yield
+            results["cycles"] = results.get("cycles", 0) + 1
+
+    run_simulation(dut, [generator(), timer()])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wishbone cache benchmark")
+    parser.add_argument("--cachesize", default=256, type=int, help="cache size, in words")
+    parser.add_argument("--length", default=2000, type=int, help="accesses")
+    parser.add_argument("--write-through", action="store_true", help="write-through cache")
+    args = parser.parse_args()
+
+    for ways in [1, 2, 4, 8]:
+        for linesize in [1, 4, 8]:
+            results = measure(args.cachesize, ways, linesize, args.write_through, args.length)
+            print("{}-way, {}-word lines: hit rate {:.1f}%, {} evictions, {:.2f} cycles/access".format(
+                ways, linesize, 100*results["hits"]/args.length, results["evictions"],
+                results["cycles"]/args.length))
+
+
+if __name__ == "__main__":
+    main()
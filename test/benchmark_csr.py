@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# License: BSD
+
+"""CSR access benchmark
+
+Simulates the CSR path of a SoCCore (shared Wishbone interconnect, WB2CSR bridge and CSR
+banks) for 8 and 32-bit CSR data widths, and prints the 32-bit CSR reads and writes per
+second performed by a Wishbone master, as done by the generated C accessors: a bus access per
+CSR data word.
+"""
+
+import argparse
+
+from migen import *
+
+from litex.soc.interconnect import csr, csr_bus, wishbone
+from litex.soc.interconnect.wishbone2csr import WB2CSR
+from litex.soc.integration.common import mem_decoder
+
+
+class CSRModule(Module, csr.AutoCSR):
+    def __init__(self):
+        self._scratch = csr.CSRStorage(32, reset=0x12345678, name="scratch")
+        self._status = csr.CSRStatus(32, name="status")
+
+
+class DUT(Module):
+    def __init__(self, csr_data_width):
+        self.master = wishbone.Interface()
+        self.submodules.csrmodule = CSRModule()
+        self.submodules.wishbone2csr = WB2CSR(bus_csr=csr_bus.Interface(data_width=csr_data_width))
+        self.submodules.wishbonecon = wishbone.InterconnectShared([self.master],
+            [(mem_decoder(0x82000000, 0x1000000), self.wishbone2csr.wishbone)], register=True)
+        self.submodules.csrbankarray = csr_bus.CSRBankArray(self,
+            lambda name, memory: {"csrmodule": 0}[name], data_width=csr_data_width)
+        self.submodules.csrcon = csr_bus.Interconnect(self.wishbone2csr.csr,
+            self.csrbankarray.get_buses())
+
+
+def measure(csr_data_width, length):
+    dut = DUT(csr_data_width)
+    nwords = 32//csr_data_width
+    base = 0x82000000 >> 2
+    cycles = {"now": 0}
+
+    def generator():
+        for name in ["write", "read"]:
+            start = cycles["now"]
+            for i in range(length):
+                if name == "write":
+                    for word in range(nwords):
+                        yield from dut.master.write(base + word,
+                            (i >> (nwords - word - 1)*csr_data_width) & (2**csr_data_width - 1))
+                else:
+                    value = 0
+                    for word in range(nwords):
+                        value <<= csr_data_width
+                        value |= (yield from dut.master.read(base + word))
+                    assert value == length - 1
+            cycles[name] = cycles["now"] - start
+
+    @passive
+    def timer():
+        while True:
+            yield
+            cycles["now"] += 1
+
+    run_simulation(dut, [generator(), timer()])
+    return cycles["write"]/length, cycles["read"]/length
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CSR access benchmark")
+    parser.add_argument("--clk-freq", default=100e6, type=float, help="system clock frequency")
+    parser.add_argument("--length", default=1000, type=int, help="accesses")
+    args = parser.parse_args()
+
+    for csr_data_width in [8, 32]:
+        write, read = measure(csr_data_width, args.length)
+        print("csr_data_width={}: write {:.1f} cycles ({:.2f} Mops/s), "
+              "read {:.1f} cycles ({:.2f} Mops/s)".format(csr_data_width,
+              write, args.clk_freq/write/1e6, read, args.clk_freq/read/1e6))
+
+
+if __name__ == "__main__":
+    main()
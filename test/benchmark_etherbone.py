@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+# License: BSD
+
+"""Etherbone codec benchmark
+
+Encodes and decodes packets of full records (255 writes or reads) with the packed codec and with
+the compatibility classes built on it.
+"""
+
+import time
+import argparse
+
+from litex.tools.remote.etherbone import EtherbonePacket, EtherboneRecord
+from litex.tools.remote.etherbone import EtherboneReads, EtherboneWrites
+from litex.tools.remote.etherbone import PackedRecord, pack_packet, unpack_packet
+
+
+def packed_encode(datas):
+    return pack_packet([PackedRecord(base_addr=0x1000, writes=datas),
+                        PackedRecord(base_ret_addr=0x1000, reads=datas)])
+
+
+def packed_decode(data):
+    return unpack_packet(memoryview(data))
+
+
+def classes_encode(datas):
+    writes = EtherboneRecord()
+    writes.writes = EtherboneWrites(base_addr=0x1000, datas=datas)
+    reads = EtherboneRecord()
+    reads.reads = EtherboneReads(base_ret_addr=0x1000, addrs=datas)
+    packet = EtherbonePacket()
+    packet.records = [writes, reads]
+    packet.encode()
+    return bytes(packet)
+
+
+def classes_decode(data):
+    packet = EtherbonePacket(data)
+    packet.decode()
+    return packet.records
+
+
+def run(fn, arg, n):
+    start = time.perf_counter()
+    for i in range(n):
+        r = fn(arg)
+    return r, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Etherbone codec benchmark")
+    parser.add_argument("--packets", default=2000, type=int, help="number of packets")
+    args = parser.parse_args()
+
+    datas = list(range(255))
+    for name, encode, decode in [
+        ("packed codec", packed_encode, packed_decode),
+        ("compatibility classes", classes_encode, classes_decode)]:
+        data, te = run(encode, datas, args.packets)
+        _, td = run(decode, data, args.packets)
+        mb = len(data)*args.packets/1e6
+        print("{}: encode {:.1f} MB/s, decode {:.1f} MB/s".format(name, mb/te, mb/td))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+# License: BSD
+
+"""Wishbone interconnect benchmark
+
+Simulates 2 to 4 masters writing and reading back bursts on as many Wishbone SRAMs, through a
+shared interconnect and through a crossbar, and prints the aggregate words transferred per
+cycle. Each master accesses its own SRAM with a probability of ``--locality`` and a random
+SRAM otherwise: a crossbar only serializes the masters accessing the same SRAM.
+"""
+
+import random
+import argparse
+
+from migen import *
+
+from litex.soc.interconnect import wishbone
+from litex.soc.integration.common import mem_decoder
+
+
+class DUT(Module):
+    def __init__(self, n, interconnect):
+        self.masters = [wishbone.Interface() for i in range(n)]
+        self.srams = [wishbone.SRAM(0x1000) for i in range(n)]
+        self.submodules += self.srams
+        slaves = [(mem_decoder(0x1000*i, 0x1000), sram.bus) for i, sram in enumerate(self.srams)]
+        if interconnect == "shared":
+            self.submodules.interconnect = wishbone.InterconnectShared(self.masters, slaves,
+                register=True)
+        else:
+            self.submodules.interconnect = wishbone.Crossbar(self.masters, slaves, register=True)
+
+
+def measure(n, interconnect, length, burst_length, locality, seed=0):
+    dut = DUT(n, interconnect)
+    prng = random.Random(seed)
+    cycles = {"now": 0}
+    done = []
+
+    def master(i):
+        bursts = length//burst_length
+        for b in range(bursts):
+            sram = i if prng.random() < locality else prng.randrange(n)
+            # each master uses its own quarter of the SRAMs
+            adr = 0x400*sram + 0x100*i + (b*burst_length) % 0x100
+            datas = [prng.getrandbits(32) for j in range(burst_length)]
+            yield from dut.masters[i].write_burst(adr, datas)
+            assert (yield from dut.masters[i].read_burst(adr, burst_length)) == datas
+        done.append(cycles["now"])
+
+    @passive
+    def timer():
+        while True:
+            yield
+            cycles["now"] += 1
+
+    run_simulation(dut, [master(i) for i in range(n)] + [timer()])
+    return 2*n*length/max(done)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wishbone interconnect benchmark")
+    parser.add_argument("--length", default=512, type=int, help="words written by each master")
+    parser.add_argument("--burst-length", default=16, type=int, help="words per burst")
+    parser.add_argument("--locality", default=0.75, type=float,
+                        help="probability of a master accessing its own SRAM")
+    args = parser.parse_args()
+
+    for n in [2, 3, 4]:
+        for interconnect in ["shared", "crossbar"]:
+            bandwidth = measure(n, interconnect, args.length, args.burst_length, args.locality)
+            print("{} masters, {}: {:.2f} words/cycle".format(n, interconnect, bandwidth))
+
+
+if __name__ == "__main__":
+    main()
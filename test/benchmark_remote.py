@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+# License: BSD
+
+"""Host tooling throughput benchmark
+
+Writes a memory region and reads it back through a RemoteClient connected to a RemoteServer,
+on a simulated link: an in-process SRAM model (CommSim) by default, or the UART bridge of a
+litex_sim model built with --with-uartbone. No board is needed.
+"""
+
+import time
+import random
+import argparse
+
+from litex.tools.litex_client import RemoteClient
+from litex.tools.litex_server import RemoteServer
+from litex.tools.remote.comm_sim import CommSim
+from litex.tools.remote.comm_uart import CommUART
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host tooling throughput benchmark")
+    parser.add_argument("--sim-port", default=None, type=int,
+                        help="TCP port of a litex_sim UART bridge (in-process SRAM model otherwise)")
+    parser.add_argument("--base", default="0x0", help="base address of the memory region")
+    parser.add_argument("--length", default=4096, type=int, help="length of the region, in words")
+    args = parser.parse_args()
+
+    if args.sim_port is None:
+        comm = CommSim(size=4*args.length)
+    else:
+        comm = CommUART("socket://localhost:{}".format(args.sim_port), max_length=255, window=4)
+    server = RemoteServer(comm, "localhost", 0)
+    server.open()
+    server.start()
+    client = RemoteClient(port=server.socket.getsockname()[1], csr_csv=None, csr_data_width=32)
+    client.open()
+
+    base = int(args.base, 0)
+    datas = [random.getrandbits(32) for i in range(args.length)]
+    for write in [True, False]:
+        start = time.perf_counter()
+        if write:
+            client.write(base, datas)
+            # writes are not acknowledged, wait for them with a read
+            client.read(base)
+        else:
+            assert client.read(base, args.length) == datas
+        elapsed = time.perf_counter() - start
+        print("{}: {:.1f} kB/s".format("write" if write else "read", 4*args.length/elapsed/1e3))
+    if args.sim_port is None:
+        print("{} simulated cycles".format(comm.stats["cycles"]))
+
+    client.close()
+    server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+# License: BSD
+
+"""UART bridge throughput benchmark
+
+Writes a memory region of the board and reads it back through the UART bridge, with the burst mode
+and with the 8 words frames and no pipelining of the previous versions, and compares the measured
+throughput to the limit set by the baudrate (8N1 characters and frame headers).
+"""
+
+import time
+import random
+import argparse
+
+from litex.tools.remote.comm_uart import CommUART
+
+
+def limit(baudrate, max_length, write):
+    # writes send a header with each frame, read replies are headerless and their requests are sent
+    # on the other direction of the link
+    header = 6 if write else 0
+    return baudrate/10*4*max_length/(header + 4*max_length)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UART bridge throughput benchmark")
+    parser.add_argument("--port", required=True, help="UART port")
+    parser.add_argument("--baudrate", default=115200, type=int, help="UART baudrate")
+    parser.add_argument("--base", default="0x40000000", help="base address of the memory region")
+    parser.add_argument("--length", default=4096, type=int, help="length of the region, in words")
+    args = parser.parse_args()
+
+    base = int(args.base, 0)
+    datas = [random.getrandbits(32) for i in range(args.length)]
+    for name, max_length, window in [("burst", 255, 4), ("8 words frames", 8, 1)]:
+        comm = CommUART(args.port, args.baudrate, max_length=max_length, window=window)
+        comm.open()
+        for write in [True, False]:
+            start = time.perf_counter()
+            if write:
+                comm.write_block(base, datas)
+            else:
+                assert comm.read_block(base, args.length) == datas
+            rate = 4*args.length/(time.perf_counter() - start)
+            print("{} {}: {:.1f} kB/s, {:.0f}% of the {:.1f} kB/s limit".format(name,
+                "write" if write else "read", rate/1e3,
+                100*rate/limit(args.baudrate, max_length, write),
+                limit(args.baudrate, max_length, write)/1e3))
+        comm.close()
+
+
+if __name__ == "__main__":
+    main()
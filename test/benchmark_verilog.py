@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+# License: BSD
+
+"""Verilog conversion benchmark on a full SoCCore or a synthetic design
+
+Times the analysis of the lowered fragment shared by the Verilog printers against the Migen
+helpers it replaces (list_signals, list_targets, group_by_targets), then complete conversions with
+both combinatorial printers, with the shared analysis and with the Migen helpers called by each
+printer as before, and checks that both give the same Verilog. With ``--cores``, the design is
+made of that many synthetic cores (a register bank, a state machine and an output driven by
+several statements) instead of a SoCCore.
+"""
+
+import time
+import argparse
+
+from migen import *
+from migen.genlib.fsm import FSM, NextState, NextValue
+from migen.fhdl.structure import DUID
+from migen.fhdl.tools import list_signals, list_targets, list_special_ios, group_by_targets
+from migen.util.misc import flat_iteration
+
+from litex.boards.platforms import arty
+from litex.soc.integration.soc_core import SoCCore
+from litex.gen.fhdl import verilog
+
+
+class SyntheticCore(Module):
+    def __init__(self, width=16, nregs=8):
+        self.sink = Signal(width)
+        self.source = Signal(width)
+        self.enable = Signal()
+        self.adr = Signal(max=nregs)
+        self.we = Signal()
+
+        # # #
+
+        # register bank, written and read back through an address decoder
+        regs = [Signal(width) for i in range(nregs)]
+        for i, reg in enumerate(regs):
+            self.sync += If(self.we & (self.adr == i), reg.eq(self.sink))
+        readback = Signal(width)
+        self.comb += Case(self.adr, {i: readback.eq(reg) for i, reg in enumerate(regs)})
+
+        # state machine driving several signals from each state
+        counter = Signal(width)
+        valid = Signal()
+        ready = Signal()
+        busy = Signal()
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+        fsm.act("IDLE",
+            ready.eq(1),
+            If(self.enable,
+                NextValue(counter, 0),
+                NextState("RUN")
+            )
+        )
+        fsm.act("RUN",
+            busy.eq(1),
+            valid.eq(counter[0]),
+            NextValue(counter, counter + 1),
+            If(counter[-1], NextState("DONE"))
+        )
+        fsm.act("DONE",
+            valid.eq(1),
+            ready.eq(self.we),
+            If(self.we, NextState("IDLE"))
+        )
+
+        # output driven by several statements
+        self.comb += [
+            self.source.eq(readback),
+            If(valid, self.source.eq(counter)),
+            If(busy & ready, self.source.eq(0))
+        ]
+
+
+class SyntheticDesign(Module):
+    def __init__(self, n):
+        self.clock_domains.cd_sys = ClockDomain("sys")
+        previous = Signal(16)
+        adr = Signal(3)
+        we = Signal()
+        self.io = {previous, adr, we}
+        for i in range(n):
+            core = SyntheticCore()
+            self.submodules += core
+            self.comb += [
+                core.sink.eq(previous),
+                core.enable.eq(previous[i % 16]),
+                core.adr.eq(adr),
+                core.we.eq(we)
+            ]
+            previous = core.source
+        self.io.add(previous)
+
+
+class LegacyAnalysis:
+    """Analysis recomputed with the Migen helpers on each access, as done by the printers before
+    _FragmentAnalysis"""
+    node_targets = None
+
+    def __init__(self, f):
+        self.f = f
+
+    @property
+    def signals(self):
+        return list_signals(self.f) | list_special_ios(self.f, True, True, True)
+
+    @property
+    def targets(self):
+        return list_targets(self.f) | list_special_ios(self.f, False, True, True)
+
+    @property
+    def inouts(self):
+        return list_special_ios(self.f, False, False, True)
+
+    @property
+    def wires(self):
+        r = list_special_ios(self.f, False, True, True)
+        for targets, statements in group_by_targets(self.f.comb):
+            if len(statements) == 1 and isinstance(statements[0], verilog._Assign):
+                r |= targets
+        return r
+
+    @property
+    def groups(self):
+        return group_by_targets(self.f.comb)
+
+    @property
+    def target_statements(self):
+        target_statements = dict()
+        for statement in flat_iteration(self.f.comb):
+            for t in list_targets(statement):
+                target_statements.setdefault(t, []).append(statement)
+        return target_statements
+
+
+def get_synthetic_fragment(n):
+    design = SyntheticDesign(n)
+    return design, design.get_fragment()
+
+
+def get_fragment(cpu_type):
+    platform = arty.Platform()
+    soc = SoCCore(platform, clk_freq=int(100e6), cpu_type=cpu_type,
+        integrated_rom_size=0x8000,
+        integrated_main_ram_size=0x4000)
+    fragment = soc.get_fragment()
+    platform.finalize(fragment)
+    return platform, fragment
+
+
+def legacy_analysis(f):
+    analysis = LegacyAnalysis(f)
+    return analysis.signals, analysis.targets, analysis.groups, analysis.target_statements
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    r = fn(*args, **kwargs)
+    return r, time.perf_counter() - start
+
+
+def convert(args, regular_comb, legacy, duid):
+    # the design is rebuilt for each conversion, conversion lowers the fragment. Signals are
+    # hashed by duid: designs built from the same duid iterate their sets in the same order and
+    # give the same Verilog.
+    DUID._DUID__next_uid = duid
+    analysis = verilog._FragmentAnalysis
+    if legacy:
+        verilog._FragmentAnalysis = LegacyAnalysis
+    try:
+        if args.cores is None:
+            platform, fragment = get_fragment(args.cpu_type)
+            v, t = timed(platform.get_verilog, fragment, regular_comb=regular_comb)
+        else:
+            design, fragment = get_synthetic_fragment(args.cores)
+            v, t = timed(verilog.convert, fragment, design.io, regular_comb=regular_comb)
+    finally:
+        verilog._FragmentAnalysis = analysis
+    # skip the banner, it holds the date
+    return str(v).split("\n", 2)[2], t
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verilog conversion benchmark")
+    parser.add_argument("--cpu-type", default="vexriscv", help="CPU of the SoC")
+    parser.add_argument("--cores", default=None, type=int,
+                        help="number of cores of a synthetic design (SoCCore otherwise)")
+    args = parser.parse_args()
+
+    duid = DUID._DUID__next_uid
+    if args.cores is None:
+        platform, fragment = get_fragment(args.cpu_type)
+    else:
+        design, fragment = get_synthetic_fragment(args.cores)
+    f, _ = verilog._lower(fragment, dict())
+    print("{} combinatorial statements".format(len(list(flat_iteration(f.comb)))))
+
+    (signals, targets, groups, target_statements), legacy = timed(legacy_analysis, f)
+    analysis, shared = timed(verilog._FragmentAnalysis, f)
+    assert analysis.signals == signals
+    assert analysis.targets == targets
+    assert analysis.groups == groups
+    assert analysis.target_statements == target_statements
+    print("analysis: {:.3f}s with the Migen helpers, {:.3f}s shared".format(legacy, shared))
+
+    for regular_comb in [True, False]:
+        legacy_v, legacy_t = convert(args, regular_comb, legacy=True, duid=duid)
+        shared_v, shared_t = convert(args, regular_comb, legacy=False, duid=duid)
+        assert shared_v == legacy_v
+        print("conversion (regular_comb={}): {:.3f}s with the Migen helpers, {:.3f}s shared".format(
+            regular_comb, legacy_t, shared_t))
+
+
+if __name__ == "__main__":
+    main()
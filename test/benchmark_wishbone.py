@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+# License: BSD
+
+"""Wishbone burst benchmark
+
+Simulates reads and writes of a region of a Wishbone SRAM, directly, through a 64 to 32 bits
+down-converter and through a shared interconnect, with classic accesses and with incrementing
+bursts, and prints the words of the master transferred per cycle. Classic accesses give the
+throughput of the interconnect before burst support, the slaves treating bursts as classic
+accesses. The same accesses are then issued as pipelined requests, on a pipelined SRAM directly
+and through a pipelined shared interconnect.
+"""
+
+import argparse
+
+from migen import *
+
+from litex.soc.interconnect import wishbone
+
+
+class DirectDUT(Module):
+    def __init__(self):
+        self.submodules.sram = wishbone.SRAM(0x4000)
+        self.master = self.sram.bus
+
+
+class ConverterDUT(Module):
+    def __init__(self):
+        self.master = wishbone.Interface(data_width=64)
+        self.submodules.sram = wishbone.SRAM(0x4000)
+        self.submodules.converter = wishbone.Converter(self.master, self.sram.bus)
+
+
+class InterconnectDUT(Module):
+    def __init__(self):
+        self.master = wishbone.Interface()
+        self.submodules.sram = wishbone.SRAM(0x4000)
+        self.submodules.interconnect = wishbone.InterconnectShared([self.master],
+            [(lambda a: a[28:] == 0, self.sram.bus)], register=True)
+
+
+class PipelinedDirectDUT(Module):
+    def __init__(self):
+        self.submodules.sram = wishbone.PipelinedSRAM(0x4000)
+        self.master = self.sram.bus
+
+
+class PipelinedInterconnectDUT(Module):
+    def __init__(self):
+        self.master = wishbone.PipelinedInterface()
+        self.submodules.sram = wishbone.PipelinedSRAM(0x4000)
+        self.submodules.interconnect = wishbone.PipelinedInterconnectShared([self.master],
+            [(lambda a: a[28:] == 0, self.sram.bus)])
+
+
+def measure(dut, length, burst_length):
+    cycles = {"now": 0}
+
+    def generator():
+        datas = list(range(length))
+        for name in ["write", "read"]:
+            start = cycles["now"]
+            for adr in range(0, length, burst_length):
+                chunk = datas[adr:adr + burst_length]
+                if isinstance(dut.master, wishbone.PipelinedInterface):
+                    adrs = list(range(adr, adr + len(chunk)))
+                    if name == "write":
+                        yield from dut.master.write_pipelined(adrs, chunk)
+                    else:
+                        assert (yield from dut.master.read_pipelined(adrs)) == chunk
+                elif burst_length == 1:
+                    if name == "write":
+                        yield from dut.master.write(adr, chunk[0])
+                    else:
+                        assert (yield from dut.master.read(adr)) == chunk[0]
+                else:
+                    if name == "write":
+                        yield from dut.master.write_burst(adr, chunk)
+                    else:
+                        assert (yield from dut.master.read_burst(adr, len(chunk))) == chunk
+            cycles[name] = cycles["now"] - start
+
+    @passive
+    def timer():
+        while True:
+            yield
+            cycles["now"] += 1
+
+    run_simulation(dut, [generator(), timer()])
+    return cycles["write"], cycles["read"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wishbone burst benchmark")
+    parser.add_argument("--length", default=1024, type=int, help="words transferred")
+    parser.add_argument("--burst-length", default=16, type=int, help="words per burst")
+    args = parser.parse_args()
+
+    for name, dut in [("sram", DirectDUT), ("converter", ConverterDUT),
+                      ("interconnect", InterconnectDUT)]:
+        for mode, burst_length in [("classic", 1), ("burst", args.burst_length)]:
+            write, read = measure(dut(), args.length, burst_length)
+            print("{} {}: write {:.2f} words/cycle, read {:.2f} words/cycle".format(
+                name, mode, args.length/write, args.length/read))
+    for name, dut in [("pipelined sram", PipelinedDirectDUT),
+                      ("pipelined interconnect", PipelinedInterconnectDUT)]:
+        write, read = measure(dut(), args.length, args.burst_length)
+        print("{}: write {:.2f} words/cycle, read {:.2f} words/cycle".format(
+            name, args.length/write, args.length/read))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,8 @@ from migen import *
 
 from litex.soc.interconnect import csr
 from litex.soc.interconnect import csr_bus
+from litex.soc.interconnect import wishbone
+from litex.soc.interconnect.wishbone2csr import WB2CSR
 
 
 def csr32_write(dut, adr, dat):
@@ -122,3 +124,46 @@ class TestCSR(unittest.TestCase):
                 ]
         dut = DUT()
         run_simulation(dut, generator(dut))
+
+    def test_wb2csr(self):
+        class CSRModule(Module, csr.AutoCSR):
+            def __init__(self):
+                self._storage = csr.CSRStorage(32, reset=0x12345678, name="storage")
+                self._status = csr.CSRStatus(32, reset=0x5a5a5a5a, name="status")
+
+        class DUT(Module):
+            def __init__(self, data_width):
+                self.submodules.csrmodule = CSRModule()
+                self.submodules.wb2csr = WB2CSR(bus_csr=csr_bus.Interface(data_width=data_width))
+                self.submodules.csrbankarray = csr_bus.CSRBankArray(self,
+                    lambda name, memory: {"csrmodule": 0}[name], data_width=data_width)
+                self.submodules.csrcon = csr_bus.Interconnect(
+                    self.wb2csr.csr, self.csrbankarray.get_buses())
+
+        def generator(dut, data_width):
+            nwords = 32//data_width
+            bus = dut.wb2csr.wishbone
+            self.assertEqual((yield from bus.read(nwords)), 0x5a5a5a5a >> (32 - data_width))
+            # writes are acked in a cycle, reads in two
+            start = cycles["now"]
+            for i in range(nwords):
+                yield from bus.write(i, (0xdeadbeef >> (32 - data_width*(i + 1))) & (2**data_width - 1))
+            self.assertEqual(cycles["now"] - start, nwords)
+            start = cycles["now"]
+            value = 0
+            for i in range(nwords):
+                value = (value << data_width) | (yield from bus.read(i))
+            self.assertEqual(cycles["now"] - start, 2*nwords)
+            self.assertEqual(value, 0xdeadbeef)
+            self.assertEqual((yield dut.csrmodule._storage.storage), 0xdeadbeef)
+
+        @passive
+        def timer():
+            while True:
+                yield
+                cycles["now"] += 1
+
+        for data_width in [8, 32]:
+            cycles = {"now": 0}
+            dut = DUT(data_width)
+            run_simulation(dut, [generator(dut, data_width), timer()])
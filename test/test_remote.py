@@ -0,0 +1,526 @@
+# License: BSD
+
+import unittest
+import os
+import random
+import socket
+import struct
+import tempfile
+import threading
+
+from litex.tools.litex_client import RemoteClient
+from litex.tools.litex_server import RemoteServer
+from litex.tools.remote.etherbone import EtherbonePacket, EtherboneRecord
+from litex.tools.remote.etherbone import EtherboneReads, EtherboneIPC
+from litex.tools.remote.etherbone import PackedRecord, pack_packet, unpack_packet
+from litex.tools.remote.comm_uart import CommUART
+from litex.tools.remote.comm_pcie import CommPCIe
+from litex.tools.remote.comm_udp import CommUDP
+from litex.tools.remote.comm_usb import CommUSB, USBLoopback
+from litex.tools.remote.comm_sim import CommSim
+from litex.tools.remote.csr_builder import CSRBuilder, CSRCache
+
+
+class MemoryComm:
+    def __init__(self):
+        self.mem = {}
+        self.transactions = []
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def read(self, addr, length=None):
+        self.transactions.append(("read", addr, length))
+        datas = [self.mem.get(addr + 4*i, addr + 4*i) for i in range(1 if length is None else length)]
+        return datas[0] if length is None else datas
+
+    def write(self, addr, datas):
+        datas = datas if isinstance(datas, list) else [datas]
+        self.transactions.append(("write", addr, len(datas)))
+        for i, data in enumerate(datas):
+            self.mem[addr + 4*i] = data
+
+
+class UARTBridgeModel:
+    """Serial port connected to a model of the UART bridge, on top of a MemoryComm"""
+    def __init__(self, comm):
+        self.comm = comm
+        self.rx = bytearray()
+        self.tx = bytearray()
+        self.frames = []
+        self.requests = 0
+        self.replies = [] # read requests received when each reply is read
+
+    def write(self, data):
+        self.rx += data
+        while len(self.rx) >= 6:
+            cmd, length, addr = struct.unpack(">BBI", self.rx[:6])
+            if cmd == 0x01:
+                if len(self.rx) < 6 + 4*length:
+                    break
+                datas = list(struct.unpack(">{}I".format(length), self.rx[6:6 + 4*length]))
+                self.comm.write(4*addr, datas)
+                del self.rx[:6 + 4*length]
+            else:
+                datas = self.comm.read(4*addr, length)
+                self.tx += struct.pack(">{}I".format(length), *datas)
+                self.requests += 1
+                del self.rx[:6]
+            self.frames.append((cmd, length))
+        return len(data)
+
+    def read(self, length):
+        self.replies.append(self.requests)
+        data = bytes(self.tx[:length])
+        del self.tx[:length]
+        return data
+
+    def inWaiting(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+class UDPBridgeModel(threading.Thread):
+    """Etherbone UDP device on top of a MemoryComm, losing and reordering packets"""
+    def __init__(self, comm, reply_port, loss=0.0, seed=0):
+        threading.Thread.__init__(self, daemon=True)
+        self.comm = comm
+        self.reply_port = reply_port
+        self.loss = loss
+        self.prng = random.Random(seed)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("127.0.0.1", 0))
+        self.socket.settimeout(0.01)
+        self.port = self.socket.getsockname()[1]
+        self.stopped = threading.Event()
+        self.start()
+
+    def run(self):
+        held = None
+        while not self.stopped.is_set():
+            try:
+                packet, addr = self.socket.recvfrom(8192)
+            except socket.timeout:
+                continue
+            if self.prng.random() < self.loss:
+                continue
+            for record in unpack_packet(packet):
+                if len(record.writes):
+                    self.comm.write(record.base_addr, list(record.writes))
+                if len(record.reads):
+                    datas = [self.comm.read(addr) for addr in record.reads]
+                    reply = pack_packet([PackedRecord(base_addr=record.base_ret_addr, writes=datas)])
+                    if self.prng.random() < self.loss:
+                        continue
+                    # some replies are sent after the reply to the next packet
+                    if held is None and self.prng.random() < 0.1:
+                        held = reply
+                        continue
+                    self.socket.sendto(reply, ("127.0.0.1", self.reply_port))
+                    if held is not None:
+                        self.socket.sendto(held, ("127.0.0.1", self.reply_port))
+                        held = None
+
+    def close(self):
+        self.stopped.set()
+        self.join()
+        self.socket.close()
+
+
+class TestEtherbone(unittest.TestCase):
+    def test_codec(self):
+        records = [
+            PackedRecord(base_addr=0x100, writes=[1, 2, 0xffffffff]),
+            PackedRecord(base_ret_addr=0x200, reads=[0x10, 0x14], flags=0x10),
+            PackedRecord(base_addr=0x300, writes=[3], base_ret_addr=0x400, reads=[0x20]),
+        ]
+        data = pack_packet(records)
+        self.assertEqual(data[:12].hex(), "4e6f104400000000000f0300")
+        # compatibility classes
+        packet = EtherbonePacket(data)
+        packet.decode()
+        self.assertEqual(len(packet.records), 3)
+        self.assertEqual(packet.records[0].writes.get_datas(), [1, 2, 0xffffffff])
+        self.assertEqual(packet.records[1].reads.get_addrs(), [0x10, 0x14])
+        self.assertEqual(packet.records[1].cyc, 1)
+        self.assertEqual(packet.records[2].writes.base_addr, 0x300)
+        self.assertEqual(packet.records[2].reads.base_ret_addr, 0x400)
+        packet.encode()
+        self.assertEqual(bytes(packet), data)
+
+        record = EtherboneRecord()
+        record.reads = EtherboneReads(base_ret_addr=0x200, addrs=[0x10, 0x14])
+        record.cyc = 1
+        packet = EtherbonePacket()
+        packet.records = [record]
+        packet.encode()
+        decoded = unpack_packet(memoryview(bytes(packet)))
+        self.assertEqual(list(decoded[0].reads), [0x10, 0x14])
+        self.assertEqual(decoded[0].flags, 0x10)
+
+        with self.assertRaises(ValueError):
+            unpack_packet(data[:-1])
+
+
+class TestRemote(unittest.TestCase):
+    def setUp(self):
+        self.comm = MemoryComm()
+        self.server = RemoteServer(self.comm, "localhost", 0)
+        self.server.open()
+        self.server.start()
+        self.port = self.server.socket.getsockname()[1]
+        self.client = RemoteClient(port=self.port, csr_csv=None, csr_data_width=32)
+        self.client.open()
+        self.packets = 0
+        send_packet = self.client.send_packet
+        def counting_send_packet(*args):
+            self.packets += 1
+            send_packet(*args)
+        self.client.send_packet = counting_send_packet
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+
+    def test_read_write(self):
+        self.client.write(0x100, [1, 2, 3])
+        self.assertEqual(self.client.read(0x104), 2)
+        self.assertEqual(self.client.read(0x100, 4), [1, 2, 3, 0x10c])
+        # more than 255 words
+        self.client.write(0x1000, list(range(600)))
+        self.assertEqual(self.client.read(0x1000, 600), list(range(600)))
+
+    def test_batch(self):
+        prng = random.Random(42)
+        written = {}
+        reads = []
+        expected = []
+        self.packets = 0
+        with self.client.batch(window=4) as batch:
+            for i in range(2000):
+                addr = 4*prng.randrange(64)
+                if prng.randrange(4):
+                    reads.append(batch.read(addr))
+                    # reads see the writes queued before them
+                    expected.append(written.get(addr, addr))
+                else:
+                    batch.write(addr, i)
+                    written[addr] = i
+        self.assertEqual([read.result() for read in reads], expected)
+        self.assertLess(self.packets, 600)
+
+        batch = self.client.batch()
+        batch.read(0x1000, 300)
+        read = batch.read(0x2000)
+        with self.assertRaises(ValueError):
+            read.result()
+        results = batch.flush()
+        self.assertEqual(results, [[0x1000 + 4*i for i in range(300)], 0x2000])
+        self.assertEqual(read.result(), 0x2000)
+
+    def test_clients(self):
+        errors = []
+        def client_thread(n):
+            client = RemoteClient(port=self.port, csr_csv=None, csr_data_width=32)
+            client.open()
+            base = 0x10000*(n + 1)
+            for i in range(20):
+                with client.batch() as batch:
+                    batch.write(base, [i]*8)
+                    reads = [batch.read(base + 4*j) for j in range(8)]
+                if [read.result() for read in reads] != [i]*8:
+                    errors.append(n)
+            client.close()
+        threads = [threading.Thread(target=client_thread, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_records(self):
+        # every record of a packet is processed, with a reply per record with reads
+        s = socket.create_connection(("localhost", self.port))
+        s.sendall(pack_packet([
+            PackedRecord(base_addr=0x100, writes=[5, 6]),
+            PackedRecord(reads=[0x100]),
+            PackedRecord(base_addr=0x200, writes=[7], reads=[0x104, 0x200]),
+        ]))
+        replies = [unpack_packet(self.client.receive_packet(s)) for i in range(2)]
+        s.close()
+        self.assertEqual([list(r[0].writes) for r in replies], [[5], [6, 7]])
+
+    def test_receive_packet(self):
+        a, b = socket.socketpair()
+        self.addCleanup(a.close)
+        self.addCleanup(b.close)
+        a.sendall(pack_packet([PackedRecord(base_addr=0x100, writes=[1, 2])]))
+        a.sendall(pack_packet([PackedRecord(base_addr=0x200, writes=[3]),
+            PackedRecord(base_addr=0x300, writes=[4])]))
+        ipc = EtherboneIPC()
+        self.assertEqual(list(unpack_packet(ipc.receive_packet(b))[0].writes), [1, 2])
+        self.assertEqual(list(unpack_packet(ipc.receive_packet(b))[0].writes), [3])
+        # the second record of a packet is not a packet
+        with self.assertRaises(ValueError):
+            ipc.receive_packet(b)
+
+    def test_coalescing(self):
+        records = [
+            PackedRecord(reads=[0x0, 0x4]),
+            PackedRecord(reads=[0x8]),
+            PackedRecord(base_addr=0x100, writes=[1], reads=[0x100]),
+            PackedRecord(reads=[0x104, 0x0]),
+        ]
+        results = self.server._execute(records)
+        self.assertEqual(results, [[0x0, 0x4], [0x8], [1], [0x104, 0x0]])
+        self.assertEqual(self.comm.transactions, [
+            ("read", 0x0, 3), ("write", 0x100, 1), ("read", 0x100, 2), ("read", 0x0, 1)])
+
+
+class TestCommUART(unittest.TestCase):
+    def test_bursts(self):
+        memory = MemoryComm()
+        comm = CommUART("loop://", max_length=255, window=3)
+        comm.port = model = UARTBridgeModel(memory)
+        datas = [random.getrandbits(32) for i in range(1000)]
+        comm.write_block(0x1000, datas)
+        self.assertEqual(model.frames, [(0x01, 255)]*3 + [(0x01, 235)])
+        self.assertEqual(comm.read_block(0x1000, 1000), datas)
+        self.assertEqual(model.frames[4:], [(0x02, 255)]*3 + [(0x02, 235)])
+        # up to 3 outstanding read requests
+        self.assertEqual(model.replies, [3, 4, 4, 4])
+        self.assertEqual(comm.read(0x1004), datas[1])
+        comm.write(0x1000, 5)
+        self.assertEqual(comm.read(0x1000, 2), [5, datas[1]])
+
+    def test_defaults(self):
+        # frames and requests supported by all bridges
+        memory = MemoryComm()
+        comm = CommUART("loop://")
+        comm.port = model = UARTBridgeModel(memory)
+        comm.write_block(0x1000, list(range(20)))
+        self.assertEqual(model.frames, [(0x01, 8), (0x01, 8), (0x01, 4)])
+        self.assertEqual(comm.read_block(0x1000, 20), list(range(20)))
+        # a single outstanding read request
+        self.assertEqual(model.replies, [1, 2, 3])
+
+
+class TestCommPCIe(unittest.TestCase):
+    def test_bar(self):
+        with tempfile.NamedTemporaryFile() as bar:
+            bar.write(bytes(4096))
+            bar.flush()
+            comm = CommPCIe(bar.name)
+            comm.open()
+            datas = [random.getrandbits(32) for i in range(1000)]
+            comm.write(0x10, datas)
+            self.assertEqual(comm.read(0x10, 1000), datas)
+            self.assertEqual(comm.read(0x14), datas[1])
+            # words are little-endian on the bus
+            comm.write(0x0, 0x12345678)
+            self.assertEqual(comm.mmap[0:4], bytes([0x78, 0x56, 0x34, 0x12]))
+            view = comm.view(0x10, 4)
+            comm.write(0x14, 5)
+            self.assertEqual(view[1], 5)
+            view[2] = 6
+            self.assertEqual(comm.read(0x18), 6)
+            view.release()
+            with self.assertRaises(ValueError):
+                comm.read(0x12)
+            comm.close()
+
+
+class TestCommUDP(unittest.TestCase):
+    def get_comm(self, loss, **kwargs):
+        comm = CommUDP("127.0.0.1", 0, **kwargs)
+        comm.open()
+        device = UDPBridgeModel(MemoryComm(), comm.rx_socket.getsockname()[1], loss)
+        comm.port = device.port
+        self.addCleanup(comm.close)
+        self.addCleanup(device.close)
+        return comm
+
+    def test_lossy(self):
+        comm = self.get_comm(loss=0.05, timeout=0.02, retries=20, write_acks=True)
+        datas = [random.getrandbits(32) for i in range(3000)]
+        comm.write(0x10000, datas)
+        self.assertEqual(comm.read(0x10000, 3000), datas)
+        self.assertEqual(comm.read(0x10004), datas[1])
+        self.assertGreater(comm.stats["retries"], 0)
+
+    def test_mtu(self):
+        comm = self.get_comm(loss=0.0, mtu=576)
+        self.assertEqual(comm.max_length, 131)
+        comm.write(0x0, list(range(300)))
+        self.assertEqual(comm.stats["packets"], 3)
+        self.assertEqual(comm.read(0x0, 300), list(range(300)))
+
+    def test_timeout(self):
+        comm = self.get_comm(loss=1.0, timeout=0.01, retries=2)
+        with self.assertRaises(TimeoutError):
+            comm.read(0x0)
+        self.assertEqual(comm.stats["packets"], 3)
+
+    def test_write_without_ack(self):
+        comm = self.get_comm(loss=1.0, timeout=0.01, retries=2)
+        # writes are not acknowledged nor resent by default
+        comm.write(0x0, [1, 2])
+        self.assertEqual(comm.stats["packets"], 1)
+        self.assertEqual(comm.stats["retries"], 0)
+
+    def test_stale_replies(self):
+        comm = self.get_comm(loss=0.0)
+        comm.write(0x0, [1, 2])
+        # replies not matching the tag and length of the next read, queued before it
+        stale = [PackedRecord(), PackedRecord(base_addr=1, writes=[3, 4])]
+        for record in stale:
+            comm.tx_socket.sendto(pack_packet([record]),
+                ("127.0.0.1", comm.rx_socket.getsockname()[1]))
+        self.assertEqual(comm.read(0x0), 1)
+        self.assertEqual(comm.stats["stale_replies"], 2)
+
+
+class TestCommUSB(unittest.TestCase):
+    def test_bursts(self):
+        device = USBLoopback()
+        comm = CommUSB(max_length=64, device=device)
+        comm.open()
+        datas = [random.getrandbits(32) for i in range(200)]
+        comm.write(0x10000, datas)
+        self.assertEqual(comm.read(0x10000, 200), datas)
+        self.assertEqual(comm.read(0x10004), datas[1])
+        self.assertEqual(device.transfers[:4],
+            [("write", 0x10000, 64), ("write", 0x10100, 64), ("write", 0x10200, 64),
+             ("write", 0x10300, 8)])
+        self.assertEqual(comm.stats["transfers"], 9)
+        self.assertEqual(comm.stats["bytes"], 2*800 + 4)
+        self.assertGreater(comm.throughput(), 0)
+
+    def test_retries(self):
+        device = USBLoopback(failures=3)
+        comm = CommUSB(max_retries=3, backoff=0, device=device)
+        comm.open()
+        comm.write(0x0, [1, 2])
+        self.assertEqual(comm.stats["retries"], 3)
+        self.assertEqual(comm.read(0x0, 2), [1, 2])
+        device.failures = 4
+        with self.assertRaises(IOError):
+            comm.read(0x0)
+
+    def test_lost_device(self):
+        class LostDeviceCommUSB(CommUSB):
+            finds = 0
+            def _find(self):
+                self.finds += 1
+                return False
+
+        comm = LostDeviceCommUSB(max_retries=3, backoff=0)
+        comm.dev = USBLoopback(failures=1)
+        with self.assertRaises(IOError):
+            comm.read(0x0)
+        # the device is looked for once per retry
+        self.assertEqual(comm.finds, 3)
+
+
+csr_csv = """\
+#--------------------------------------------------------------------------------
+# Auto-generated by Migen
+#--------------------------------------------------------------------------------
+csr_base,ctrl,0x00000000,,
+csr_base,timer0,0x00000800,,
+csr_register,ctrl_reset,0x00000000,1,rw
+csr_register,ctrl_scratch,0x00000004,4,rw
+csr_register,ctrl_bus_errors,0x00000014,4,ro
+csr_register,timer0_load,0x00000800,4,rw
+csr_register,timer0_reload,0x00000810,4,rw
+csr_register,timer0_update_value,0x00000820,1,rw
+csr_register,timer0_value,0x00000824,4,ro
+constant,config_csr_data_width,8,,
+"""
+
+
+class TestCSRCache(unittest.TestCase):
+    def setUp(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as f:
+            f.write(csr_csv)
+        self.addCleanup(os.remove, f.name)
+        self.comm = MemoryComm()
+        self.builder = CSRBuilder(self.comm, f.name)
+        self.cache = CSRCache(self.builder, self.comm, volatile=["timer0_update_value"])
+
+    def test_shadows(self):
+        self.cache.write("ctrl_scratch", 0x12345678)
+        self.assertEqual(self.builder.regs.ctrl_scratch.read(), 0x12345678)
+        del self.comm.transactions[:]
+        self.assertEqual(self.cache.read("ctrl_scratch"), 0x12345678)
+        self.assertEqual(self.comm.transactions, [])
+        # ro and volatile registers are read on the link
+        self.cache.read("ctrl_bus_errors")
+        self.cache.write("timer0_update_value", 1)
+        self.cache.read("timer0_update_value")
+        self.assertEqual(len(self.comm.transactions), 3)
+        self.assertEqual(self.cache.stats["hits"], 1)
+        self.assertEqual(self.cache.stats["misses"], 2)
+        self.cache.invalidate()
+        self.cache.read("ctrl_scratch")
+        self.assertEqual(self.cache.stats["misses"], 3)
+
+    def test_design_updates(self):
+        # rw registers not written through the cache are read on the link
+        self.comm.mem[0x10] = 0x78
+        self.assertEqual(self.cache.read("ctrl_scratch") & 0xff, 0x78)
+        self.comm.mem[0x10] = 0x79
+        self.assertEqual(self.cache.read("ctrl_scratch") & 0xff, 0x79)
+        self.assertEqual(self.cache.stats["hits"], 0)
+        self.cache.snapshot("ctrl")
+        self.assertEqual(self.cache.shadows, {})
+        self.assertNotIn("timer0_update_value", self.cache.snapshot("timer0"))
+
+    def test_read_many(self):
+        regs = self.builder.regs
+        values = self.cache.read_many(["timer0_value", "timer0_load", "ctrl_scratch",
+            regs.timer0_reload, "timer0_update_value", "ctrl_bus_errors"])
+        self.assertEqual(values, [regs.timer0_value.read(), regs.timer0_load.read(),
+            regs.ctrl_scratch.read(), regs.timer0_reload.read(), regs.timer0_update_value.read(),
+            regs.ctrl_bus_errors.read()])
+        # adjacent registers are read together
+        self.assertEqual(self.comm.transactions[:2], [("read", 0x4, 8), ("read", 0x800, 13)])
+        self.assertEqual(self.cache.stats["reads"], 2)
+
+    def test_snapshot(self):
+        values = self.cache.snapshot("timer0")
+        self.assertEqual(sorted(values.keys()), ["timer0_load", "timer0_reload", "timer0_value"])
+        self.assertEqual(values["timer0_value"], self.builder.regs.timer0_value.read())
+        self.assertEqual(self.comm.transactions[:2], [("read", 0x800, 8), ("read", 0x824, 4)])
+        self.assertEqual(len(self.cache.snapshot("ctrl")), 3)
+
+
+class TestCommSim(unittest.TestCase):
+    def test_stack(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as f:
+            f.write(csr_csv)
+        self.addCleanup(os.remove, f.name)
+        comm = CommSim(size=0x2000)
+        server = RemoteServer(comm, "localhost", 0)
+        server.open()
+        server.start()
+        self.addCleanup(server.close)
+        client = RemoteClient(port=server.socket.getsockname()[1], csr_csv=f.name)
+        client.open()
+        self.addCleanup(client.close)
+
+        datas = [random.getrandbits(32) for i in range(300)]
+        client.write(0x1000, datas)
+        self.assertEqual(client.read(0x1000, 300), datas)
+        self.assertEqual(comm.stats["writes"], 300)
+        self.assertGreaterEqual(comm.stats["cycles"], 2*600)
+        client.regs.ctrl_scratch.write(0x12345678)
+        self.assertEqual(client.read(0x4, 4), [0x12, 0x34, 0x56, 0x78])
+        cache = CSRCache(client)
+        self.assertEqual(cache.read("ctrl_scratch"), 0x12345678)
+        self.assertEqual(cache.snapshot("timer0")["timer0_load"], 0)
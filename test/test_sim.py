@@ -0,0 +1,324 @@
+# License: BSD
+
+import unittest
+import os
+import collections
+import gzip
+import tempfile
+import warnings
+
+from migen import *
+
+from litex.gen.sim import Simulator, run_simulation, Wait, WaitUntil
+from litex.gen.sim.lxw import read_lxw, lxw_to_vcd
+
+
+class SimDUT(Module):
+    def __init__(self):
+        self.counter = counter = Signal(8)
+        self.sync += counter.eq(counter + 1)
+
+        # signed arithmetic, slices and concatenations
+        self.acc = acc = Signal((12, True))
+        self.low = low = Signal(4)
+        self.cat = cat = Signal(6)
+        self.sync += [
+            acc.eq(acc - counter[0:3]),
+            low[1:3].eq(counter[4:6]),
+        ]
+        self.comb += cat.eq(Cat(counter[6:8], low))
+
+        # arrays on both sides of assignments
+        self.regs = regs = Array(Signal(8) for _ in range(4))
+        self.sel = sel = Signal(8)
+        self.sync += regs[counter[0:2]].eq(counter ^ 0x55)
+        self.comb += sel.eq(regs[counter[2:4]])
+
+        # case statement with default, large case (dispatched) and FSM
+        self.small = small = Signal(4)
+        self.large = large = Signal(8)
+        self.comb += [
+            Case(counter[0:2], {
+                0: small.eq(1),
+                1: small.eq(2),
+                "default": small.eq(15),
+            }),
+            Case(counter[0:4], {i: large.eq(i*7) for i in range(12)}),
+        ]
+        self.fsm_out = fsm_out = Signal()
+        self.submodules.fsm = fsm = FSM()
+        fsm.act("IDLE",
+            If(counter[2],
+                NextState("BUSY")
+            ).Elif(counter[3],
+                NextState("IDLE")
+            ).Else(
+                fsm_out.eq(1)
+            )
+        )
+        fsm.act("BUSY",
+            If(counter[1:3] == 0b11, NextState("IDLE"))
+        )
+
+        # memory (lowered to an array of signals)
+        self.specials.mem = mem = Memory(8, 16, init=[i*3 for i in range(16)])
+        self.specials.wrport = wrport = mem.get_port(write_capable=True)
+        self.specials.rdport = rdport = mem.get_port(async_read=True)
+        self.comb += [
+            wrport.adr.eq(counter[0:4]),
+            wrport.dat_w.eq(counter),
+            wrport.we.eq(counter[4]),
+            rdport.adr.eq(counter[1:5]),
+        ]
+
+        self.observed = [counter, acc, low, cat, sel, small, large, fsm_out, rdport.dat_r]
+
+
+def trace_generator(dut, trace, cycles):
+    for i in range(cycles):
+        trace.append((yield dut.observed))
+        if i == cycles//2:
+            yield dut.counter.eq(3)
+        yield
+
+
+class TestSim(unittest.TestCase):
+    def run_dut(self, **kwargs):
+        dut = SimDUT()
+        trace = []
+        run_simulation(dut, trace_generator(dut, trace, 300), **kwargs)
+        return trace
+
+    def test_compiled(self):
+        interpreted = self.run_dut()
+        compiled = self.run_dut(compiled=True)
+        self.assertEqual(interpreted, compiled)
+        # sanity check on the interpreter's results
+        self.assertEqual([t[0] for t in interpreted[:4]], [0, 1, 2, 3])
+
+    def test_comb_propagation(self):
+        class DUT(Module):
+            def __init__(self):
+                self.a = Signal(8)
+                self.b = Signal(8)
+                self.c = Signal(8)
+                self.d = Signal(8)
+                # declared against dependency order
+                self.comb += [
+                    self.d.eq(self.c + self.b),
+                    self.c.eq(self.b + 1),
+                    self.b.eq(self.a + 1),
+                ]
+                self.sync += self.a.eq(self.a + 1)
+
+        def generator(dut, trace):
+            for i in range(4):
+                trace.append((yield [dut.a, dut.b, dut.c, dut.d]))
+                yield
+            # combinatorially driven signals return to their driven value
+            yield dut.c.eq(0)
+            yield
+            trace.append((yield dut.c))
+
+        for compiled in [False, True]:
+            dut = DUT()
+            trace = []
+            run_simulation(dut, generator(dut, trace), compiled=compiled)
+            self.assertEqual(trace, [[i, i + 1, i + 2, 2*i + 3] for i in range(4)] + [7])
+
+    def test_comb_loops(self):
+        class DUT(Module):
+            def __init__(self):
+                self.a = Signal()
+                self.chain = Signal(4)
+                # loop between bits of a signal, settles
+                self.comb += [self.chain[i + 1].eq(self.chain[i]) for i in range(3)]
+                self.comb += self.chain[0].eq(self.a)
+                self.sync += self.a.eq(~self.a)
+
+        def generator(dut, trace):
+            for i in range(3):
+                trace.append((yield dut.chain))
+                yield
+
+        dut = DUT()
+        trace = []
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            run_simulation(dut, generator(dut, trace))
+        self.assertEqual(caught, [])
+        self.assertEqual(trace, [0b0000, 0b1111, 0b0000])
+
+        class DUT(Module):
+            def __init__(self):
+                self.a = Signal()
+                self.pair = Signal(2)
+                # loop between bits of a signal, settles but is reported
+                self.comb += [
+                    self.pair[0].eq(self.pair[1] & self.a),
+                    self.pair[1].eq(self.pair[0])
+                ]
+
+        with self.assertWarns(UserWarning):
+            run_simulation(DUT(), [])
+
+        class DUT(Module):
+            def __init__(self):
+                self.x = Signal()
+                self.comb += self.x.eq(~self.x)
+
+        with self.assertWarns(UserWarning):
+            with self.assertRaises(ValueError):
+                run_simulation(DUT(), [])
+
+    def test_memory(self):
+        class DUT(Module):
+            def __init__(self):
+                self.specials.mem = Memory(32, 1024, init=[0x01020304, 0x05060708])
+                self.specials.wrport = self.mem.get_port(write_capable=True, we_granularity=8,
+                                                       mode=READ_FIRST)
+                self.specials.rdport = self.mem.get_port(mode=WRITE_FIRST)
+                self.specials.asport = self.mem.get_port(async_read=True)
+
+        def generator(dut, trace):
+            # init data and bulk load
+            for adr in [0, 1, 2, 1000]:
+                trace.append((yield dut.mem[adr]))
+            # byte-granular writes through the write port
+            yield dut.wrport.adr.eq(1)
+            yield dut.wrport.dat_w.eq(0xaabbccdd)
+            yield dut.wrport.we.eq(0b0101)
+            yield dut.rdport.adr.eq(1)
+            yield dut.asport.adr.eq(1)
+            yield
+            yield dut.wrport.we.eq(0)
+            yield
+            # read-first write port returned the old data during the write
+            trace.append((yield dut.wrport.dat_r))
+            # write-first read port and asynchronous read port see the new data
+            trace.append((yield dut.rdport.dat_r))
+            trace.append((yield dut.asport.dat_r))
+            # generators write memories directly
+            yield dut.mem[3].eq(0x12345678)
+            yield dut.asport.adr.eq(3)
+            yield
+            trace.append((yield dut.asport.dat_r))
+
+        for compiled in [False, True]:
+            dut = DUT()
+            trace = []
+            with Simulator(dut, generator(dut, trace), compiled=compiled) as sim:
+                sim.load_memory(dut.mem, range(1000, 1024), 1000)
+                sim.run()
+            self.assertEqual(trace, [
+                0x01020304, 0x05060708, 0, 1000,
+                0x05060708,
+                0x05bb07dd, 0x05bb07dd,
+                0x12345678])
+
+    def test_vcd(self):
+        class DUT(Module):
+            def __init__(self):
+                self.counter = Signal(8, name="counter")
+                self.other = Signal(8, name="other")
+                self.sync += self.counter.eq(self.counter + 1)
+                self.sync += self.other.eq(self.other + 2)
+
+        def generator():
+            for i in range(20):
+                yield
+
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, "test.vcd.gz")
+            run_simulation(DUT(), generator(), vcd_name=filename,
+                vcd_options=dict(include=["counter", "sys_clk"], start=55, stop=105))
+            with gzip.open(filename, "rt") as f:
+                vcd = f.read()
+        self.assertIn("counter", vcd)
+        self.assertNotIn("other", vcd)
+        times = [int(line[1:]) for line in vcd.splitlines() if line.startswith("#")]
+        self.assertEqual((min(times), max(times)), (55, 105))
+        # initial dump at the start time, then one increment per clock cycle
+        values = [int(line[1:-2], 2) for line in vcd.splitlines() if line.startswith("b")]
+        self.assertEqual(values, list(range(5, 11)))
+
+    def test_lxw(self):
+        with tempfile.TemporaryDirectory() as d:
+            traces = []
+            for name in ["test.vcd", "test.lxw"]:
+                dut = SimDUT()
+                filename = os.path.join(d, name)
+                run_simulation(dut, trace_generator(dut, [], 300), vcd_name=filename,
+                    vcd_options=dict(start=1000, stop=2000))
+                if name.endswith(".lxw"):
+                    signals, timesteps, end = read_lxw(filename)
+                    self.assertEqual(end, 2000)
+                    lxw_to_vcd(filename, filename + ".vcd")
+                    filename += ".vcd"
+                # values of each signal at the end of each timestep
+                changes = collections.defaultdict(dict)
+                t = None
+                with open(filename) as f:
+                    for line in f:
+                        if line.startswith("#"):
+                            t = int(line[1:])
+                        elif line[0] in "01":
+                            changes[line[1:]][t] = int(line[0])
+                        elif line[0] == "b":
+                            value, code = line[1:].split()
+                            changes[code][t] = int(value, 2)
+                traces.append(changes)
+            self.assertEqual(traces[0], traces[1])
+
+    def test_wait(self):
+        class DUT(Module):
+            def __init__(self):
+                self.counter = Signal(8)
+                self.sync += self.counter.eq(self.counter + 1)
+                self.slow_counter = Signal(8)
+                self.sync.slow += self.slow_counter.eq(self.slow_counter + 1)
+
+        def generator(dut, trace, use_wait):
+            if use_wait:
+                yield Wait(10)
+            else:
+                for i in range(10):
+                    yield
+            trace.append((yield dut.counter))
+            if use_wait:
+                yield WaitUntil(dut.counter == 50)
+            else:
+                while not (yield dut.counter == 50):
+                    yield
+            trace.append((yield dut.counter))
+            # condition already true, no cycle elapses
+            if use_wait:
+                yield WaitUntil(dut.counter == 50)
+            else:
+                while not (yield dut.counter == 50):
+                    yield
+            trace.append((yield dut.counter))
+            yield
+            trace.append((yield dut.counter))
+
+        def slow_generator(dut, trace):
+            yield Wait(3)
+            trace.append((yield dut.slow_counter))
+
+        traces = []
+        for use_wait in [False, True]:
+            dut = DUT()
+            trace = []
+            generators = {
+                "sys":  generator(dut, trace, use_wait),
+                "slow": slow_generator(dut, trace),
+            }
+            with Simulator(dut, generators, clocks={"sys": 10, "slow": 37}) as sim:
+                sim.run()
+            traces.append(trace)
+        self.assertEqual(traces[0], traces[1])
+        self.assertEqual(traces[0], [10, 3, 50, 50, 51])
+        self.assertEqual(sim.stats["cycles"]["sys"], 52)
+        self.assertEqual(sim.stats["time"], 515)
+        # generators are not resumed while waiting
+        self.assertEqual(sim.stats["resumes"], 6)
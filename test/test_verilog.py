@@ -0,0 +1,83 @@
+# License: BSD
+
+import unittest
+import os
+import re
+import tempfile
+
+from migen import *
+
+from litex.gen.fhdl import verilog
+
+
+class Counter(Module):
+    def __init__(self, inc):
+        self.value = Signal(8, name="value")
+        self.next = Signal(8, name="next")
+        self.comb += self.next.eq(self.value + inc)
+        self.sync += self.value.eq(self.next)
+
+
+class Top(Module):
+    def __init__(self):
+        self.inc = Signal(8, name="inc")
+        self.out = Signal(8, name="out")
+        self.submodules.a = Counter(self.inc)
+        self.submodules.b = Counter(self.inc)
+        self.submodules.c = ClockDomainsRenamer("other")(Counter(self.inc))
+        self.specials.mem = Memory(8, 4, init=[1, 2, 3, 4])
+        port = self.mem.get_port(async_read=True)
+        self.specials += port
+        self.comb += [
+            port.adr.eq(self.a.value),
+            self.out.eq(self.a.value ^ self.b.value ^ self.c.value ^ port.dat_r),
+        ]
+        # driven from two levels of the hierarchy
+        self.flag = Signal(name="flag")
+        self.comb += self.flag.eq(1)
+        self.a.comb += If(self.a.value == 0, self.flag.eq(0))
+
+    def ios(self):
+        return {self.inc, self.out, self.flag}
+
+
+def modules(src):
+    return re.findall(r"^module (\w+)\(", src, re.MULTILINE)
+
+
+class TestVerilog(unittest.TestCase):
+    def test_hierarchical(self):
+        top = Top()
+        r = verilog.convert(top, top.ios(), hierarchical=True)
+        src = r.main_source
+        # identical submodules share a definition, the top-level module is emitted last
+        self.assertEqual(len(modules(src)), 2)
+        self.assertEqual(modules(src)[-1], "top")
+        self.assertEqual(len(re.findall(r"^top_\w+ (a|b|c)\($", src, re.MULTILINE)), 3)
+        # clocks are ports of the submodules
+        self.assertIn("(other_clk)", src)
+        self.assertIn("(sys_clk)", src)
+        # signals driven from several levels are driven from their common ancestor
+        self.assertIn("output reg flag", src)
+        self.assertEqual(len(r.data_files), 1)
+        self.assertEqual(r.ns.get_name(top.inc), "inc")
+        self.assertEqual(r.ns.get_name(top.a.next), "a/next")
+        # the flat conversion is still available
+        top = Top()
+        src = verilog.convert(top, top.ios()).main_source
+        self.assertEqual(modules(src), ["top"])
+
+    def test_name_cache(self):
+        with tempfile.TemporaryDirectory() as d:
+            sources = []
+            for i in range(2):
+                top = Top()
+                r = verilog.convert(top, top.ios(), hierarchical=True, name_cache_dir=d)
+                sources.append(r.main_source.split("\n", 3)[-1])
+            self.assertEqual(len(os.listdir(d)), 2)
+        self.assertEqual(sources[0], sources[1])
+
+    def test_requires_module(self):
+        top = Top()
+        with self.assertRaises(TypeError):
+            verilog.convert(top.get_fragment(), top.ios(), hierarchical=True)
@@ -0,0 +1,351 @@
+# License: BSD
+
+import random
+import unittest
+
+from migen import *
+
+from litex.soc.interconnect import wishbone
+from litex.soc.integration.common import mem_decoder
+
+
+class Timer:
+    """Cycles of the simulation"""
+    def __init__(self):
+        self.cycles = 0
+
+    @passive
+    def generator(self):
+        while True:
+            yield
+            self.cycles += 1
+
+
+class TestWishbone(unittest.TestCase):
+    def test_sram_burst(self):
+        dut = wishbone.SRAM(256)
+        timer = Timer()
+
+        def generator():
+            datas = [0x100 + i for i in range(16)]
+            start = timer.cycles
+            yield from dut.bus.write_burst(4, datas)
+            # one word per cycle after the first
+            self.assertLessEqual(timer.cycles - start, 17)
+            start = timer.cycles
+            self.assertEqual((yield from dut.bus.read_burst(4, 16)), datas)
+            self.assertLessEqual(timer.cycles - start, 17)
+            # wrapping bursts
+            self.assertEqual((yield from dut.bus.read_burst(6, 4, wishbone.BTE_WRAP_4)),
+                [0x102, 0x103, 0x100, 0x101])
+            yield from dut.bus.write_burst(13, [1, 2, 3, 4], bte=wishbone.BTE_WRAP_8)
+            self.assertEqual((yield from dut.bus.read_burst(8, 8)),
+                [4, 0x105, 0x106, 0x107, 0x108, 1, 2, 3])
+            # classic accesses
+            yield from dut.bus.write(0, 5)
+            self.assertEqual((yield from dut.bus.read(0)), 5)
+            self.assertEqual((yield from dut.bus.read(5)), 0x101)
+
+        run_simulation(dut, [generator(), timer.generator()])
+
+    def test_downconverter_burst(self):
+        class DUT(Module):
+            def __init__(self):
+                self.master = wishbone.Interface(data_width=64)
+                self.submodules.sram = wishbone.SRAM(256)
+                self.submodules.converter = wishbone.Converter(self.master, self.sram.bus)
+        dut = DUT()
+        timer = Timer()
+
+        def generator():
+            datas = [(0x200 + i) << 32 | (0x100 + i) for i in range(8)]
+            yield from dut.master.write_burst(2, datas)
+            start = timer.cycles
+            self.assertEqual((yield from dut.master.read_burst(2, 8)), datas)
+            # the slave burst continues over the master burst
+            self.assertLessEqual(timer.cycles - start, 2*8 + 2)
+            self.assertEqual((yield dut.sram.mem[4]), 0x100)
+            self.assertEqual((yield dut.sram.mem[5]), 0x200)
+            self.assertEqual((yield from dut.master.read(3)), datas[1])
+
+        run_simulation(dut, [generator(), timer.generator()])
+
+    def test_arbiter_burst(self):
+        class DUT(Module):
+            def __init__(self):
+                self.masters = [wishbone.Interface() for i in range(2)]
+                self.submodules.sram = wishbone.SRAM(256)
+                self.submodules.interconnect = wishbone.InterconnectShared(self.masters,
+                    [(lambda a: 1, self.sram.bus)])
+        dut = DUT()
+        timer = Timer()
+        ends = {}
+
+        def burst_master():
+            yield from dut.masters[0].write_burst(0, list(range(32)))
+            self.assertEqual((yield from dut.masters[0].read_burst(0, 32)), list(range(32)))
+            ends["burst"] = timer.cycles
+
+        def classic_master():
+            yield
+            yield
+            self.assertEqual((yield from dut.masters[1].read(3)), 3)
+            ends["classic"] = timer.cycles
+
+        run_simulation(dut, [burst_master(), classic_master(), timer.generator()])
+        # the grant is held for the burst
+        self.assertGreater(ends["classic"], ends["burst"])
+
+    def test_cache_burst_refill(self):
+        class DUT(Module):
+            def __init__(self):
+                self.master = wishbone.Interface(data_width=128)
+                self.submodules.sram = wishbone.SRAM(1024)
+                self.submodules.cache = wishbone.Cache(16, self.master, self.sram.bus)
+        dut = DUT()
+
+        def generator():
+            for i in range(256):
+                yield dut.sram.mem[i].eq(i)
+            # lines are initially tagged 0
+            for adr in [16, 19, 24, 17]:
+                expected = sum((4*adr + i) << 32*i for i in range(4))
+                self.assertEqual((yield from dut.master.read(adr)), expected)
+            yield from dut.master.write(17, 0xaaaa)
+            # evicted by the line of adr 33
+            yield from dut.master.read(33)
+            self.assertEqual((yield dut.sram.mem[68]), 0xaaaa)
+            self.assertEqual((yield dut.sram.mem[69]), 0)
+
+        run_simulation(dut, generator())
+
+    def cache_test(self, ways=1, linesize=None, write_through=False):
+        class DUT(Module):
+            def __init__(self):
+                self.master = wishbone.Interface()
+                self.submodules.sram = wishbone.SRAM(1024)
+                self.submodules.cache = wishbone.Cache(32, self.master, self.sram.bus,
+                    ways=ways, linesize=linesize, write_through=write_through, with_csr=True)
+        dut = DUT()
+        prng = random.Random(42)
+
+        def generator():
+            reference = [prng.getrandbits(32) for i in range(128)]
+            for i, data in enumerate(reference):
+                yield dut.sram.mem[i].eq(data)
+            for i in range(200):
+                adr = prng.randrange(128)
+                if prng.random() < 0.4:
+                    data = prng.getrandbits(32)
+                    yield from dut.master.write(adr, data)
+                    reference[adr] = data
+                    if write_through:
+                        self.assertEqual((yield dut.sram.mem[adr]), data)
+                else:
+                    self.assertEqual((yield from dut.master.read(adr)), reference[adr])
+            yield
+            hits = yield dut.cache._hits.status
+            misses = yield dut.cache._misses.status
+            evictions = yield dut.cache._evictions.status
+            self.assertEqual(hits + misses, 200)
+            self.assertEqual(evictions == 0, write_through)
+            yield from dut.cache._clear.write(1)
+            yield
+            self.assertEqual((yield dut.cache._hits.status), 0)
+
+        run_simulation(dut, generator())
+
+    def test_cache_direct_mapped(self):
+        self.cache_test()
+
+    def test_cache_set_associative(self):
+        self.cache_test(ways=2, linesize=4)
+        self.cache_test(ways=4)
+        self.cache_test(ways=8, linesize=2)
+
+    def test_cache_write_through(self):
+        self.cache_test(ways=2, write_through=True)
+
+    def test_cache_ways(self):
+        class DUT(Module):
+            def __init__(self):
+                self.master = wishbone.Interface()
+                self.submodules.sram = wishbone.SRAM(1024)
+                self.submodules.cache = wishbone.Cache(32, self.master, self.sram.bus,
+                    ways=2, linesize=4, with_csr=True)
+        dut = DUT()
+
+        def generator():
+            # 4 sets of 4 words: lines of adr 0 and 16 share a set
+            for adr in [0, 16, 1, 17, 2, 18]:
+                yield from dut.master.read(adr)
+            yield
+            self.assertEqual((yield dut.cache._misses.status), 2)
+            self.assertEqual((yield dut.cache._hits.status), 4)
+            # the least recently used line of the set is replaced
+            yield from dut.master.read(0)
+            yield from dut.master.read(32)
+            yield from dut.master.read(1)
+            yield
+            self.assertEqual((yield dut.cache._misses.status), 3)
+            yield from dut.master.read(16)
+            yield
+            self.assertEqual((yield dut.cache._misses.status), 4)
+
+        run_simulation(dut, generator())
+
+    def test_pipelined_sram(self):
+        dut = wishbone.PipelinedSRAM(256)
+        timer = Timer()
+
+        def generator():
+            datas = [0x100 + i for i in range(16)]
+            adrs = [(7*i) % 64 for i in range(16)]
+            start = timer.cycles
+            yield from dut.bus.write_pipelined(adrs, datas)
+            # one word per cycle
+            self.assertLessEqual(timer.cycles - start, 16 + 2)
+            start = timer.cycles
+            self.assertEqual((yield from dut.bus.read_pipelined(adrs)), datas)
+            self.assertLessEqual(timer.cycles - start, 16 + 2)
+            yield from dut.bus.write(3, 5)
+            self.assertEqual((yield from dut.bus.read(3)), 5)
+
+        run_simulation(dut, [generator(), timer.generator()])
+
+    def test_pipelined_interconnect(self):
+        class DUT(Module):
+            def __init__(self):
+                self.masters = [wishbone.PipelinedInterface() for i in range(2)]
+                self.submodules.sram0 = wishbone.PipelinedSRAM(256)
+                self.submodules.sram1 = wishbone.PipelinedSRAM(256)
+                self.submodules.interconnect = wishbone.PipelinedInterconnectShared(self.masters, [
+                    (lambda a: a[8] == 0, self.sram0.bus),
+                    (lambda a: a[8] == 1, self.sram1.bus)])
+        dut = DUT()
+        timer = Timer()
+
+        def master(n):
+            adrs = [(0x100 if i % 4 == 3 else 0) + 32*n + i for i in range(32)]
+            datas = [(n << 16) + i for i in range(32)]
+            yield from dut.masters[n].write_pipelined(adrs, datas)
+            start = timer.cycles
+            self.assertEqual((yield from dut.masters[n].read_pipelined(adrs)), datas)
+            self.assertLessEqual(timer.cycles - start, 32 + 2*8 + 2)
+            self.assertEqual((yield from dut.masters[n].read(0x100 + 32*n + 3)), datas[3])
+
+        run_simulation(dut, [master(0), master(1), timer.generator()])
+
+    def test_pipelined_bridges(self):
+        class DUT(Module):
+            def __init__(self):
+                self.classic = wishbone.Interface()
+                self.submodules.pipelined_sram = wishbone.PipelinedSRAM(256)
+                self.submodules.classic_to_pipelined = wishbone.ClassicToPipelined(self.classic,
+                    self.pipelined_sram.bus)
+                self.pipelined = wishbone.PipelinedInterface()
+                self.submodules.classic_sram = wishbone.SRAM(256)
+                self.submodules.pipelined_to_classic = wishbone.PipelinedToClassic(self.pipelined,
+                    self.classic_sram.bus)
+        dut = DUT()
+
+        def classic_master():
+            for i in range(8):
+                yield from dut.classic.write(i, 0x100 + i)
+            for i in range(8):
+                self.assertEqual((yield from dut.classic.read(i)), 0x100 + i)
+            self.assertEqual((yield dut.pipelined_sram.mem[5]), 0x105)
+
+        def pipelined_master():
+            datas = [0x200 + i for i in range(8)]
+            yield from dut.pipelined.write_pipelined(list(range(8)), datas)
+            self.assertEqual((yield from dut.pipelined.read_pipelined(list(range(8)))), datas)
+            self.assertEqual((yield dut.classic_sram.mem[6]), 0x206)
+
+        run_simulation(dut, [classic_master(), pipelined_master()])
+
+    def test_minimal_decoder(self):
+        regions = [(0x00000000, 0x8000), (0x01000000, 0x1000), (0x40000000, 0x10000000),
+                   (0x82000000, 0x1000000)]
+        decoders = wishbone._minimal_decoders([mem_decoder(*region) for region in regions])
+        # bits 22, 23 and 28 of the word address tell the regions apart
+        self.assertEqual([sorted(decoder.bits) for decoder in decoders],
+            [[22, 23, 28], [22, 23, 28], [28], [22, 23, 28]])
+        self.assertRaises(ValueError, wishbone._minimal_decoders,
+            [mem_decoder(0x0, 0x2000), mem_decoder(0x1000, 0x1000)])
+        # decoders must describe their bits
+        self.assertRaises(ValueError, wishbone._minimal_decoders,
+            [mem_decoder(0x0, 0x1000), lambda a: a[28] == 1])
+
+        class DUT(Module):
+            def __init__(self):
+                self.master = wishbone.Interface()
+                self.srams = [wishbone.SRAM(256) for region in regions]
+                self.submodules += self.srams
+                self.submodules.decoder = wishbone.Decoder(self.master,
+                    [(mem_decoder(*region), sram.bus) for region, sram in zip(regions, self.srams)],
+                    minimal=True)
+        dut = DUT()
+
+        def generator():
+            for i, (origin, size) in enumerate(regions):
+                yield from dut.master.write(origin//4 + 1, i + 1)
+            for i, (origin, size) in enumerate(regions):
+                self.assertEqual((yield dut.srams[i].mem[1]), i + 1)
+                self.assertEqual((yield from dut.master.read(origin//4 + 1)), i + 1)
+
+        run_simulation(dut, generator())
+
+    def test_crossbar(self):
+        class DUT(Module):
+            def __init__(self, connectivity=None, minimal=False):
+                self.masters = [wishbone.Interface() for i in range(3)]
+                self.srams = [wishbone.SRAM(256) for i in range(2)]
+                self.submodules += self.srams
+                self.submodules.crossbar = wishbone.Crossbar(self.masters, [
+                    (mem_decoder(0x0000, 0x1000), self.srams[0].bus),
+                    (mem_decoder(0x1000, 0x1000), self.srams[1].bus)],
+                    connectivity=connectivity, minimal=minimal, timeout_cycles=16)
+        timer = Timer()
+
+        def master(dut, n, adr, ends):
+            datas = [(n << 8) + i for i in range(32)]
+            yield from dut.masters[n].write_burst(adr, datas)
+            self.assertEqual((yield from dut.masters[n].read_burst(adr, 32)), datas)
+            ends.append(timer.cycles)
+
+        # masters accessing different slaves are not serialized
+        dut = DUT()
+        ends = []
+        run_simulation(dut, [master(dut, 0, 0x000, ends), master(dut, 1, 0x400 + 64, ends),
+            timer.generator()])
+        self.assertLessEqual(max(ends), 2*(32 + 2))
+
+        # partial crossbar: master 2 is only connected to the second slave
+        dut = DUT(connectivity=[[0, 1], [0, 1], [1]])
+        ends = []
+
+        def generator():
+            # accesses to the first slave time out
+            yield from dut.masters[2].write(0x10, 0x1234)
+            self.assertEqual((yield from dut.masters[2].read(0x10)), 0xffffffff)
+            self.assertEqual((yield dut.srams[0].mem[0x10]), 0)
+            yield from master(dut, 2, 0x400, ends)
+
+        run_simulation(dut, generator())
+        self.assertEqual(len(ends), 1)
+
+        # minimal decoding keeps a master off the slaves it is not connected to
+        dut = DUT(connectivity=[[0, 1], [1], [1]], minimal=True)
+        ends = []
+
+        def generator():
+            yield from dut.masters[1].write(0x10, 0x1234)
+            self.assertEqual((yield from dut.masters[1].read(0x10)), 0xffffffff)
+            self.assertEqual((yield dut.srams[0].mem[0x10]), 0)
+            self.assertEqual((yield dut.srams[1].mem[0x10]), 0)
+            yield from master(dut, 1, 0x400, ends)
+            yield from master(dut, 0, 0x000, ends)
+
+        run_simulation(dut, generator())
+        self.assertEqual(len(ends), 2)
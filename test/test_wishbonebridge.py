@@ -0,0 +1,66 @@
+# License: BSD
+
+import unittest
+import struct
+
+from migen import *
+
+from litex.soc.interconnect import stream
+from litex.soc.interconnect import wishbone
+from litex.soc.interconnect.wishbonebridge import WishboneStreamingBridge
+
+
+class PHY(Module):
+    def __init__(self):
+        self.sink = stream.Endpoint([("data", 8)])
+        self.source = stream.Endpoint([("data", 8)])
+
+
+class DUT(Module):
+    def __init__(self):
+        self.submodules.phy = PHY()
+        self.submodules.bridge = WishboneStreamingBridge(self.phy, clk_freq=int(1e6))
+        self.submodules.sram = wishbone.SRAM(1024)
+        self.comb += self.bridge.wishbone.connect(self.sram.bus)
+
+
+def frame(cmd, addr, length, datas=[]):
+    return struct.pack(">BBI", cmd, length, addr) + struct.pack(">{}I".format(len(datas)), *datas)
+
+
+class TestWishboneStreamingBridge(unittest.TestCase):
+    def test_pipelined_frames(self):
+        datas = [0x01020304*(i + 1) & 0xffffffff for i in range(40)]
+        # frames of more than 8 words, read requests sent while the previous replies are sent
+        rx = (frame(0x01, 0x10, 40, datas) +
+              frame(0x02, 0x10, 20) +
+              frame(0x02, 0x24, 5) +
+              frame(0x02, 0x30, 8))
+        expected = struct.pack(">{}I".format(33), *(datas[:20] + datas[20:25] + datas[32:40]))
+        tx = []
+
+        def send(phy):
+            # the PHY does not wait for ready, like the RS232 PHY
+            for byte in rx:
+                yield phy.source.valid.eq(1)
+                yield phy.source.data.eq(byte)
+                yield
+                yield phy.source.valid.eq(0)
+                for i in range(3):
+                    yield
+
+        def receive(phy):
+            for cycle in range(20*len(rx) + 10*len(expected)):
+                if len(tx) == len(expected):
+                    break
+                yield phy.sink.ready.eq(1)
+                yield
+                if (yield phy.sink.valid):
+                    tx.append((yield phy.sink.data))
+                yield phy.sink.ready.eq(0)
+                for i in range(9):
+                    yield
+
+        dut = DUT()
+        run_simulation(dut, [send(dut.phy), receive(dut.phy)])
+        self.assertEqual(bytes(tx), expected)